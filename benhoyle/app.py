@@ -8,7 +8,10 @@ from benhoyle.extensions import (
     db,
     login_manager,
     cache,
-    debug_toolbar
+    debug_toolbar,
+    instrumentation,
+    metrics,
+    pragmas
 )
 
 from werkzeug.contrib.fixers import ProxyFix
@@ -58,9 +61,12 @@ def extensions(app):
     """
     csrf.init_app(app)
     db.init_app(app)
+    pragmas.init_app(app)
     login_manager.init_app(app)
     cache.init_app(app)
     debug_toolbar.init_app(app)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
 
     return None
 
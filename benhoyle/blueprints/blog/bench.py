@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from itertools import accumulate, product
+from multiprocessing.pool import ThreadPool
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from flask import url_for
+
+from config import settings
+
+from benhoyle.extensions import db
+
+from benhoyle.blueprints.blog.models import (
+    Post, Tag, Category, post_tag, post_category
+    )
+from benhoyle.blueprints.blog.static_export import POSTS_PER_PAGE
+from benhoyle.blueprints.blog.subsites import subsites as registry
+from benhoyle.blueprints.blog.wxr import WXRImporter
+
+# Settings of the apps being measured: their own database, page cache and
+# metrics so that a run never touches the site's
+BENCH_SETTINGS = {
+    'SQLALCHEMY_DATABASE_URI': settings.SQLALCHEMY_DATABASE_URI + '_bench',
+    'CACHE_DIR': settings.CACHE_DIR + '_bench',
+    'METRICS_PATH': settings.METRICS_PATH + '_bench',
+    'DEBUG_TB_ENABLED': False
+    }
+
+# Measures compared between runs, and whether a higher value is worse
+MEASURES = {'p50_ms': True, 'p99_ms': True, 'rps': False}
+
+# Made up words for the synthetic content, the first ones much the most
+# frequent as in real text
+WORDS = [
+    ''.join(syllables) for syllables in product(
+        ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'te', 'vo'],
+        ['ba', 'di', 'fo', 'gu', 'le', 'ma', 'po', 'ri'],
+        ['', 'n', 's', 'th', 'ck']
+        )
+    ]
+WORD_WEIGHTS = [1.0 / (rank + 1) for rank in range(len(WORDS))]
+# Running totals of the weights, to draw words from
+WORD_CUMULATIVE = list(accumulate(WORD_WEIGHTS))
+
+# Word used as the search term, the most frequent one
+SEARCH_WORD = WORDS[0]
+
+
+def _text(rng, words):
+    """ Paragraphs of words drawn from WORDS, as random.choices, which
+    needs Python 3.6, would draw them. """
+    total = WORD_CUMULATIVE[-1]
+    drawn = [
+        WORDS[bisect.bisect(WORD_CUMULATIVE, rng.random() * total)]
+        for _ in range(max(1, words))
+        ]
+    paragraphs = [
+        ' '.join(drawn[i:i + 80]).capitalize() + '.'
+        for i in range(0, len(drawn), 80)
+        ]
+    return '\n\n'.join(paragraphs)
+
+
+def seed(posts=1000, tags=200, categories=20, subsites=1,
+         content_words=600, random_seed=0):
+    """ Add synthetic posts, tags and categories to the database, through
+    the same bulk importer as WXR exports.
+
+    Each subsite gets posts posts published over the five years up to
+    2020, a tenth of them drafts. Content lengths vary around content_words the
+    way real posts do, a few much longer than the rest. Each post has up
+    to six tags and one or two categories.
+
+    :param posts: Posts per subsite
+    :param tags: Tags per subsite
+    :param categories: Categories per subsite
+    :param subsites: Number of subsites, named Bench1, Bench2, ...
+    :param content_words: Typical number of words in a post
+    :param random_seed: Seed, the same seed gives the same database
+    :return: Names of the subsites
+    """
+    rng = random.Random(random_seed)
+    end = datetime.datetime(2020, 1, 1)
+    names = ['Bench{0}'.format(i + 1) for i in range(subsites)]
+    tag_terms = [
+        ('tag-{0}'.format(i), 'Tag {0}'.format(i)) for i in range(tags)
+        ]
+    category_terms = [
+        ('category-{0}'.format(i), 'Category {0}'.format(i))
+        for i in range(categories)
+        ]
+
+    for subsite in names:
+        importer = WXRImporter(subsite)
+        importer.add_author({'login': 'bench', 'display_name': 'Bench'})
+        for i in range(posts):
+            published = end - datetime.timedelta(
+                seconds=rng.randint(0, 5 * 365 * 24 * 3600))
+            words = int(rng.lognormvariate(0, 0.6) * content_words)
+            importer.add_post({
+                'display_title': _text(rng, rng.randint(3, 9))[:-1],
+                'nicename': 'bench-post-{0}'.format(i),
+                'content': _text(rng, words),
+                'excerpt': _text(rng, 30),
+                'date_published': published,
+                'date_updated': published,
+                'status': 'draft' if rng.random() < 0.1 else 'publish',
+                'post_type': 'post',
+                'tags': rng.sample(
+                    tag_terms, min(len(tag_terms), rng.randint(0, 6))),
+                'categories': rng.sample(
+                    category_terms,
+                    min(len(category_terms), rng.randint(1, 2))),
+                'authors': ['bench']
+                })
+        importer.flush()
+    # The bulk inserts bypass the events that keep the subsites current in
+    # every worker
+    registry.invalidate()
+    return names
+
+
+def _most_used(model, association, key, subsite):
+    return db.session.query(model.nicename).join(
+        association, association.c[key] == model.id).filter(
+            model.subsite == subsite).group_by(model.id).order_by(
+                db.func.count().desc(), model.id).limit(1).scalar()
+
+
+def routes(subsite):
+    """ Return (name, url) of a page of each public route of the blog,
+    picking posts, tags and categories of subsite that exist.
+
+    Must be called in a request context so that URLs can be built.
+
+    :param subsite: Subsite to measure
+    :return: List of (name, url) tuples
+    """
+    published = Post.query.filter(Post.subsite == subsite).filter(
+        Post.status == "publish").order_by(Post.date_published.desc())
+    count = published.count()
+    post = published.offset(count // 2).first()
+    latest = published.first()
+    tag = _most_used(Tag, post_tag, 'tag_id', subsite)
+    category = _most_used(Category, post_category, 'category_id', subsite)
+
+    pages = [
+        ('index', url_for('blog.index')),
+        ('show_posts', url_for('blog.show_posts', subsite=subsite)),
+        ('archive', url_for('blog.archive', subsite=subsite)),
+        ('search', url_for(
+            'blog.search', subsite=subsite, q=SEARCH_WORD)),
+        ('subsite_feed', url_for('blog.subsite_feed', subsite=subsite)),
+        ('show_tags', url_for('blog.show_tags', subsite=subsite)),
+        ('tag_counts', url_for('blog.tag_counts', subsite=subsite)),
+        ('show_categories', url_for(
+            'blog.show_categories', subsite=subsite)),
+        ('category_counts', url_for(
+            'blog.category_counts', subsite=subsite)),
+        ('sitemap', url_for('blog.sitemap'))
+        ]
+    if count > POSTS_PER_PAGE:
+        pages.append(('show_posts_page_2', url_for(
+            'blog.show_posts', subsite=subsite, page=2)))
+    if post is not None:
+        pages.append(('post', url_for(
+            'blog.post', subsite=subsite, nicename=post.nicename)))
+    if latest is not None and latest.date_published is not None:
+        year = latest.date_published_year
+        month = latest.date_published_month
+        pages.append(('archive_year', url_for(
+            'blog.archive_posts', subsite=subsite, year=year)))
+        pages.append(('archive_month', url_for(
+            'blog.archive_posts', subsite=subsite, year=year, month=month)))
+    if tag is not None:
+        pages.append(('tag_postwall', url_for(
+            'blog.tag_postwall', subsite=subsite, tag_nicename=tag)))
+        pages.append(('tag_feed', url_for(
+            'blog.tag_feed', subsite=subsite, tag_nicename=tag)))
+    if category is not None:
+        pages.append(('category_postwall', url_for(
+            'blog.category_postwall', subsite=subsite,
+            category_nicename=category)))
+        pages.append(('category_feed', url_for(
+            'blog.category_feed', subsite=subsite,
+            category_nicename=category)))
+    return pages
+
+
+def percentile(latencies, q):
+    """ Nearest rank percentile of sorted latencies. """
+    if not latencies:
+        return None
+    rank = max(1, int(-(-q * len(latencies) // 100)))
+    return latencies[rank - 1]
+
+
+def measure(get, url, requests=100, warmup=5, concurrency=1):
+    """ Time requests for a page.
+
+    :param get: Function fetching a URL and returning its HTTP status
+    :param url: Page to fetch
+    :param requests: Number of timed requests
+    :param warmup: Requests made first and not timed, to fill caches
+    :param concurrency: Requests made at once
+    :return: Dict of the throughput in requests per second, the mean, p50
+             and p99 latencies in milliseconds and the non 2xx responses
+    """
+    for _ in range(warmup):
+        get(url)
+
+    def timed(_):
+        start = time.perf_counter()
+        status = get(url)
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        pool = ThreadPool(concurrency)
+        try:
+            results = pool.map(timed, range(requests))
+        finally:
+            pool.close()
+    else:
+        results = [timed(i) for i in range(requests)]
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, status in results)
+    return {
+        'requests': requests,
+        'errors': sum(1 for latency, status in results if status >= 300),
+        'rps': round(requests / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p99_ms': round(percentile(latencies, 99), 3)
+        }
+
+
+def client_getter(client):
+    """ get function for measure through a Flask test client. """
+    def get(url):
+        return client.get(url).status_code
+    return get
+
+
+def http_getter(base_url):
+    """ get function for measure over HTTP, e.g. against gunicorn. """
+    def get(url):
+        try:
+            response = urlopen(base_url + url)
+            response.read()
+            return response.getcode()
+        except HTTPError as e:
+            return e.code
+    return get
+
+
+def bench_app():
+    """ App for gunicorn to serve during a run, with BENCH_SETTINGS and any
+    overrides passed in the BENCH_SETTINGS environment variable. """
+    from benhoyle.app import create_app
+    overrides = dict(BENCH_SETTINGS)
+    overrides.update(json.loads(os.environ.get('BENCH_SETTINGS', '{}')))
+    return create_app(settings_override=overrides)
+
+
+def start_gunicorn(port=8001, workers=2, overrides=None, timeout=30):
+    """ Start gunicorn serving bench_app with config/gunicorn.py, waiting
+    until it answers.
+
+    :param port: Local port to bind
+    :param workers: Number of worker processes
+    :param overrides: Settings passed on to bench_app
+    :param timeout: Seconds to wait for it to start
+    :return: Tuple of (process, base URL)
+    """
+    environment = dict(
+        os.environ, BENCH_SETTINGS=json.dumps(overrides or {}))
+    process = subprocess.Popen([
+        sys.executable, '-m', 'gunicorn',
+        '-c', os.path.join(settings.BASE_DIR, 'config', 'gunicorn.py'),
+        '--bind', '127.0.0.1:{0}'.format(port),
+        '--workers', str(workers),
+        '--access-logfile', os.devnull,
+        'benhoyle.blueprints.blog.bench:bench_app()'
+        ], env=environment, cwd=settings.BASE_DIR)
+    base_url = 'http://127.0.0.1:{0}'.format(port)
+    get = http_getter(base_url)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            get('/')
+            return process, base_url
+        except IOError:
+            if process.poll() is not None or time.time() > deadline:
+                process.terminate()
+                raise RuntimeError('gunicorn did not start')
+            time.sleep(0.2)
+
+
+def run(get, pages, requests=100, warmup=5, concurrency=1):
+    """ Measure each page.
+
+    :return: Dict of the results of measure by route name
+    """
+    return dict(
+        (name, measure(get, url, requests, warmup, concurrency))
+        for name, url in pages
+        )
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, stderr=subprocess.STDOUT
+            ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results, **meta):
+    """ Results of a run with what is needed to compare it with others:
+    the commit, when it ran and how. """
+    meta.update(
+        commit=_commit(),
+        date=datetime.datetime.utcnow().isoformat() + 'Z'
+        )
+    return {'meta': meta, 'routes': results}
+
+
+def compare(baseline, current, threshold=0.1):
+    """ Find the routes that got slower than baseline by more than
+    threshold.
+
+    :param baseline: Report of an earlier run
+    :param current: Report of this run
+    :param threshold: Largest allowed change, as a fraction
+    :return: List of (route, measure, baseline value, current value,
+             change) tuples
+    """
+    regressions = []
+    for route, result in sorted(current['routes'].items()):
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+        for key, higher_is_worse in sorted(MEASURES.items()):
+            old, new = before.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = float(new - old) / old
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append((route, key, old, new, change))
+    return regressions
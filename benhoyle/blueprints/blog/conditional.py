@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+from functools import wraps
+
+from flask import g, request, make_response
+
+from benhoyle.blueprints.blog.page_cache import content_generation
+
+
+def validators(updated):
+    """ Return the weak ETag and Last-Modified time for a page whose
+    content last changed at updated.
+
+    The site wide content generation is folded in so that changes which
+    do not touch a post's date_updated (tag and category edits, deletes)
+    still change the validators.
+
+    :param updated: datetime the page's posts were last updated
+    :return: Tuple of (etag, last modified datetime)
+    """
+    token, generation_started = content_generation()
+    last_modified = max(updated, generation_started).replace(microsecond=0)
+    etag = hashlib.sha1(
+        '{0}|{1}'.format(token, updated.isoformat()).encode('utf-8')
+        ).hexdigest()
+    return etag, last_modified
+
+
+def not_modified(etag, last_modified):
+    """ Does the request already hold the current version of the page? """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def conditional(last_updated):
+    """ Answer conditional GETs from anonymous readers with 304 Not
+    Modified before the view runs its queries or renders anything.
+
+    :param last_updated: Function called with the view's arguments that
+                         returns when the page's content last changed, from
+                         a cheap indexed query, or None if it cannot tell
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if (
+                request.method != 'GET' or
+                (g.user is not None and g.user.is_authenticated)
+            ):
+                return f(*args, **kwargs)
+
+            updated = last_updated(*args, **kwargs)
+            if updated is None:
+                return f(*args, **kwargs)
+
+            etag, last_modified = validators(updated)
+            if not_modified(etag, last_modified):
+                response = make_response('', 304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            return response
+        return decorated_function
+    return decorator
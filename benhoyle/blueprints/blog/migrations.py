@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+
+from benhoyle.extensions import db
+
+# Import models so that every blog table is registered on the metadata
+from benhoyle.blueprints.blog.models import (
+    Post, PostBody, post_tag, post_category, post_author
+    )
+from benhoyle.blueprints.blog.rendering import excerpt_row
+from benhoyle.blueprints.blog import search
+
+
+def remove_duplicate_associations(connection):
+    """ Delete repeated rows from the association tables, keeping the
+    first, so that their unique indexes can be created.
+
+    :param connection: SQLAlchemy connection
+    :return: Number of rows deleted
+    """
+    deleted = 0
+    for table in [post_tag, post_category, post_author]:
+        left, right = [c.name for c in table.columns]
+        result = connection.execute(
+            "DELETE FROM {0} WHERE rowid NOT IN "
+            "(SELECT MIN(rowid) FROM {0} GROUP BY {1}, {2})".format(
+                table.name, left, right
+                )
+            )
+        deleted += result.rowcount
+    return deleted
+
+
+def missing_columns(engine):
+    """ Return the columns declared on the models but not in the database.
+
+    :param engine: SQLAlchemy engine
+    :return: List of SQLAlchemy Column objects
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = set(c['name'] for c in inspector.get_columns(table.name))
+        missing.extend(c for c in table.columns if c.name not in existing)
+    return missing
+
+
+def add_column(connection, column):
+    """ Add a nullable column to an existing table.
+
+    :param connection: SQLAlchemy connection
+    :param column: SQLAlchemy Column bound to its table
+    :return: None
+    """
+    connection.execute('ALTER TABLE {0} ADD COLUMN {1} {2}'.format(
+        column.table.name,
+        column.name,
+        column.type.compile(dialect=connection.dialect)
+        ))
+
+
+def backfill_archive_months(connection):
+    """ Fill in the year and month columns of posts published before they
+    were set, so that they appear in the archive.
+
+    :param connection: SQLAlchemy connection
+    :return: Number of posts updated
+    """
+    return connection.execute(
+        "UPDATE post SET "
+        "date_published_year = CAST(strftime('%Y', date_published) "
+        "AS INTEGER), "
+        "date_published_month = CAST(strftime('%m', date_published) "
+        "AS INTEGER) "
+        "WHERE date_published IS NOT NULL "
+        "AND (date_published_year IS NULL OR date_published_month IS NULL)"
+        ).rowcount
+
+
+# Columns of post that moved to post_body
+BODY_COLUMNS = ['content', 'content_html', 'content_hash']
+
+
+def rebuild_post_table(connection):
+    """ Rebuild the post table as the model declares it, dropping the
+    columns the model no longer has. SQLite only drops columns itself from
+    version 3.35, so the table is copied: a new table is created, filled
+    from the old one, which is dropped, and renamed into place.
+
+    The indexes go with the old table and are left to the upgrade to
+    create again, skipping any that duplicate rows prevent.
+
+    :param connection: SQLAlchemy connection
+    :return: None
+    """
+    table = Post.__table__
+    columns = ', '.join(c.name for c in table.columns)
+    create = str(CreateTable(table).compile(dialect=connection.dialect))
+    connection.execute(create.replace(
+        'CREATE TABLE {0} '.format(table.name),
+        'CREATE TABLE {0}_new '.format(table.name), 1))
+    connection.execute(
+        'INSERT INTO {0}_new ({1}) SELECT {1} FROM {0}'.format(
+            table.name, columns))
+    connection.execute('DROP TABLE {0}'.format(table.name))
+    connection.execute(
+        'ALTER TABLE {0}_new RENAME TO {0}'.format(table.name))
+
+
+def move_post_bodies(connection):
+    """ Move the bodies of posts out of the post table into post_body and
+    drop the columns that held them, so that post rows shrink to what
+    listings need. The full text index read them from post, so it is
+    rebuilt over both tables.
+
+    :param connection: SQLAlchemy connection
+    :return: Number of bodies moved, None if they had been moved already
+    """
+    columns = set(c['name'] for c in inspect(connection).get_columns('post'))
+    if 'content' not in columns:
+        return None
+    moved = connection.execute(
+        "INSERT INTO post_body (post_id, {0}) SELECT id, {1} FROM post "
+        "WHERE id NOT IN (SELECT post_id FROM post_body)".format(
+            ', '.join(BODY_COLUMNS),
+            ', '.join(c if c in columns else 'NULL' for c in BODY_COLUMNS)
+            )
+        ).rowcount
+    # The index, its view and triggers read the table being rebuilt
+    search.drop_index(connection)
+    rebuild_post_table(connection)
+    search.rebuild_index(connection)
+    return moved
+
+
+def backfill_excerpts(connection, force=False, batch_size=500):
+    """ Make the stored excerpts of posts saved before they were kept, in
+    batches of executemany updates.
+
+    :param connection: SQLAlchemy connection
+    :param force: Remake every post's excerpts, e.g. after changing how
+                  they are made
+    :param batch_size: Posts read and written at a time
+    :return: Number of posts updated
+    """
+    table = Post.__table__
+    update = table.update().where(
+        table.c.id == bindparam('b_id')).values(
+            excerpt_text=bindparam('excerpt_text'),
+            excerpt_html=bindparam('excerpt_html')
+            )
+    query = db.select([table.c.id]).order_by(table.c.id)
+    if not force:
+        query = query.where(table.c.excerpt_text.is_(None))
+    ids = [row[0] for row in connection.execute(query)]
+    body = PostBody.__table__
+
+    updated = 0
+    for start in range(0, len(ids), batch_size):
+        rows = connection.execute(db.select([
+            table.c.id, table.c.excerpt, body.c.content,
+            table.c.excerpt_text
+            ]).select_from(table.outerjoin(
+                body, body.c.post_id == table.c.id)).where(
+                    table.c.id.in_(ids[start:start + batch_size])))
+        values = [
+            row for row in (excerpt_row(tuple(r), force) for r in rows)
+            if row is not None
+            ]
+        if values:
+            connection.execute(update, values)
+        updated += len(values)
+    return updated
+
+
+def missing_indexes(engine):
+    """ Return the indexes declared on the models but not in the database.
+
+    :param engine: SQLAlchemy engine
+    :return: List of SQLAlchemy Index objects
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = set(ix['name'] for ix in inspector.get_indexes(table.name))
+        missing.extend(
+            index for index in sorted(table.indexes, key=lambda i: i.name)
+            if index.name not in existing
+            )
+    return missing
+
+
+def upgrade(engine=None):
+    """ Bring an existing SQLite database up to the current models.
+
+    Creates any missing tables, columns and indexes, moves post bodies to
+    their own table, fills in the columns derived from others, and builds
+    the full text index of posts if there is none yet. Unique indexes
+    that cannot be created because of duplicate rows are skipped and
+    reported rather than aborting the upgrade.
+
+    :param engine: SQLAlchemy engine, defaults to the app engine
+    :return: List of (step, outcome) tuples describing what was done
+    """
+    engine = engine or db.engine
+    steps = []
+
+    db.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        for column in missing_columns(engine):
+            add_column(connection, column)
+            steps.append(
+                ('{0}.{1}'.format(column.table.name, column.name), 'added')
+                )
+
+    with engine.begin() as connection:
+        moved = move_post_bodies(connection)
+    if moved is not None:
+        steps.append(('post_body', str(moved)))
+        # Hand back the pages the bodies took up in the post table
+        engine.execute('VACUUM')
+
+    with engine.begin() as connection:
+        backfilled = backfill_archive_months(connection)
+    if backfilled:
+        steps.append(('archive months', str(backfilled)))
+
+    with engine.begin() as connection:
+        backfilled = backfill_excerpts(connection)
+    if backfilled:
+        steps.append(('excerpts', str(backfilled)))
+
+    with engine.begin() as connection:
+        deleted = remove_duplicate_associations(connection)
+    if deleted:
+        steps.append(('remove duplicate associations', str(deleted)))
+
+    for index in missing_indexes(engine):
+        try:
+            index.create(bind=engine)
+            steps.append((index.name, 'created'))
+        except IntegrityError:
+            steps.append((index.name, 'skipped, duplicate rows'))
+
+    with engine.begin() as connection:
+        if not search.index_exists(connection):
+            search.rebuild_index(connection)
+            steps.append(('post_fts', 'created'))
+
+    return steps
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 
+from collections import namedtuple
 from datetime import datetime
 
-from benhoyle.extensions import db
+from benhoyle.extensions import db, cache
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
 
 import re
 
+from benhoyle.blueprints.blog.rendering import (
+    render_content, content_hash, make_excerpt
+    )
+
 # Import security helper functions
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -47,27 +56,94 @@ class Base(db.Model):
 post_tag = db.Table(
     'post_tag',
     db.Column('post_id', db.Integer, db.ForeignKey('post.id')),
-    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'))
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')),
+    # Association is looked up from both sides
+    db.Index('uq_post_tag_post_tag', 'post_id', 'tag_id', unique=True),
+    db.Index('ix_post_tag_tag_post', 'tag_id', 'post_id')
     )
 
 # Define post to category association table
 post_category = db.Table(
     'post_category',
     db.Column('post_id', db.Integer, db.ForeignKey('post.id')),
-    db.Column('category_id', db.Integer, db.ForeignKey('category.id'))
+    db.Column('category_id', db.Integer, db.ForeignKey('category.id')),
+    # Association is looked up from both sides
+    db.Index(
+        'uq_post_category_post_category',
+        'post_id', 'category_id', unique=True
+        ),
+    db.Index('ix_post_category_category_post', 'category_id', 'post_id')
     )
 
 # Define post to author association table
 post_author = db.Table(
     'post_author',
     db.Column('post_id', db.Integer, db.ForeignKey('post.id')),
-    db.Column('author_id', db.Integer, db.ForeignKey('author.id'))
+    db.Column('author_id', db.Integer, db.ForeignKey('author.id')),
+    # Association is looked up from both sides
+    db.Index(
+        'uq_post_author_post_author',
+        'post_id', 'author_id', unique=True
+        ),
+    db.Index('ix_post_author_author_post', 'author_id', 'post_id')
     )
 
 
+# A tag or category with the number of published posts it is on
+TermCount = namedtuple('TermCount', ['nicename', 'display_name', 'count'])
+
+
+def term_counts_key(model, subsite):
+    """ Cache key for the post counts of the tags or categories of
+    subsite. """
+    return 'term_counts/{0}/{1}'.format(model.__tablename__, subsite)
+
+
+def term_counts(model, association, subsite):
+    """ Return a TermCount for every tag or category of subsite, in
+    display name order, from a single GROUP BY over the association table.
+    The result is cached until a post, tag or category of the subsite is
+    written.
+
+    :param model: Tag or Category
+    :param association: post_tag or post_category
+    :param subsite: Subsite
+    :return: List of TermCount
+    """
+    key = term_counts_key(model, subsite)
+    counts = cache.get(key)
+    if counts is None:
+        term_id = [c for c in association.columns if c.name != 'post_id'][0]
+        counts = [
+            TermCount(*row) for row in db.session.query(
+                model.nicename,
+                model.display_name,
+                db.func.count(Post.id)).outerjoin(
+                    association, term_id == model.id).outerjoin(
+                        Post, db.and_(
+                            Post.id == association.c.post_id,
+                            Post.status == "publish"
+                            )).filter(
+                                model.subsite == subsite).group_by(
+                                    model.id).order_by(
+                                        model.display_name.asc())
+            ]
+        cache.set(key, counts)
+    return counts
+
+
 class Category(Base):
     """ Model for blog categories. """
     __tablename__ = "category"
+    __table_args__ = (
+        # Nicename lookups, with or without the subsite
+        db.Index('ix_category_nicename_subsite', 'nicename', 'subsite'),
+        # Alphabetical listing per subsite
+        db.Index(
+            'ix_category_subsite_display_name',
+            'subsite', 'display_name'
+            ),
+        )
     # Category name in lower case with spaces replaced by dashes
     nicename = db.Column(db.String(256))
     # Category name with spaces and capitals
@@ -91,6 +167,21 @@ class Category(Base):
         """ Return a category based on the nicename. """
         return Category.query.filter(Category.nicename == nicename).first()
 
+    @staticmethod
+    def last_post_update(subsite, nicename):
+        """ Return when a published post in the category last changed. """
+        return db.session.query(db.func.max(Post.date_updated)).join(
+            post_category, post_category.c.post_id == Post.id).join(
+                Category, Category.id == post_category.c.category_id).filter(
+                    Category.subsite == subsite).filter(
+                        Category.nicename == nicename).filter(
+                            Post.status == "publish").scalar()
+
+    @staticmethod
+    def post_counts(subsite):
+        """ Return a TermCount for each category of subsite. """
+        return term_counts(Category, post_category, subsite)
+
     def add_parent(self, parent_nicename):
         """ Adds parent category based on parent_nicename. """
         parent_category = Category.query.filter(
@@ -118,6 +209,12 @@ class Category(Base):
 class Tag(Base):
     """ Model for blog tags. """
     __tablename__ = "tag"
+    __table_args__ = (
+        # Nicename lookups, with or without the subsite
+        db.Index('ix_tag_nicename_subsite', 'nicename', 'subsite'),
+        # Alphabetical listing per subsite
+        db.Index('ix_tag_subsite_display_name', 'subsite', 'display_name'),
+        )
     # Tag name in lower case with spaces replaced by dashes
     nicename = db.Column(db.String(256))
     # Tag name with spaces and capitals
@@ -136,6 +233,21 @@ class Tag(Base):
         """ Return a category based on the nicename. """
         return Tag.query.filter(Tag.nicename == nicename).first()
 
+    @staticmethod
+    def last_post_update(subsite, nicename):
+        """ Return when a published post with the tag last changed. """
+        return db.session.query(db.func.max(Post.date_updated)).join(
+            post_tag, post_tag.c.post_id == Post.id).join(
+                Tag, Tag.id == post_tag.c.tag_id).filter(
+                    Tag.subsite == subsite).filter(
+                        Tag.nicename == nicename).filter(
+                            Post.status == "publish").scalar()
+
+    @staticmethod
+    def post_counts(subsite):
+        """ Return a TermCount for each tag of subsite. """
+        return term_counts(Tag, post_tag, subsite)
+
     @classmethod
     def get_tag_names(cls, subsite):
         """ Return list of tuples (nicename, display_name)
@@ -195,24 +307,88 @@ class Author(Base):
         self.password = generate_password_hash(password)
 
 
+class PostBody(db.Model):
+    """ Body of a blog post, kept out of the post row so that listings,
+    which never show it, scan small rows. """
+    __tablename__ = "post_body"
+    post_id = db.Column(
+        db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    content = db.Column(db.Text)
+    # Content rendered to HTML at save time and the hash it was made from
+    content_html = db.Column(db.Text)
+    content_hash = db.Column(db.String(40))
+
+
+def _body_attribute(name):
+    """ Property reading and writing a column of a post's body, adding the
+    body when first written. """
+    def get(self):
+        return getattr(self.body, name) if self.body is not None else None
+
+    def set(self, value):
+        if self.body is None:
+            self.body = PostBody()
+        setattr(self.body, name, value)
+    return property(get, set, doc="The {0} of the post's body.".format(name))
+
+
 class Post(Base):
     """ Model for blog post. """
     __tablename__ = "post"
+    __table_args__ = (
+        # A post is addressed by subsite and nicename
+        db.Index(
+            'uq_post_subsite_nicename',
+            'subsite', 'nicename', unique=True
+            ),
+        # Post walls filter on subsite and status and order by date
+        db.Index(
+            'ix_post_subsite_status_published',
+            'subsite', 'status', 'date_published'
+            ),
+        # Drafts and the sitemap order by date updated
+        db.Index(
+            'ix_post_subsite_status_updated',
+            'subsite', 'status', 'date_updated'
+            ),
+        # Archive summary and pages, in date order within a month
+        db.Index(
+            'ix_post_subsite_status_year_month',
+            'subsite', 'status', 'date_published_year',
+            'date_published_month', 'date_published'
+            ),
+        )
     display_title = db.Column(db.String(256))
     # Post name in lower case with spaces replaced by dashes
     nicename = db.Column(db.String(256))
-    content = db.Column(db.Text)
+    # Loaded only by the pages that show or edit it
+    body = db.relationship(
+        'PostBody', uselist=False, cascade='all, delete-orphan',
+        backref='post'
+        )
+    content = _body_attribute('content')
+    content_html = _body_attribute('content_html')
+    content_hash = _body_attribute('content_hash')
     # Short post summary for display
     excerpt = db.Column(db.Text)
+    # Plain text and HTML excerpts made from the excerpt, or the content
+    # if there is none, whenever either is saved
+    excerpt_text = db.Column(db.Text)
+    excerpt_html = db.Column(db.Text)
     # date post first published
     date_published = db.Column(db.DateTime)
     # Store year and month separately to allow for quick archive link
-    date_published_year = db.Column(db.Integer)
-    date_published_month = db.Column(db.Integer)
+    # (active_history: the update events below need the old value even
+    # when it was not loaded before the change)
+    date_published_year = db.column_property(
+        db.Column(db.Integer), active_history=True)
+    date_published_month = db.column_property(
+        db.Column(db.Integer), active_history=True)
     # date post updated
     date_updated = db.Column(db.DateTime)
     # status - draft = not public, publish = published on Internet
-    status = db.Column(db.String(25))
+    status = db.column_property(
+        db.Column(db.String(25)), active_history=True)
 
     authors = db.relationship(
                         'Author',
@@ -235,8 +411,55 @@ class Post(Base):
                         lazy='dynamic'
                         )
 
+    # Read only copies of the collections above that can be eager loaded
+    # for display - the dynamic relationships remain the write path
+    author_list = db.relationship(
+                        'Author',
+                        secondary=post_author,
+                        viewonly=True
+                        )
+
+    tag_list = db.relationship(
+                        'Tag',
+                        secondary=post_tag,
+                        viewonly=True
+                        )
+
+    category_list = db.relationship(
+                        'Category',
+                        secondary=post_category,
+                        viewonly=True
+                        )
+
     # subsite e.g. if importing multiple different blogs
-    subsite = db.Column(db.String(25))
+    subsite = db.column_property(
+        db.Column(db.String(25)), active_history=True)
+
+    @classmethod
+    def with_relations(cls):
+        """ Query for posts to show in full: the body is joined in, and
+        authors, tags and categories loaded in batched SELECT ... IN
+        queries rather than one query per access. """
+        return cls.query.options(
+            db.joinedload(cls.body),
+            db.selectinload(cls.author_list),
+            db.selectinload(cls.tag_list),
+            db.selectinload(cls.category_list)
+            )
+
+    @classmethod
+    def with_body(cls):
+        """ Query for posts with their bodies loaded in the same query. """
+        return cls.query.options(db.joinedload(cls.body))
+
+    @classmethod
+    def listing(cls, *criteria):
+        """ Query for just the columns a post wall shows, with the stored
+        excerpt, so that post bodies are never read. """
+        return db.session.query(
+            cls.id, cls.subsite, cls.nicename, cls.display_title,
+            cls.date_published, cls.date_updated, cls.excerpt_text
+            ).filter(*criteria)
 
     def make_nicename(self):
         """Generate the nicename from the display title"""
@@ -244,9 +467,73 @@ class Post(Base):
         self.nicename = re.sub(r'\s+', '-', no_punct)
 
     @staticmethod
-    def exists(nicename):
-        """ Check if a post with nicename already exists. """
-        return Post.query.filter(Post.nicename == nicename).count() > 0
+    def count_key(subsite, status):
+        """ Cache key for the number of posts in subsite with status. """
+        return 'post_count/{0}/{1}'.format(subsite, status)
+
+    @staticmethod
+    def count_by_status(subsite, status):
+        """ Return the number of posts in subsite with status. The count
+        is cached until a post is added to, removed from or changes status
+        within the subsite. """
+        key = Post.count_key(subsite, status)
+        count = cache.get(key)
+        if count is None:
+            count = Post.query.filter(
+                Post.subsite == subsite).filter(
+                    Post.status == status).count()
+            cache.set(key, count)
+        return count
+
+    @staticmethod
+    def archive_key(subsite):
+        """ Cache key for the archive summary of subsite. """
+        return 'archive/{0}'.format(subsite)
+
+    @staticmethod
+    def archive_summary(subsite):
+        """ Return (year, month, count) of the published posts of subsite
+        for each month with any, newest first, from one GROUP BY over the
+        (subsite, status, year, month) index. The summary is cached until
+        a post of the subsite is published, unpublished, moved or deleted.
+        """
+        key = Post.archive_key(subsite)
+        summary = cache.get(key)
+        if summary is None:
+            summary = [
+                tuple(row) for row in db.session.query(
+                    Post.date_published_year,
+                    Post.date_published_month,
+                    db.func.count(Post.id)).filter(
+                        Post.subsite == subsite).filter(
+                            Post.status == "publish").filter(
+                                Post.date_published_year.isnot(None)).group_by(
+                                    Post.date_published_year,
+                                    Post.date_published_month).order_by(
+                                        Post.date_published_year.desc(),
+                                        Post.date_published_month.desc())
+                ]
+            cache.set(key, summary)
+        return summary
+
+    @staticmethod
+    def last_updated(*criteria):
+        """ Return the latest date_updated of the posts matching criteria.
+        With subsite and status criteria this is read from the end of the
+        (subsite, status, date_updated) index. """
+        return db.session.query(
+            db.func.max(Post.date_updated)).filter(*criteria).scalar()
+
+    @staticmethod
+    def exists(nicename, subsite=None, exclude_id=None):
+        """ Check if a post with nicename already exists, optionally within
+        a subsite and ignoring the post with id exclude_id. """
+        query = Post.query.filter(Post.nicename == nicename)
+        if subsite is not None:
+            query = query.filter(Post.subsite == subsite)
+        if exclude_id is not None:
+            query = query.filter(Post.id != exclude_id)
+        return query.count() > 0
 
     def tag_by_nicename(self, tag_nicename):
         """ Add tag based on nicename. """
@@ -301,32 +588,237 @@ class Post(Base):
             self.authors.append(author)
             return self
 
+    def _set_terms(self, model, association, nicenames):
+        """ Make the post's tags or categories exactly those of its subsite
+        with nicenames. The nicenames are resolved in one IN query and
+        compared with the current association rows, and only the
+        difference is written, with one DELETE and one executemany INSERT.
+
+        :param model: Tag or Category
+        :param association: post_tag or post_category
+        :param nicenames: Nicenames of the terms the post should have
+        :return: Tuple of (number added, number removed)
+        """
+        if self.id is None:
+            db.session.flush()
+        term_id = [c for c in association.columns if c.name != 'post_id'][0]
+        wanted = set()
+        if nicenames:
+            wanted = set(row[0] for row in db.session.query(model.id).filter(
+                model.subsite == self.subsite).filter(
+                    model.nicename.in_(set(nicenames))))
+        current = set(row[0] for row in db.session.query(term_id).filter(
+            association.c.post_id == self.id))
+
+        removed = current - wanted
+        added = wanted - current
+        if removed:
+            db.session.execute(association.delete().where(
+                association.c.post_id == self.id).where(
+                    term_id.in_(removed)))
+        if added:
+            db.session.execute(association.insert(), [
+                {'post_id': self.id, term_id.name: ident} for ident in added
+                ])
+        if added or removed:
+            db.session.expire(self, ['tag_list', 'category_list'])
+            _stale(
+                object_session(self), term_counts_key(model, self.subsite))
+        return len(added), len(removed)
+
+    def set_tags(self, nicenames):
+        """ Make the post's tags exactly those with nicenames. """
+        return self._set_terms(Tag, post_tag, nicenames)
+
+    def set_categories(self, nicenames):
+        """ Make the post's categories exactly those with nicenames. """
+        return self._set_terms(Category, post_category, nicenames)
+
+    def render(self):
+        """ Render the content to HTML and record the hash of the content
+        it was rendered from. """
+        self.content_html = render_content(self.content or '')
+        self.content_hash = content_hash(self.content)
+        return self
+
+    def needs_render(self):
+        """ Is the stored HTML missing or stale? """
+        return (
+            self.content_html is None or
+            self.content_hash != content_hash(self.content)
+            )
+
+    def make_excerpts(self):
+        """ Make the plain text and HTML excerpts. """
+        self.excerpt_text, self.excerpt_html = make_excerpt(
+            self.excerpt, self.content)
+        return self
+
     def get_excerpt(self):
-        """ Return excerpt if exists; if not create from content. """
-        if self.excerpt:
-            if len(self.excerpt) > 1:
-                return self.excerpt
-        try:
-            return self.content.splitlines()[0] + "..."
-        except:
-            return None
+        """ Return the plain text excerpt, made from the content if the
+        post has no excerpt. """
+        if self.excerpt_text is None:
+            return make_excerpt(self.excerpt, self.content)[0]
+        return self.excerpt_text
 
     def get_tag_nicenames(self):
         """ Get nicenames of post tags. """
-        return [tag.nicename for tag in self.tags]
+        return [tag.nicename for tag in self.tag_list]
 
     def get_category_nicenames(self):
         """ Get nicenames of post categories. """
-        return [cat.nicename for cat in self.categories]
+        return [cat.nicename for cat in self.category_list]
 
     def get_tags(self):
         """ Get display names of post tags. """
-        return [tag.display_name for tag in self.tags]
+        return [tag.display_name for tag in self.tag_list]
 
     def get_categories(self):
         """ Get display names of post categories. """
-        return [cat.display_name for cat in self.categories]
+        return [cat.display_name for cat in self.category_list]
 
     def get_authors(self):
         """ Get a list of authors. """
-        return [author.display_name for author in self.authors]
+        return [author.display_name for author in self.author_list]
+
+
+def _stale(session, *keys):
+    """ Delete keys from the cache once session commits. Deleting them
+    during the flush would let a concurrent reader cache the old values
+    again before the change is visible, or leave them deleted for a change
+    that is rolled back. """
+    if session is not None and keys:
+        session.info.setdefault('stale_cache_keys', set()).update(keys)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _delete_stale_keys(session):
+    keys = session.info.pop('stale_cache_keys', None)
+    if keys:
+        cache.delete_many(*keys)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _keep_stale_keys(session):
+    session.info.pop('stale_cache_keys', None)
+
+
+def _previous_value(target, attribute):
+    """ Value of attribute before the pending change, if it changed. """
+    history = getattr(inspect(target).attrs, attribute).history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(target, attribute)
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _make_excerpts(session, flush_context, instances):
+    """ Remake the excerpts of posts whose excerpt or body changed. A body
+    is a separate row, so its post is not otherwise part of the flush. """
+    posts = set()
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, Post):
+            state = inspect(instance)
+            if (
+                state.pending or
+                state.attrs.excerpt.history.has_changes() or
+                instance.excerpt_text is None
+            ):
+                posts.add(instance)
+        elif isinstance(instance, PostBody) and instance.post is not None:
+            if (
+                inspect(instance).pending or
+                inspect(instance).attrs.content.history.has_changes()
+            ):
+                posts.add(instance.post)
+    for post in posts:
+        post.make_excerpts()
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _render_bodies(session, flush_context, instances):
+    """ Render bodies whose stored HTML is missing or stale as they are
+    saved, so that showing a post never has to write. """
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, PostBody) and (
+            instance.content_html is None or
+            instance.content_hash != content_hash(instance.content)
+        ):
+            instance.content_html = render_content(instance.content or '')
+            instance.content_hash = content_hash(instance.content)
+
+
+@event.listens_for(Post, 'after_insert')
+@event.listens_for(Post, 'after_delete')
+def _invalidate_count_on_insert_delete(mapper, connection, target):
+    _stale(
+        object_session(target), Post.count_key(target.subsite, target.status))
+
+
+@event.listens_for(Post, 'after_update')
+def _invalidate_count_on_update(mapper, connection, target):
+    old_key = Post.count_key(
+        _previous_value(target, 'subsite'),
+        _previous_value(target, 'status')
+        )
+    new_key = Post.count_key(target.subsite, target.status)
+    if old_key != new_key:
+        _stale(object_session(target), old_key, new_key)
+
+
+def _archive_month(target, value=getattr):
+    """ (subsite, year, month) a post counts towards in the archive, or
+    None if it is not published. """
+    if value(target, 'status') != "publish":
+        return None
+    return (
+        value(target, 'subsite'),
+        value(target, 'date_published_year'),
+        value(target, 'date_published_month')
+        )
+
+
+@event.listens_for(Post, 'after_insert')
+def _archive_on_insert(mapper, connection, target):
+    month = _archive_month(target)
+    if month:
+        _stale(object_session(target), Post.archive_key(month[0]))
+
+
+@event.listens_for(Post, 'after_delete')
+def _archive_on_delete(mapper, connection, target):
+    month = _archive_month(target, _previous_value)
+    if month:
+        _stale(object_session(target), Post.archive_key(month[0]))
+
+
+@event.listens_for(Post, 'after_update')
+def _archive_on_update(mapper, connection, target):
+    old_month = _archive_month(target, _previous_value)
+    new_month = _archive_month(target)
+    if old_month != new_month:
+        _stale(object_session(target), *[
+            Post.archive_key(month[0]) for month in (old_month, new_month)
+            if month
+            ])
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _invalidate_term_counts(session, flush_context):
+    """ Drop the cached tag and category counts of every subsite with a
+    post, tag or category written in the flush, once it commits. Tagging
+    a post marks the post (or the tag) as changed, so this covers tagging
+    changes too. """
+    keys = set()
+    for instance in set(session.new) | set(session.dirty) | set(
+        session.deleted
+    ):
+        if isinstance(instance, Post):
+            for subsite in set([
+                instance.subsite, _previous_value(instance, 'subsite')
+            ]):
+                keys.add(term_counts_key(Tag, subsite))
+                keys.add(term_counts_key(Category, subsite))
+        elif isinstance(instance, (Tag, Category)):
+            keys.add(term_counts_key(type(instance), instance.subsite))
+    _stale(session, *keys)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import uuid
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import g, request, session, make_response
+
+from benhoyle.extensions import cache
+
+# Key for the site wide content generation
+CONTENT_GENERATION_KEY = 'page_cache/content_generation'
+
+# Query string arguments that select a different page. Others are left
+# out of the page key, so that made up ones cannot fill the cache.
+PAGE_ARGS = ('after', 'before')
+
+
+def dependency_key(dependency):
+    """ Cache key holding the current generation of a dependency.
+
+    A dependency is a tuple naming something pages are built from, e.g.
+    ('post', subsite, nicename), ('tag', subsite, nicename) or
+    ('wall', subsite).
+    """
+    return 'page_dep/' + '/'.join(dependency)
+
+
+def page_key():
+    """ Cache key for the current request's page, from the endpoint, its
+    view arguments (subsite, nicename, page number...) and any PAGE_ARGS,
+    in a fixed order. """
+    view_args = sorted((request.view_args or {}).items())
+    page_args = [(k, request.args[k]) for k in PAGE_ARGS if k in request.args]
+    return 'page/{0}/{1}?{2}'.format(
+        request.endpoint, urlencode(view_args), urlencode(page_args))
+
+
+def generations(dependencies):
+    """ Return the current generation of each dependency, starting a new
+    generation for any that have none (never seen or evicted). """
+    keys = [dependency_key(d) for d in dependencies]
+    current = dict(zip(keys, cache.get_many(*keys))) if keys else {}
+    for key, value in current.items():
+        if value is None:
+            current[key] = uuid.uuid4().hex
+            cache.set(key, current[key], timeout=0)
+    return current
+
+
+def depends_on(*dependencies):
+    """ Record that the page being rendered is built from dependencies.
+
+    The generations are read now, before the page's own queries, so that
+    a write racing the render leaves the stored page already stale. """
+    if 'page_dependencies' in g:
+        g.page_dependencies.update(generations(dependencies))
+
+
+def content_generation():
+    """ Return the site wide content generation and when it started, as a
+    (token, datetime) tuple. Every invalidation starts a new generation. """
+    generation = cache.get(CONTENT_GENERATION_KEY)
+    if generation is None:
+        generation = _new_content_generation()
+    return generation
+
+
+def _new_content_generation():
+    generation = (uuid.uuid4().hex, datetime.datetime.now())
+    cache.set(CONTENT_GENERATION_KEY, generation, timeout=0)
+    return generation
+
+
+def invalidate(*dependencies):
+    """ Evict every cached page built from any of dependencies by moving
+    them to a new generation. """
+    for dependency in dependencies:
+        cache.set(dependency_key(dependency), uuid.uuid4().hex, timeout=0)
+    _new_content_generation()
+
+
+def post_dependencies(subsite, nicenames, tag_nicenames=(),
+                      category_nicenames=()):
+    """ Dependencies affected by adding, editing or deleting a post.
+
+    :param subsite: Subsite of the post
+    :param nicenames: Nicenames the post had and has
+    :param tag_nicenames: Tags the post had and has
+    :param category_nicenames: Categories the post had and has
+    :return: List of dependencies
+    """
+    dependencies = [
+        ('wall', subsite), ('tags', subsite), ('categories', subsite)
+        ]
+    dependencies.extend(('post', subsite, n) for n in set(nicenames))
+    dependencies.extend(('tag', subsite, n) for n in set(tag_nicenames))
+    dependencies.extend(
+        ('category', subsite, n) for n in set(category_nicenames)
+        )
+    return dependencies
+
+
+def _is_current(stored):
+    """ Are the dependency generations a page was built from current? """
+    keys = list(stored)
+    return bool(keys) and cache.get_many(*keys) == [stored[k] for k in keys]
+
+
+def cacheable():
+    """ Only anonymous GETs without pending flash messages are cached. """
+    return (
+        request.method == 'GET' and
+        not (g.user is not None and g.user.is_authenticated) and
+        '_flashes' not in session
+        )
+
+
+def cached_page(f):
+    """ Serve anonymous readers a cached copy of the page.
+
+    The view declares what the page is built from with depends_on. A
+    stored page is used only while all of those dependencies are still at
+    the generation they had when it was rendered, so invalidate evicts
+    exactly the pages built from the changed post, tag or category.
+
+    Responses say whether they were a hit in X-Cache, which the metrics
+    count, so a hit reads the cache and never writes to it.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not cacheable():
+            return f(*args, **kwargs)
+
+        key = page_key()
+        stored = cache.get(key)
+        if stored is not None and _is_current(stored['dependencies']):
+            response = make_response(stored['body'], stored['status'])
+            response.headers['Content-Type'] = stored['content_type']
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        g.page_dependencies = {}
+        try:
+            response = make_response(f(*args, **kwargs))
+        finally:
+            dependencies = g.pop('page_dependencies')
+        if (
+            response.status_code == 200 and
+            not response.is_streamed and
+            dependencies
+        ):
+            cache.set(key, {
+                'body': response.get_data(),
+                'status': response.status_code,
+                'content_type': response.headers['Content-Type'],
+                'dependencies': dependencies
+                })
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return decorated_function
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import datetime
+import json
+
+from sqlalchemy import and_, or_
+
+from werkzeug.exceptions import NotFound
+
+
+def encode_cursor(value, ident, page=None):
+    """ Encode a sort key into an opaque URL safe cursor.
+
+    :param value: Value of the ordering column, a datetime, number or None
+    :param ident: Row id, used as a tie breaker
+    :param page: Page number the cursor leads to, if known
+    :return: str
+    """
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, ident, page], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """ Decode a cursor made by encode_cursor, raising NotFound if it has
+    been tampered with.
+
+    :param cursor: Cursor string
+    :return: Tuple of (value, id, page)
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        value, ident, page = json.loads(raw.decode('utf-8'))
+        if isinstance(value, bool) or not (
+            value is None or isinstance(value, (str, int, float))
+        ):
+            raise TypeError(value)
+        if isinstance(value, str):
+            value = datetime.datetime.strptime(
+                value,
+                '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+                )
+        page = int(page) if page is not None else None
+        if page is not None and page < 1:
+            raise ValueError(page)
+        return value, int(ident), page
+    except (ValueError, TypeError, UnicodeError):
+        raise NotFound()
+
+
+def _seek_after(column, id_column, value, ident):
+    """ Rows following (value, ident) in descending order, nulls last. """
+    if value is None:
+        return and_(column.is_(None), id_column < ident)
+    return or_(
+        column < value,
+        and_(column == value, id_column < ident),
+        column.is_(None)
+        )
+
+
+def _seek_before(column, id_column, value, ident):
+    """ Rows preceding (value, ident) in descending order, nulls last. """
+    if value is None:
+        return or_(column.isnot(None), id_column > ident)
+    return or_(column > value, and_(column == value, id_column > ident))
+
+
+class KeysetPagination(object):
+    """ A page of results ordered newest first on (column, id), found by
+    seeking from the previous page's last row rather than with OFFSET.
+
+    Exposes the same has_prev/has_next/page/pages attributes as the
+    Flask-SQLAlchemy Pagination object plus the cursors for the pages
+    either side. """
+
+    def __init__(self, query, column, id_column, per_page,
+                 after=None, before=None, page=None, total=None):
+        self.query = query
+        self.column = column
+        self.id_column = id_column
+        self.per_page = per_page
+        self.total = total
+        self.page = page
+
+        if before is not None:
+            value, ident, self.page = decode_cursor(before)
+            rows = query.filter(
+                _seek_before(column, id_column, value, ident)).order_by(
+                    column.asc(), id_column.asc()).limit(per_page + 1).all()
+            self.has_prev = len(rows) > per_page
+            self.has_next = True
+            self.items = list(reversed(rows[:per_page]))
+        else:
+            if after is not None:
+                value, ident, self.page = decode_cursor(after)
+                query = query.filter(
+                    _seek_after(column, id_column, value, ident))
+            rows = query.order_by(
+                column.desc(), id_column.desc()).limit(per_page + 1).all()
+            self.has_prev = after is not None
+            self.has_next = len(rows) > per_page
+            self.items = rows[:per_page]
+
+    @property
+    def pages(self):
+        """ The total number of pages, if the total is known. """
+        if self.total is None:
+            return None
+        return max(1, -(-self.total // self.per_page))
+
+    def _cursor(self, item, page):
+        return encode_cursor(
+            getattr(item, self.column.key),
+            getattr(item, self.id_column.key),
+            page
+            )
+
+    @property
+    def next_cursor(self):
+        """ Cursor for the page of older results. """
+        if not self.has_next or not self.items:
+            return None
+        page = self.page + 1 if self.page else None
+        return self._cursor(self.items[-1], page)
+
+    @property
+    def prev_cursor(self):
+        """ Cursor for the page of newer results. """
+        if not self.has_prev or not self.items:
+            return None
+        page = self.page - 1 if self.page else None
+        return self._cursor(self.items[0], page)
+
+
+def paginate_keyset(query, column, id_column, per_page, page=1,
+                    after=None, before=None, total=None):
+    """ Paginate a query by keyset.
+
+    A cursor takes precedence over a page number. Page numbers are mapped
+    onto a cursor by reading only the sort key of the last row on the
+    preceding page, which the (…, column) indexes answer without touching
+    the table rows.
+
+    :param query: SQLAlchemy query for the rows to paginate
+    :param column: Column to order by, newest first
+    :param id_column: Unique column used as a tie breaker
+    :param per_page: Number of items per page
+    :param page: Page number, used when no cursor is given
+    :param after: Cursor of the row before the page
+    :param before: Cursor of the row after the page
+    :param total: Total number of rows, if known
+    :return: KeysetPagination
+    """
+    if after is None and before is None and page > 1:
+        boundary = query.with_entities(column, id_column).order_by(
+            column.desc(), id_column.desc()).offset(
+                (page - 1) * per_page - 1).limit(1).first()
+        if boundary is None:
+            raise NotFound()
+        after = encode_cursor(boundary[0], boundary[1], page)
+
+    pagination = KeysetPagination(
+        query, column, id_column, per_page,
+        after=after, before=before, page=page, total=total
+        )
+    if not pagination.items and (after or before):
+        raise NotFound()
+    return pagination
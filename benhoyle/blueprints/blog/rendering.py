@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from markupsafe import Markup
+
+# Bump when render_content changes so that stored renders become stale
+RENDERER_VERSION = 1
+
+# Longest plain text excerpt in characters, cut at a word boundary
+EXCERPT_LENGTH = 280
+
+
+def render_content(content):
+    """ Split into lines and format paragraphs """
+    output_lines = []
+    p_on = True
+    for line in content.strip().splitlines():
+        if len(line.strip()) > 0:
+            if line[0] == "<" and line[-1] == ">":
+                if "<pre>" in line:
+                    p_on = False
+                if "</pre>" in line:
+                    p_on = True
+                output_lines.append(line)
+            else:
+                if p_on:
+                    output_lines.append("<p>" + line.strip() + "</p>")
+                else:
+                    output_lines.append(line)
+    return "\n".join(output_lines)
+
+
+def content_hash(content):
+    """ Hash of the raw content and renderer version a render was made
+    from. """
+    digest = hashlib.sha1(str(RENDERER_VERSION).encode('utf-8'))
+    digest.update((content or '').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def render_row(row, force=False):
+    """ Render a (post id, content, stored hash) row for a bulk update.
+
+    Kept at module level so that it can be sent to a process pool.
+
+    :param row: Tuple of post id, raw content and stored content hash
+    :param force: Render even if the stored hash is current
+    :return: Dict of new column values or None if already current
+    """
+    ident, content, stored_hash = row
+    new_hash = content_hash(content)
+    if stored_hash == new_hash and not force:
+        return None
+    return {
+        'b_id': ident,
+        'content_html': render_content(content or ''),
+        'content_hash': new_hash
+        }
+
+
+def make_excerpt(excerpt, content):
+    """ Plain text and HTML excerpts of a post: its excerpt if it has one,
+    otherwise the start of its content, without markup and cut at a word
+    boundary.
+
+    Only the start of the content is read, however long it is.
+
+    :param excerpt: Excerpt written for the post, may be empty
+    :param content: Raw content
+    :return: Tuple of (plain text, HTML)
+    """
+    source = excerpt if excerpt and len(excerpt) > 1 else (content or '')
+    # Markup and whitespace only shrink the text, so a prefix is enough
+    prefix = source[:EXCERPT_LENGTH * 4]
+    text = ' '.join(Markup(prefix).striptags().split())
+    if len(text) > EXCERPT_LENGTH or len(source) > len(prefix):
+        cut = text.rfind(' ', 0, EXCERPT_LENGTH + 1)
+        text = text[:cut if cut > 0 else EXCERPT_LENGTH].rstrip(',.;:') + '…'
+    html = Markup('<p>{0}</p>').format(text) if text else Markup('')
+    return text, str(html)
+
+
+def excerpt_row(row, force=False):
+    """ Make the excerpts of a (post id, excerpt, content, stored plain
+    text excerpt) row for a bulk update.
+
+    :param row: Tuple of post id, excerpt, raw content and stored excerpt
+    :param force: Remake excerpts that are already stored
+    :return: Dict of new column values or None if already stored
+    """
+    ident, excerpt, content, stored = row
+    if stored is not None and not force:
+        return None
+    text, html = make_excerpt(excerpt, content)
+    return {'b_id': ident, 'excerpt_text': text, 'excerpt_html': html}
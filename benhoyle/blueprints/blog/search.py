@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import event, text
+
+from werkzeug.exceptions import NotFound
+
+from benhoyle.extensions import db
+
+from benhoyle.blueprints.blog.models import Post, PostBody
+from benhoyle.blueprints.blog.pagination import encode_cursor, decode_cursor
+
+# Column weights for bm25, a match in the title counts for the most
+WEIGHTS = (10.0, 5.0, 1.0)
+
+# Markers snippet() puts around matches, replaced with <mark> once the
+# snippet has been escaped
+START_MARK, END_MARK = '\x02', '\x03'
+
+# Words kept around the matches in a snippet
+SNIPPET_TOKENS = 32
+
+# The index holds no copy of the text: it reads it back by post id from a
+# view joining each post to its body. Posts and bodies are separate rows,
+# so each has triggers keeping the index entry of its post equal to the
+# view row, whichever of the two is written first.
+FTS_COLUMNS = "display_title, excerpt, content"
+
+CREATE_INDEX = [
+    "CREATE VIEW IF NOT EXISTS post_fts_source AS "
+    "SELECT post.id AS id, post.display_title AS display_title, "
+    "post.excerpt AS excerpt, post_body.content AS content "
+    "FROM post LEFT JOIN post_body ON post_body.post_id = post.id",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+    "{0}, content='post_fts_source', content_rowid='id')".format(FTS_COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post "
+    "BEGIN "
+    "INSERT INTO post_fts (rowid, {0}) "
+    "SELECT id, {0} FROM post_fts_source WHERE id = new.id; "
+    "END".format(FTS_COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post "
+    "BEGIN "
+    "INSERT INTO post_fts (post_fts, rowid, {0}) "
+    "VALUES ('delete', old.id, old.display_title, old.excerpt, "
+    "(SELECT content FROM post_body WHERE post_id = old.id)); "
+    "END".format(FTS_COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS post_fts_update "
+    "AFTER UPDATE OF display_title, excerpt ON post "
+    "BEGIN "
+    "INSERT INTO post_fts (post_fts, rowid, {0}) "
+    "VALUES ('delete', old.id, old.display_title, old.excerpt, "
+    "(SELECT content FROM post_body WHERE post_id = old.id)); "
+    "INSERT INTO post_fts (rowid, {0}) "
+    "SELECT id, {0} FROM post_fts_source WHERE id = new.id; "
+    "END".format(FTS_COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS post_fts_body_insert "
+    "AFTER INSERT ON post_body "
+    "BEGIN "
+    "INSERT INTO post_fts (post_fts, rowid, {0}) "
+    "SELECT 'delete', id, display_title, excerpt, NULL "
+    "FROM post WHERE id = new.post_id; "
+    "INSERT INTO post_fts (rowid, {0}) "
+    "SELECT id, {0} FROM post_fts_source WHERE id = new.post_id; "
+    "END".format(FTS_COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS post_fts_body_delete "
+    "AFTER DELETE ON post_body "
+    "BEGIN "
+    "INSERT INTO post_fts (post_fts, rowid, {0}) "
+    "SELECT 'delete', id, display_title, excerpt, old.content "
+    "FROM post WHERE id = old.post_id; "
+    "INSERT INTO post_fts (rowid, {0}) "
+    "SELECT id, display_title, excerpt, NULL "
+    "FROM post WHERE id = old.post_id; "
+    "END".format(FTS_COLUMNS),
+    "CREATE TRIGGER IF NOT EXISTS post_fts_body_update "
+    "AFTER UPDATE OF content ON post_body "
+    "BEGIN "
+    "INSERT INTO post_fts (post_fts, rowid, {0}) "
+    "SELECT 'delete', id, display_title, excerpt, old.content "
+    "FROM post WHERE id = old.post_id; "
+    "INSERT INTO post_fts (rowid, {0}) "
+    "SELECT id, {0} FROM post_fts_source WHERE id = new.post_id; "
+    "END".format(FTS_COLUMNS)
+    ]
+
+DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS post_fts_insert",
+    "DROP TRIGGER IF EXISTS post_fts_delete",
+    "DROP TRIGGER IF EXISTS post_fts_update",
+    "DROP TRIGGER IF EXISTS post_fts_body_insert",
+    "DROP TRIGGER IF EXISTS post_fts_body_delete",
+    "DROP TRIGGER IF EXISTS post_fts_body_update",
+    "DROP TABLE IF EXISTS post_fts",
+    "DROP VIEW IF EXISTS post_fts_source"
+    ]
+
+# Ids and ranks of the matching published posts of a subsite, in rank
+# order, starting after a cursor. bm25() can only be evaluated inside the
+# full text query so the seek is applied around it.
+SEARCH = """
+SELECT id, rank FROM (
+    SELECT post.id AS id, bm25(post_fts, {weights}) AS rank
+    FROM post_fts JOIN post ON post.id = post_fts.rowid
+    WHERE post_fts MATCH :query
+    AND post.subsite = :subsite AND post.status = 'publish'
+)
+WHERE :rank IS NULL OR rank > :rank OR (rank = :rank AND id > :id)
+ORDER BY rank, id
+LIMIT :limit
+""".format(weights=', '.join(str(w) for w in WEIGHTS))
+
+SNIPPETS = """
+SELECT rowid, snippet(post_fts, -1, :start, :end, '…', :tokens)
+FROM post_fts
+WHERE post_fts MATCH :query AND rowid IN ({ids})
+"""
+
+
+def create_index(connection):
+    """ Create the full text index of posts and the triggers that keep it
+    in step with the post and post_body tables.
+
+    :param connection: SQLAlchemy connection
+    :return: None
+    """
+    for statement in CREATE_INDEX:
+        connection.execute(text(statement))
+
+
+def drop_index(connection):
+    """ Drop the full text index of posts and its triggers. """
+    for statement in DROP_INDEX:
+        connection.execute(text(statement))
+
+
+def rebuild_index(connection):
+    """ Rebuild the full text index from the posts and their bodies.
+
+    :param connection: SQLAlchemy connection
+    :return: None
+    """
+    create_index(connection)
+    connection.execute(text(
+        "INSERT INTO post_fts (post_fts) VALUES ('rebuild')"
+        ))
+
+
+def index_exists(connection):
+    """ Has the full text index been created? """
+    return connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+        "AND name = 'post_fts'"
+        )).first() is not None
+
+
+# The index reads both tables: it is created once the bodies, which come
+# after the posts, exist, and dropped with the posts, which go last
+@event.listens_for(PostBody.__table__, 'after_create')
+def _create_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        create_index(connection)
+
+
+@event.listens_for(Post.__table__, 'before_drop')
+def _drop_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        drop_index(connection)
+
+
+def match_query(terms):
+    """ Turn what a reader typed into an FTS5 query matching posts that
+    contain every word, the last as a prefix so that results appear while
+    a word is still being typed. Every word is quoted so that FTS5 syntax
+    in the input is searched for rather than interpreted.
+
+    :param terms: Search string
+    :return: FTS5 query string, or None if there are no words
+    """
+    words = re.findall(r'\w+', terms or '', re.UNICODE)
+    if not words:
+        return None
+    quoted = ['"{0}"'.format(word) for word in words]
+    quoted[-1] += ' *'
+    return ' '.join(quoted)
+
+
+def highlight(snippet):
+    """ Escape a snippet and mark up its matches. """
+    return Markup(
+        escape(snippet).replace(START_MARK, Markup('<mark>')).replace(
+            END_MARK, Markup('</mark>'))
+        )
+
+
+class SearchResults(object):
+    """ A page of posts matching a search, best match first, with a
+    highlighted snippet of each.
+
+    :param subsite: Subsite to search
+    :param terms: Search string
+    :param per_page: Number of results per page
+    :param after: Cursor of the last result of the previous page
+    """
+
+    def __init__(self, subsite, terms, per_page, after=None):
+        self.terms = terms
+        self.has_prev = after is not None
+        self.items = []
+        self.snippets = {}
+        self.has_next = False
+        self._last = None
+
+        query = match_query(terms)
+        if query is None:
+            return
+
+        rank, ident = None, 0
+        if after is not None:
+            rank, ident, _ = decode_cursor(after)
+            if not isinstance(rank, (int, float)):
+                raise NotFound()
+        rows = db.session.execute(text(SEARCH), {
+            'query': query,
+            'subsite': subsite,
+            'rank': rank,
+            'id': ident,
+            'limit': per_page + 1
+            }).fetchall()
+        self.has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        if not rows:
+            return
+        self._last = rows[-1]
+
+        ids = [row[0] for row in rows]
+        posts = dict(
+            (post.id, post) for post in
+            Post.query.filter(Post.id.in_(ids)).all()
+            )
+        self.items = [posts[i] for i in ids if i in posts]
+
+        snippets = db.session.execute(
+            text(SNIPPETS.format(ids=', '.join(str(i) for i in ids))), {
+                'query': query,
+                'start': START_MARK,
+                'end': END_MARK,
+                'tokens': SNIPPET_TOKENS
+                })
+        self.snippets = dict(
+            (ident, highlight(snippet)) for ident, snippet in snippets
+            )
+
+    @property
+    def next_cursor(self):
+        """ Cursor for the next page of results. """
+        if not self.has_next or self._last is None:
+            return None
+        return encode_cursor(self._last[1], self._last[0])
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from benhoyle.extensions import db, cache
+
+from benhoyle.blueprints.blog.models import (
+    Tag, Category, post_tag, post_category, term_counts_key
+    )
+from benhoyle.blueprints.blog import page_cache
+
+# Association table and its term id column for each kind of term
+ASSOCIATIONS = {
+    Tag: (post_tag, post_tag.c.tag_id),
+    Category: (post_category, post_category.c.category_id)
+    }
+
+# Page cache dependency names for each kind of term
+DEPENDENCIES = {
+    Tag: ('tags', 'tag'),
+    Category: ('categories', 'category')
+    }
+
+
+def find_terms(model, subsite, nicenames):
+    """ Return (id, nicename, display_name) of the tags or categories of
+    subsite with nicenames, in the order given, from one IN query.
+
+    :param model: Tag or Category
+    :param subsite: Subsite of the terms
+    :param nicenames: Nicenames to look up
+    :return: List of tuples, unknown nicenames are left out
+    """
+    if not nicenames:
+        return []
+    found = dict(
+        (row[1], tuple(row)) for row in db.session.query(
+            model.id, model.nicename, model.display_name).filter(
+                model.subsite == subsite).filter(
+                    model.nicename.in_(nicenames))
+        )
+    return [found[n] for n in nicenames if n in found]
+
+
+def _invalidate(model, subsite, nicenames):
+    """ Evict the pages and counts built from the changed terms. The bulk
+    statements bypass the session events that would otherwise do it. """
+    listing, single = DEPENDENCIES[model]
+    cache.delete(term_counts_key(model, subsite))
+    page_cache.invalidate(
+        (listing, subsite), *[(single, subsite, n) for n in nicenames]
+        )
+
+
+def delete_terms(model, subsite, nicenames):
+    """ Delete tags or categories and remove them from all their posts
+    with set based statements in a single transaction.
+
+    :param model: Tag or Category
+    :param subsite: Subsite of the terms
+    :param nicenames: Nicenames of the terms to delete
+    :return: Tuple of (terms deleted, post associations removed)
+    """
+    terms = find_terms(model, subsite, nicenames)
+    if not terms:
+        return 0, 0
+    association, term_id = ASSOCIATIONS[model]
+    ids = [term[0] for term in terms]
+
+    removed = db.session.execute(
+        association.delete().where(term_id.in_(ids))).rowcount
+    if model is Category:
+        # Children of a deleted category move to the top level
+        db.session.execute(Category.__table__.update().where(
+            Category.parent.in_(ids)).values(parent=None))
+    db.session.execute(model.__table__.delete().where(model.id.in_(ids)))
+    db.session.commit()
+
+    _invalidate(model, subsite, [term[1] for term in terms])
+    return len(terms), removed
+
+
+def merge_terms(model, subsite, nicenames, display_name=None):
+    """ Add a new tag or category to every post that has any of the given
+    ones, copying the association rows with one INSERT ... SELECT in a
+    single transaction. The merged terms are kept.
+
+    :param model: Tag or Category
+    :param subsite: Subsite of the terms
+    :param nicenames: Nicenames of the terms to merge
+    :param display_name: Name of the new term, by default the names of the
+                         merged terms joined with spaces
+    :return: Tuple of (new term, posts it was added to)
+    :raises ValueError: If fewer than two of the terms exist or the new
+                        term's nicename is already taken
+    """
+    terms = find_terms(model, subsite, nicenames)
+    if len(terms) < 2:
+        raise ValueError(
+            "Select more than one {0} to merge".format(
+                DEPENDENCIES[model][1])
+            )
+    new_term = model(
+        display_name=display_name or " ".join(term[2] for term in terms),
+        subsite=subsite
+        )
+    new_term.make_nicename()
+    if find_terms(model, subsite, [new_term.nicename]):
+        raise ValueError(
+            "A {0} called {1} already exists".format(
+                DEPENDENCIES[model][1], new_term.display_name)
+            )
+    db.session.add(new_term)
+    db.session.flush()
+
+    association, term_id = ASSOCIATIONS[model]
+    posts = db.session.query(association.c.post_id).filter(
+        term_id.in_([term[0] for term in terms])).distinct()
+    added = db.session.execute(association.insert().from_select(
+        ['post_id', term_id.name],
+        posts.add_columns(db.literal(new_term.id)).statement
+        )).rowcount
+    db.session.commit()
+
+    _invalidate(
+        model, subsite, [new_term.nicename] + [term[1] for term in terms]
+        )
+    return new_term, added
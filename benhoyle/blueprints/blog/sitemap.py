@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import zlib
+
+from flask import (
+    Response, current_app, request, stream_with_context, url_for
+    )
+
+from benhoyle.extensions import db
+
+from benhoyle.blueprints.blog.models import Post
+
+# Posts read from the database per round trip while streaming
+YIELD_PER = 1000
+
+
+def listing_pages(subsites):
+    """ Yield [url, lastmod] for the post wall, categories and tags pages
+    of each subsite. """
+    ten_days_ago = datetime.datetime.now() - datetime.timedelta(days=10)
+    for subsite in subsites:
+        for endpoint in [
+            'blog.show_posts', 'blog.show_categories', 'blog.show_tags'
+        ]:
+            yield [
+                url_for(endpoint, subsite=subsite, _external=True),
+                ten_days_ago
+                ]
+
+
+def post_pages(subsite, offset=0, limit=None):
+    """ Yield [url, lastmod] for the published posts of a subsite, newest
+    change first, reading only the nicename and date_updated columns a
+    batch at a time.
+
+    :param subsite: Subsite of the posts
+    :param offset: Number of posts to skip
+    :param limit: Maximum number of posts
+    """
+    query = db.session.query(Post.nicename, Post.date_updated).filter(
+        Post.subsite == subsite).filter(
+            Post.status == "publish").order_by(
+                Post.date_updated.desc(), Post.id.desc())
+    if offset:
+        query = query.offset(offset)
+    if limit:
+        query = query.limit(limit)
+    for nicename, date_updated in query.yield_per(YIELD_PER):
+        yield [
+            url_for(
+                'blog.post',
+                subsite=subsite,
+                nicename=nicename,
+                _external=True
+                ),
+            date_updated.isoformat() if date_updated else None
+            ]
+
+
+def gzip_stream(chunks):
+    """ Compress an iterable of str chunks into a gzip stream. """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_xml(template_name, **context):
+    """ Stream a rendered XML template, gzipped if enabled and accepted.
+
+    :param template_name: Template to render
+    :param context: Template context, may hold generators
+    :return: Streamed Flask response
+    """
+    template = current_app.jinja_env.get_template(template_name)
+    chunks = template.stream(**context)
+    chunks.enable_buffering(100)
+
+    headers = {'Vary': 'Accept-Encoding'}
+    if (
+        current_app.config.get('SITEMAP_GZIP') and
+        'gzip' in request.accept_encodings
+    ):
+        chunks = gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/xml',
+        headers=headers
+        )
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from flask import current_app, url_for
+from sqlalchemy import and_
+from werkzeug.urls import url_unquote
+
+from benhoyle.extensions import db
+
+from benhoyle.blueprints.blog.models import (
+    Post, Tag, Category, post_tag, post_category
+    )
+from benhoyle.blueprints.blog.subsites import subsites
+
+# Posts per post wall page, as shown by show_posts
+POSTS_PER_PAGE = 20
+
+# File in the output tree recording the version each page was written at
+MANIFEST = '.export-manifest.json'
+
+# Settings for the apps that render the pages
+EXPORT_SETTINGS = {
+    # Link between post wall pages by number rather than by cursor
+    'STATIC_EXPORT': True,
+    # Do not fill the shared page cache with the exported pages
+    'CACHE_TYPE': 'null'
+    }
+
+
+def output_path(root, url):
+    """ File a page is written to: pages with a file extension, like the
+    sitemaps, keep their name, everything else becomes an index.html in
+    a directory named after the decoded path, as the proxy looks it up.
+
+    :param root: Root of the output tree
+    :param url: Path of the page
+    :return: File path
+    """
+    parts = [url_unquote(p) for p in url.split('/') if p]
+    if not parts or '.' not in parts[-1]:
+        parts.append('index.html')
+    return os.path.join(root, *parts)
+
+
+def _version(updated, count):
+    return '{0}|{1}'.format(updated.isoformat() if updated else '', count)
+
+
+def _digest(versions):
+    digest = hashlib.sha1()
+    for version in versions:
+        digest.update(version.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _term_versions(model, association, key, subsite):
+    """ (nicename, version) of every tag or category in subsite from one
+    GROUP BY over its published posts. """
+    return [
+        (nicename, _version(updated, count))
+        for nicename, updated, count in db.session.query(
+            model.nicename,
+            db.func.max(Post.date_updated),
+            db.func.count(Post.id)).outerjoin(
+                association, association.c[key] == model.id).outerjoin(
+                    Post, and_(
+                        Post.id == association.c.post_id,
+                        Post.status == "publish"
+                        )).filter(
+                            model.subsite == subsite).group_by(
+                                model.id).order_by(model.nicename)
+        ]
+
+
+def _term_posts(model, association, key, subsite):
+    """ {nicename: [(post id, date_updated)]} of the published posts of
+    every tag or category in subsite, in the order its post wall lists
+    them, from one query. """
+    posts = OrderedDict()
+    for nicename, ident, updated in db.session.query(
+        model.nicename, Post.id, Post.date_updated).join(
+            association, association.c[key] == model.id).join(
+                Post, Post.id == association.c.post_id).filter(
+                    model.subsite == subsite).filter(
+                        Post.status == "publish").order_by(
+                            model.nicename, Post.date_published.desc(),
+                            Post.id.desc()):
+        posts.setdefault(nicename, []).append((ident, updated))
+    return posts
+
+
+def _wall_pages(posts, endpoint, **values):
+    """ (url, version) of each page of a post wall listing posts. """
+    pages = []
+    page_count = max(1, -(-len(posts) // POSTS_PER_PAGE))
+    for page in range(1, page_count + 1):
+        on_page = posts[(page - 1) * POSTS_PER_PAGE:page * POSTS_PER_PAGE]
+        updated = [post[1] for post in on_page if post[1] is not None]
+        pages.append((
+            url_for(endpoint, page=page, **values),
+            _version(max(updated) if updated else None, len(posts))
+            ))
+    return pages
+
+
+def subsite_pages(subsite):
+    """ Return (url, version) for every public page of a subsite.
+
+    A page's version changes whenever the posts it is built from change:
+    a post page with the post's date_updated, a post wall page with the
+    newest date_updated on it and the number of published posts (which
+    moves posts between pages), archive, tag and category post wall pages
+    and feeds likewise over their posts.
+
+    Must be called in a request context so that URLs can be built.
+
+    :param subsite: Subsite
+    :return: List of (url, version) tuples
+    """
+    posts = db.session.query(
+        Post.nicename, Post.date_updated,
+        Post.date_published_year, Post.date_published_month).filter(
+            Post.subsite == subsite).filter(
+                Post.status == "publish").order_by(
+                    Post.date_published.desc(), Post.id.desc()).all()
+    pages = [
+        (
+            url_for('blog.post', subsite=subsite, nicename=nicename),
+            _version(updated, 1)
+        )
+        for nicename, updated, year, month in posts
+        ]
+
+    # Post wall pages, in the order show_posts lists them
+    pages.extend(_wall_pages(posts, 'blog.show_posts', subsite=subsite))
+
+    # Archive pages of each year and month, listed in the same order
+    years, months = OrderedDict(), OrderedDict()
+    for post in posts:
+        if post[2] is not None and post[3] is not None:
+            years.setdefault(post[2], []).append(post)
+            months.setdefault(post[2:4], []).append(post)
+    for year, on_year in years.items():
+        pages.extend(_wall_pages(
+            on_year, 'blog.archive_posts', subsite=subsite, year=year))
+    for (year, month), on_month in months.items():
+        pages.extend(_wall_pages(
+            on_month, 'blog.archive_posts',
+            subsite=subsite, year=year, month=month
+            ))
+    pages.append((
+        url_for('blog.archive', subsite=subsite),
+        _digest('{0}|{1}'.format(m, len(p)) for m, p in months.items())
+        ))
+
+    latest = [
+        post[1] for post in posts[:current_app.config['FEED_LENGTH']]
+        if post[1] is not None
+        ]
+    pages.append((
+        url_for('blog.subsite_feed', subsite=subsite),
+        _version(max(latest) if latest else None, len(posts))
+        ))
+
+    tags = _term_versions(Tag, post_tag, 'tag_id', subsite)
+    tag_posts = _term_posts(Tag, post_tag, 'tag_id', subsite)
+    for n, v in tags:
+        pages.extend(_wall_pages(
+            tag_posts.get(n, []), 'blog.tag_postwall',
+            subsite=subsite, tag_nicename=n
+            ))
+        pages.append(
+            (url_for('blog.tag_feed', subsite=subsite, tag_nicename=n), v))
+    pages.append((
+        url_for('blog.show_tags', subsite=subsite),
+        _digest(n + v for n, v in tags)
+        ))
+
+    categories = _term_versions(
+        Category, post_category, 'category_id', subsite
+        )
+    category_posts = _term_posts(
+        Category, post_category, 'category_id', subsite
+        )
+    for n, v in categories:
+        pages.extend(_wall_pages(
+            category_posts.get(n, []), 'blog.category_postwall',
+            subsite=subsite, category_nicename=n
+            ))
+        pages.append((
+            url_for('blog.category_feed', subsite=subsite,
+                    category_nicename=n),
+            v
+            ))
+    pages.append((
+        url_for('blog.show_categories', subsite=subsite),
+        _digest(n + v for n, v in categories)
+        ))
+    return pages
+
+
+def site_pages():
+    """ Return (url, version) for every public page of the site: the
+    front page, the pages of each subsite and the sitemaps.
+
+    Must be called in a request context so that URLs can be built.
+    """
+    pages = [(url_for('blog.index'), 'static')]
+    for subsite in subsites:
+        pages.extend(subsite_pages(subsite))
+    # The sitemaps list every page, so change with any of them
+    sitemap_version = _digest(url + version for url, version in pages)
+    pages.append((url_for('blog.sitemap'), sitemap_version))
+
+    # Child sitemaps, when the site is too large for a single sitemap
+    max_urls = current_app.config['SITEMAP_MAX_URLS']
+    counts = [
+        (subsite, Post.count_by_status(subsite, "publish"))
+        for subsite in subsites
+        ]
+    post_count = sum(count for subsite, count in counts)
+    if 3 * len(counts) + post_count > max_urls:
+        pages.append((url_for('blog.sitemap_listings'), sitemap_version))
+        for subsite, count in counts:
+            pages.extend(
+                (
+                    url_for('blog.sitemap_posts', subsite=subsite, chunk=c),
+                    sitemap_version
+                )
+                for c in range(-(-count // max_urls))
+                )
+    return pages
+
+
+def load_manifest(root):
+    """ Return the {url: version} written by the last export to root. """
+    try:
+        with open(os.path.join(root, MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_manifest(root, manifest):
+    """ Record the version of every page written to root. """
+    _write(os.path.join(root, MANIFEST), json.dumps(
+        manifest, indent=0, sort_keys=True).encode('utf-8'))
+
+
+def changed_pages(pages, manifest):
+    """ Split pages into those to write and the urls to remove, given the
+    manifest of the last export.
+
+    :param pages: List of (url, version) tuples
+    :param manifest: {url: version} of the last export
+    :return: Tuple of (urls to render, urls no longer published)
+    """
+    current = dict(pages)
+    stale = [url for url, version in pages if manifest.get(url) != version]
+    removed = [url for url in manifest if url not in current]
+    return stale, removed
+
+
+def _write(path, data):
+    """ Write a file atomically so the proxy never serves half a page. """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def render_page(client, root, url, base_url=None):
+    """ Fetch a page through the app as an anonymous reader and write it
+    to the output tree.
+
+    :param client: Flask test client
+    :param root: Root of the output tree
+    :param url: Path of the page
+    :param base_url: Scheme and host the site is served from, used in the
+                     absolute URLs of the sitemaps
+    :return: Tuple of (url, HTTP status)
+    """
+    response = client.get(url, base_url=base_url)
+    if response.status_code == 200:
+        _write(output_path(root, url), response.get_data())
+    return url, response.status_code
+
+
+# Per process state of the pool workers
+_worker = {}
+
+
+def init_worker(root, base_url):
+    """ Give a pool worker its own app, database connection and client. """
+    from benhoyle.app import create_app
+    app = create_app(settings_override=EXPORT_SETTINGS)
+    _worker.update(
+        client=app.test_client(), root=root, base_url=base_url
+        )
+
+
+def render_in_worker(url):
+    """ Render a page in a pool worker set up by init_worker. """
+    return render_page(
+        _worker['client'], _worker['root'], url, _worker['base_url']
+        )
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import object_session
+
+from benhoyle.extensions import db, cache
+
+from benhoyle.blueprints.blog.models import Post
+
+# Key in the shared cache for the generation of the subsites
+GENERATION_KEY = 'subsites/generation'
+
+
+def _generation():
+    """ Return the current generation of the subsites, starting a new one
+    if there is none (never set, evicted or the cache was cleared). """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.set(GENERATION_KEY, generation, timeout=0)
+    return generation
+
+
+class SubsiteRegistry(object):
+    """ Process wide cache of the subsites that have posts.
+
+    The set of subsites is loaded with a single SELECT DISTINCT and kept
+    while the generation in the shared cache is the one it was loaded at.
+    A post write in any worker, or a bulk import calling invalidate,
+    starts a new generation so that every worker reloads. Membership
+    checks are set lookups, the list preserves the database order so that
+    the default subsite is the same one the old per-request query
+    returned. """
+
+    def __init__(self):
+        self._loaded = None
+
+    def load(self):
+        """ (Re)load the subsites from the post table. """
+        # Read first so that a write racing the load leaves it stale
+        generation = _generation()
+        names = [
+            result[0] for result in
+            db.session.query(Post.subsite).distinct().all()
+        ]
+        self._loaded = (generation, names, frozenset(names))
+        return names
+
+    def forget(self):
+        """ Forget the cached subsites in this worker only. """
+        self._loaded = None
+
+    def invalidate(self):
+        """ Forget the cached subsites in every worker; the next access
+        reloads them. """
+        self.forget()
+        cache.set(GENERATION_KEY, uuid.uuid4().hex, timeout=0)
+
+    def _current(self):
+        """ Return (generation, names, lookup), reloaded if the subsites
+        changed since they were loaded. """
+        loaded = self._loaded
+        if loaded is None or loaded[0] != cache.get(GENERATION_KEY):
+            self.load()
+            loaded = self._loaded
+        return loaded
+
+    @property
+    def names(self):
+        """ Return list of subsites. """
+        return self._current()[1]
+
+    @property
+    def default(self):
+        """ Return the subsite used when a request names an unknown one. """
+        return self.names[0]
+
+    def __contains__(self, subsite):
+        return subsite in self._current()[2]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+subsites = SubsiteRegistry()
+
+
+def _changed(target):
+    """ Reload in this worker at once, and in the others once the change
+    is committed so that they cannot reload it before it is visible. """
+    subsites.forget()
+    session = object_session(target)
+    if session is not None:
+        session.info['subsites_changed'] = True
+
+
+@event.listens_for(Post, 'after_insert')
+@event.listens_for(Post, 'after_delete')
+def _invalidate_on_insert_delete(mapper, connection, target):
+    _changed(target)
+
+
+@event.listens_for(Post, 'after_update')
+def _invalidate_on_update(mapper, connection, target):
+    if inspect(target).attrs.subsite.history.has_changes():
+        _changed(target)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('subsites_changed', False):
+        subsites.invalidate()
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget_on_rollback(session):
+    session.info.pop('subsites_changed', None)
@@ -1,10 +1,12 @@
 
+import calendar
 import datetime
+import time
 
 # Import flask and template operators
 from flask import (
     render_template, request, redirect, url_for, g,
-    session, flash, make_response, Blueprint
+    session, flash, make_response, Blueprint, abort, current_app, jsonify
     )
 
 # Import Login Manager
@@ -14,8 +16,38 @@ from flask_login import (
 
 from benhoyle.extensions import db
 
+# Import read replica routing
+from benhoyle.replicas import use_primary
+
 # Import models
-from benhoyle.blueprints.blog.models import Post, Tag, Category, Author
+from benhoyle.blueprints.blog.models import (
+    Post, Tag, Category, Author, post_tag, post_category
+    )
+
+# Import post renderer
+from benhoyle.blueprints.blog.rendering import render_content
+
+# Import the cached subsite registry
+from benhoyle.blueprints.blog.subsites import subsites
+
+# Import keyset paginator
+from benhoyle.blueprints.blog.pagination import paginate_keyset
+
+# Import full page cache for anonymous readers
+from benhoyle.blueprints.blog import page_cache
+from benhoyle.blueprints.blog.page_cache import cached_page
+
+# Import conditional GET support
+from benhoyle.blueprints.blog.conditional import conditional
+
+# Import set based tag and category operations
+from benhoyle.blueprints.blog import services
+
+# Import full text search
+from benhoyle.blueprints.blog.search import SearchResults
+
+# Import streaming sitemap helpers
+from benhoyle.blueprints.blog import sitemap as sitemap_pages
 
 # Import forms
 from benhoyle.blueprints.blog.forms import (
@@ -34,40 +66,66 @@ blog = Blueprint(
 @blog.app_template_filter()
 def contentfilter(content):
     """ Split into lines and format paragraphs """
-    output_lines = []
-    p_on = True
-    for line in content.strip().splitlines():
-        if len(line.strip()) > 0:
-            if line[0] == "<" and line[-1] == ">":
-                if "<pre>" in line:
-                    p_on = False
-                if "</pre>" in line:
-                    p_on = True
-                output_lines.append(line)
-            else:
-                if p_on:
-                    output_lines.append("<p>" + line.strip() + "</p>")
-                else:
-                    output_lines.append(line)
-    return "\n".join(output_lines)
+    return render_content(content)
 
 
-# current_app.jinja_env.filters['contentfilter'] = contentfilter
+@blog.app_template_filter()
+def atomdate(value):
+    """ Format a naive local datetime, as the posts store them, as a UTC
+    timestamp for Atom feeds. """
+    utc = datetime.datetime.utcfromtimestamp(time.mktime(value.timetuple()))
+    return utc.replace(microsecond=value.microsecond).isoformat() + 'Z'
 
-def get_subsites():
-    """ Return list of subsites. """
-    return [
-        result[0] for result in
-        db.session.query(Post.subsite).distinct().all()
-    ]
 
+# current_app.jinja_env.filters['contentfilter'] = contentfilter
 
 @blog.before_request
 def before_request():
     g.user = current_user
 
 
+# Last change to the content of each public page, for conditional GETs
+def wall_updated(subsite, page=None, chunk=None):
+    return Post.last_updated(Post.subsite == subsite, Post.status == "publish")
+
+
+def subsite_updated(subsite):
+    return Post.last_updated(Post.subsite == subsite)
+
+
+def post_updated(subsite, nicename):
+    return Post.last_updated(
+        Post.subsite == subsite,
+        Post.nicename == nicename,
+        Post.status == "publish"
+        )
+
+
+def category_updated(subsite, category_nicename, page=None):
+    return Category.last_post_update(subsite, category_nicename)
+
+
+def tag_updated(subsite, tag_nicename, page=None):
+    return Tag.last_post_update(subsite, tag_nicename)
+
+
+def archive_updated(subsite, year, month=None, page=None):
+    criteria = [
+        Post.subsite == subsite,
+        Post.status == "publish",
+        Post.date_published_year == year
+        ]
+    if month is not None:
+        criteria.append(Post.date_published_month == month)
+    return Post.last_updated(*criteria)
+
+
+def site_updated():
+    return Post.last_updated(Post.status == "publish")
+
+
 @blog.route('/login', methods=['GET', 'POST'])
+@use_primary
 def login():
     # If user is already logged in go straight to homepage
     if g.user is not None and g.user.is_authenticated:
@@ -89,7 +147,7 @@ def login():
             login_user(user, remember=remember_me)
             flash('Welcome %s' % user.display_name)
             return redirect(
-                url_for('blog.show_posts', subsite=get_subsites()[0])
+                url_for('blog.show_posts', subsite=subsites.default)
                 )
         flash('Wrong email or password', 'error-message')
 
@@ -110,14 +168,21 @@ def index():
 
 @blog.route('/<subsite>/posts', defaults={'page': 1})
 @blog.route('/<subsite>/posts/page/<int:page>')
+@conditional(wall_updated)
+@cached_page
 def show_posts(subsite, page):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_posts', subsite=get_subsites()[0]))
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_posts', subsite=subsites.default))
     g.subsite = subsite
-    paginated_posts = Post.query.filter(
-        Post.subsite == subsite).filter(
-            Post.status == "publish").order_by(
-                Post.date_published.desc()).paginate(page, 20, True)
+    page_cache.depends_on(('wall', subsite))
+    paginated_posts = paginate_keyset(
+        Post.listing(Post.subsite == subsite, Post.status == "publish"),
+        Post.date_published, Post.id, 20,
+        page=page,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=Post.count_by_status(subsite, "publish")
+        )
 
     return render_template(
         'postwall.html',
@@ -127,85 +192,316 @@ def show_posts(subsite, page):
 
 @blog.route('/<subsite>/posts/drafts', defaults={'page': 1})
 @blog.route('/<subsite>/posts/drafts/page/<int:page>')
+@use_primary
 @login_required
 def show_drafts(subsite, page):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_drafts', subsite=get_subsites()[0]))
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_drafts', subsite=subsites.default))
     g.subsite = subsite
-    paginated_posts = Post.query.filter(
-        Post.subsite == subsite).filter(
-            Post.status == "draft").order_by(
-                Post.date_updated.desc()).paginate(page, 10, True)
+    paginated_posts = paginate_keyset(
+        Post.listing(Post.subsite == subsite, Post.status == "draft"),
+        Post.date_updated, Post.id, 10,
+        page=page,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=Post.count_by_status(subsite, "draft")
+        )
     return render_template('postwall.html', posts=paginated_posts)
 
 
-@blog.route('/<subsite>/categories/<category_nicename>')
-def category_postwall(subsite, category_nicename):
-    if subsite not in get_subsites():
+@blog.route('/<subsite>/archive')
+@conditional(wall_updated)
+@cached_page
+def archive(subsite):
+    if subsite not in subsites:
+        return redirect(url_for('blog.archive', subsite=subsites.default))
+    g.subsite = subsite
+    page_cache.depends_on(('wall', subsite))
+    years = []
+    for year, month, count in Post.archive_summary(subsite):
+        if not years or years[-1][0] != year:
+            years.append((year, []))
+        years[-1][1].append((month, calendar.month_name[month], count))
+    return render_template('archive.html', years=years)
+
+
+@blog.route(
+    '/<subsite>/archive/<int:year>',
+    defaults={'month': None, 'page': 1}
+    )
+@blog.route(
+    '/<subsite>/archive/<int:year>/page/<int:page>',
+    defaults={'month': None}
+    )
+@blog.route('/<subsite>/archive/<int:year>/<int:month>', defaults={'page': 1})
+@blog.route('/<subsite>/archive/<int:year>/<int:month>/page/<int:page>')
+@conditional(archive_updated)
+@cached_page
+def archive_posts(subsite, year, month, page):
+    if subsite not in subsites:
+        return redirect(url_for('blog.archive', subsite=subsites.default))
+    g.subsite = subsite
+    page_cache.depends_on(('wall', subsite))
+    total = sum(
+        count for y, m, count in Post.archive_summary(subsite)
+        if y == year and (month is None or m == month)
+        )
+    if not total:
+        abort(404)
+    query = Post.listing(
+        Post.subsite == subsite,
+        Post.status == "publish",
+        Post.date_published_year == year
+        )
+    if month is not None:
+        query = query.filter(Post.date_published_month == month)
+    paginated_posts = paginate_keyset(
+        query, Post.date_published, Post.id, 20,
+        page=page,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=total
+        )
+    return render_template(
+        'postwall.html',
+        posts=paginated_posts,
+        archive=(
+            '{0} {1}'.format(calendar.month_name[month], year)
+            if month else str(year)
+            ),
+        args=dict(year=year, month=month)
+        )
+
+
+# Not page cached, as every query would take its own entry
+@blog.route('/<subsite>/search')
+@conditional(wall_updated)
+def search(subsite):
+    if subsite not in subsites:
+        return redirect(url_for('blog.search', subsite=subsites.default))
+    g.subsite = subsite
+    results = SearchResults(
+        subsite,
+        request.args.get('q', ''),
+        20,
+        after=request.args.get('after')
+        )
+    return render_template('search.html', results=results)
+
+
+def term_count(model, subsite, nicename):
+    """ Number of published posts with a tag or category, from the cached
+    counts of the subsite. """
+    return next(
+        (
+            term.count for term in model.post_counts(subsite)
+            if term.nicename == nicename
+        ),
+        0
+        )
+
+
+@blog.route(
+    '/<subsite>/categories/<category_nicename>', defaults={'page': 1}
+    )
+@blog.route('/<subsite>/categories/<category_nicename>/page/<int:page>')
+@conditional(category_updated)
+@cached_page
+def category_postwall(subsite, category_nicename, page):
+    if subsite not in subsites:
         return redirect(
             url_for(
                 'blog.show_categories',
-                subsite=get_subsites()[0]
+                subsite=subsites.default
                 )
             )
     g.subsite = subsite
+    page_cache.depends_on(('category', subsite, category_nicename))
     category = Category.query.filter(
         Category.subsite == subsite).filter(
             Category.nicename == category_nicename).first()
-    posts = category.posts.filter(
-        Post.status == "publish").order_by(
-            Post.date_published.desc()).all()
+    if not category:
+        abort(404)
+    paginated_posts = paginate_keyset(
+        Post.listing(Post.status == "publish").join(
+            post_category, post_category.c.post_id == Post.id).filter(
+                post_category.c.category_id == category.id),
+        Post.date_published, Post.id, 20,
+        page=page,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=term_count(Category, subsite, category_nicename)
+        )
     return render_template(
         'tag_cat_postwall.html',
-        posts=posts,
-        category=category
+        posts=paginated_posts,
+        category=category,
+        args=dict(category_nicename=category_nicename)
         )
 
 
-@blog.route('/<subsite>/tags/<tag_nicename>')
-def tag_postwall(subsite, tag_nicename):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_tags', subsite=get_subsites()[0]))
+@blog.route('/<subsite>/tags/<tag_nicename>', defaults={'page': 1})
+@blog.route('/<subsite>/tags/<tag_nicename>/page/<int:page>')
+@conditional(tag_updated)
+@cached_page
+def tag_postwall(subsite, tag_nicename, page):
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_tags', subsite=subsites.default))
     g.subsite = subsite
+    page_cache.depends_on(('tag', subsite, tag_nicename))
     tag = Tag.query.filter(
         Tag.subsite == subsite).filter(
             Tag.nicename == tag_nicename).first()
-    posts = tag.posts.filter(
-        Post.status == "publish").order_by(
-            Post.date_published.desc()).all()
+    if not tag:
+        abort(404)
+    paginated_posts = paginate_keyset(
+        Post.listing(Post.status == "publish").join(
+            post_tag, post_tag.c.post_id == Post.id).filter(
+                post_tag.c.tag_id == tag.id),
+        Post.date_published, Post.id, 20,
+        page=page,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        total=term_count(Tag, subsite, tag_nicename)
+        )
     return render_template(
         'tag_cat_postwall.html',
+        posts=paginated_posts,
+        tag=tag,
+        args=dict(tag_nicename=tag_nicename)
+        )
+
+
+def render_feed(posts, title, link):
+    """ Atom feed response for posts, newest first. """
+    response = make_response(render_template(
+        'feed.xml',
         posts=posts,
-        tag=tag
+        title=title,
+        link=link,
+        updated=max(
+            [
+                p.date_updated or p.date_published for p in posts
+                if p.date_updated or p.date_published
+            ] or [datetime.datetime.now()]
+            )
+        ))
+    response.mimetype = 'application/atom+xml'
+    return response
+
+
+def feed_posts(query):
+    """ The latest published posts of a Post.with_relations() query, for
+    a feed. """
+    return query.filter(
+        Post.status == "publish").order_by(
+            Post.date_published.desc(), Post.id.desc()).limit(
+                current_app.config['FEED_LENGTH']).all()
+
+
+@blog.route('/<subsite>/feed.atom')
+@conditional(wall_updated)
+@cached_page
+def subsite_feed(subsite):
+    if subsite not in subsites:
+        abort(404)
+    page_cache.depends_on(('wall', subsite))
+    return render_feed(
+        feed_posts(Post.with_relations().filter(Post.subsite == subsite)),
+        subsite,
+        url_for('blog.show_posts', subsite=subsite, _external=True)
+        )
+
+
+@blog.route('/<subsite>/categories/<category_nicename>/feed.atom')
+@conditional(category_updated)
+@cached_page
+def category_feed(subsite, category_nicename):
+    page_cache.depends_on(('category', subsite, category_nicename))
+    category = Category.query.filter(
+        Category.subsite == subsite).filter(
+            Category.nicename == category_nicename).first()
+    if not category:
+        abort(404)
+    return render_feed(
+        feed_posts(Post.with_relations().join(
+            post_category, post_category.c.post_id == Post.id).filter(
+                post_category.c.category_id == category.id)),
+        '{0} - {1}'.format(subsite, category.display_name),
+        url_for(
+            'blog.category_postwall',
+            subsite=subsite,
+            category_nicename=category_nicename,
+            _external=True
+            )
+        )
+
+
+@blog.route('/<subsite>/tags/<tag_nicename>/feed.atom')
+@conditional(tag_updated)
+@cached_page
+def tag_feed(subsite, tag_nicename):
+    page_cache.depends_on(('tag', subsite, tag_nicename))
+    tag = Tag.query.filter(
+        Tag.subsite == subsite).filter(
+            Tag.nicename == tag_nicename).first()
+    if not tag:
+        abort(404)
+    return render_feed(
+        feed_posts(Post.with_relations().join(
+            post_tag, post_tag.c.post_id == Post.id).filter(
+                post_tag.c.tag_id == tag.id)),
+        '{0} - {1}'.format(subsite, tag.display_name),
+        url_for(
+            'blog.tag_postwall',
+            subsite=subsite,
+            tag_nicename=tag_nicename,
+            _external=True
+            )
         )
 
 
 @blog.route('/<subsite>/posts/<nicename>')
+@conditional(post_updated)
+@cached_page
 def post(subsite, nicename):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_posts', subsite=get_subsites()[0]))
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_posts', subsite=subsites.default))
     g.subsite = subsite
+    page_cache.depends_on(('post', subsite, nicename))
     if g.user is not None and g.user.is_authenticated:
         # Show drafts as well as published posts
-        post = Post.query.filter(
+        post = Post.with_relations().filter(
             Post.subsite == subsite).filter(
                 Post.nicename == nicename).first()
     else:
         # Only show published posts
-        post = Post.query.filter(
+        post = Post.with_relations().filter(
             Post.subsite == subsite).filter(
                 Post.status == "publish").filter(
                     Post.nicename == nicename).first()
     if not post:
         return redirect(url_for('blog.show_posts', subsite=subsite))
-    return render_template('post.html', post=post)
+    # The page also shows the display names of its tags and categories
+    page_cache.depends_on(
+        *[('tag', subsite, n) for n in post.get_tag_nicenames()] +
+        [('category', subsite, n) for n in post.get_category_nicenames()]
+        )
+    # Posts saved before pre-rendering, or with a stale render, are
+    # rendered for display only; the render command stores their HTML
+    if post.needs_render():
+        content_html = render_content(post.content or '')
+    else:
+        content_html = post.content_html
+    return render_template('post.html', post=post, content_html=content_html)
 
 
 @blog.route('/<subsite>/posts/<nicename>/edit', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def edit_post(subsite, nicename):
     g.subsite = subsite
-    post = Post.query.filter(
+    post = Post.with_body().filter(
         Post.subsite == subsite).filter(
             Post.nicename == nicename).first()
     if not post:
@@ -223,6 +519,10 @@ def edit_post(subsite, nicename):
                 'blog.post',
                 subsite=subsite,
                 nicename=post.nicename))
+        # Pages built from the post as it was need evicting as well
+        old_nicename = post.nicename
+        old_tags = post.get_tag_nicenames()
+        old_categories = post.get_category_nicenames()
         if form.save_as_draft_button.data:
             post.status = "draft"
         if form.publish_button.data:
@@ -234,21 +534,27 @@ def edit_post(subsite, nicename):
         post.date_updated = datetime.datetime.now()
         post.display_title = form.display_title.data
         post.content = form.content.data
+        post.render()
         post.make_nicename()
-        # Need to add here removal of category
-        for category in post.categories:
-            if category.nicename not in form.categories.data:
-                post.uncategorise(category)
-        for category in form.categories.data:
-            post.categorise_by_nicename(category)
-        for tag in post.tags:
-            if tag.nicename not in form.tags.data:
-                post.untag(tag)
-        for tag in form.tags.data:
-            post.tag_by_nicename(tag)
+        with db.session.no_autoflush:
+            nicename_taken = Post.exists(post.nicename, subsite, post.id)
+        if nicename_taken:
+            db.session.rollback()
+            form.display_title.errors.append(
+                "A post with this title already exists"
+                )
+            return render_template('add_edit.html', form=form)
+        post.set_categories(form.categories.data)
+        post.set_tags(form.tags.data)
 
         db.session.add(post)
         db.session.commit()
+        page_cache.invalidate(*page_cache.post_dependencies(
+            subsite,
+            [old_nicename, post.nicename],
+            old_tags + form.tags.data,
+            old_categories + form.categories.data
+            ))
         return redirect(
             url_for('blog.post', subsite=subsite, nicename=post.nicename)
             )
@@ -256,10 +562,11 @@ def edit_post(subsite, nicename):
 
 
 @blog.route('/<subsite>/posts/add', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def add_post(subsite):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_posts', subsite=get_subsites()[0]))
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_posts', subsite=subsites.default))
     g.subsite = subsite
     form = PostForm()
     form.categories.choices = Category.get_category_names(subsite)
@@ -271,9 +578,15 @@ def add_post(subsite):
         post = Post()
         post.display_title = form.display_title.data
         post.content = form.content.data
+        post.render()
         post.date_updated = datetime.datetime.now()
         post.make_nicename()
         post.subsite = subsite
+        if Post.exists(post.nicename, subsite):
+            form.display_title.errors.append(
+                "A post with this title already exists"
+                )
+            return render_template('add_edit.html', form=form)
         if form.save_as_draft_button.data:
             post.status = "draft"
         if form.publish_button.data:
@@ -285,13 +598,17 @@ def add_post(subsite):
 
         db.session.add(post)
 
-        for category in form.categories.data:
-            post.categorise_by_nicename(category)
-        for tag in form.tags.data:
-            post.tag_by_nicename(tag)
+        post.set_categories(form.categories.data)
+        post.set_tags(form.tags.data)
         post.add_author_by_login(g.user.login)
 
         db.session.commit()
+        page_cache.invalidate(*page_cache.post_dependencies(
+            subsite,
+            [post.nicename],
+            form.tags.data,
+            form.categories.data
+            ))
         return redirect(
             url_for('blog.post', subsite=subsite, nicename=post.nicename)
             )
@@ -299,6 +616,7 @@ def add_post(subsite):
 
 
 @blog.route('/<subsite>/posts/<nicename>/delete', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def delete_post(subsite, nicename):
     g.subsite = subsite
@@ -309,14 +627,21 @@ def delete_post(subsite, nicename):
         return redirect(
             url_for(
                 'blog.show_posts',
-                subsite=get_subsites()[0]
+                subsite=subsites.default
                 )
             )
     form = DeleteConfirm(request.form)
     if form.validate_on_submit():
         if form.confirm_delete.data:
+            dependencies = page_cache.post_dependencies(
+                subsite,
+                [post.nicename],
+                post.get_tag_nicenames(),
+                post.get_category_nicenames()
+                )
             db.session.delete(post)
             db.session.commit()
+            page_cache.invalidate(*dependencies)
             return redirect(url_for('blog.show_posts'))
         if form.cancel.data:
             return redirect(
@@ -330,40 +655,66 @@ def delete_post(subsite, nicename):
 
 
 @blog.route('/<subsite>/categories')
+@conditional(subsite_updated)
+@cached_page
 def show_categories(subsite):
-    if subsite not in get_subsites():
+    if subsite not in subsites:
         return redirect(
             url_for(
                 'blog.show_categories',
-                subsite=get_subsites()[0]
+                subsite=subsites.default
                 )
             )
     g.subsite = subsite
-    categories = Category.query.filter(
-        Category.subsite == subsite).order_by(
-            Category.display_name.asc()).all()
-    return render_template('categories.html', categories=categories)
+    page_cache.depends_on(('categories', subsite))
+    return render_template(
+        'categories.html',
+        categories=Category.post_counts(subsite)
+        )
+
+
+@blog.route('/<subsite>/categories.json', methods=['GET'])
+@conditional(subsite_updated)
+@cached_page
+def category_counts(subsite):
+    if subsite not in subsites:
+        abort(404)
+    page_cache.depends_on(('categories', subsite))
+    return jsonify(categories=[
+        c._asdict() for c in Category.post_counts(subsite)
+        ])
 
 
 @blog.route('/<subsite>/tags', methods=['GET'])
+@conditional(subsite_updated)
+@cached_page
 def show_tags(subsite):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_tags', subsite=get_subsites()[0]))
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_tags', subsite=subsites.default))
     g.subsite = subsite
-    tags = Tag.query.filter(
-        Tag.subsite == subsite).order_by(
-            Tag.display_name.asc()).all()
-    return render_template('tags.html', tags=tags)
+    page_cache.depends_on(('tags', subsite))
+    return render_template('tags.html', tags=Tag.post_counts(subsite))
+
+
+@blog.route('/<subsite>/tags.json', methods=['GET'])
+@conditional(subsite_updated)
+@cached_page
+def tag_counts(subsite):
+    if subsite not in subsites:
+        abort(404)
+    page_cache.depends_on(('tags', subsite))
+    return jsonify(tags=[t._asdict() for t in Tag.post_counts(subsite)])
 
 
 @blog.route('/<subsite>/categories/add', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def add_categories(subsite):
-    if subsite not in get_subsites():
+    if subsite not in subsites:
         return redirect(
             url_for(
                 'blog.show_categories',
-                subsite=get_subsites()[0]
+                subsite=subsites.default
                 )
             )
     g.subsite = subsite
@@ -382,6 +733,7 @@ def add_categories(subsite):
             else:
                 db.session.add(category)
                 db.session.commit()
+                page_cache.invalidate(('categories', subsite))
                 return redirect(url_for('blog.add_categories'))
     return render_template(
         'add_categories.html',
@@ -391,13 +743,14 @@ def add_categories(subsite):
 
 
 @blog.route('/<subsite>/categories/edit', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def edit_categories(subsite):
-    if subsite not in get_subsites():
+    if subsite not in subsites:
         return redirect(
             url_for(
                 'blog.show_categories',
-                subsite=get_subsites()[0]
+                subsite=subsites.default
                 )
             )
     g.subsite = subsite
@@ -414,6 +767,11 @@ def edit_categories(subsite):
                 category.make_nicename()
                 db.session.add(category)
                 db.session.commit()
+                page_cache.invalidate(
+                    ('categories', subsite),
+                    ('category', subsite, selected_category_nicename),
+                    ('category', subsite, category.nicename)
+                    )
                 return redirect(
                     url_for('blog.show_categories', subsite=subsite)
                     )
@@ -421,13 +779,14 @@ def edit_categories(subsite):
 
 
 @blog.route('/<subsite>/categories/merge_delete', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def merge_delete_categories(subsite):
-    if subsite not in get_subsites():
+    if subsite not in subsites:
         return redirect(
             url_for(
                 'blog.show_categories',
-                subsite=get_subsites()[0])
+                subsite=subsites.default)
             )
     g.subsite = subsite
 
@@ -443,60 +802,30 @@ def merge_delete_categories(subsite):
             merge_delete_form.validate_on_submit() and
             merge_delete_form.delete_button.data
         ):
-            for category_name in merge_delete_form.categories.data:
-                category = Category.get_by_nicename(category_name)
-                if category:
-                    flash("Deleted category: " + category.display_name)
-                    for post in category.posts:
-                        post.uncategorise(category)
-                        db.session.add(post)
-                        flash(
-                            "Category removed from post: "
-                            + post.display_title
-                            )
-                    db.session.delete(category)
-                    db.session.commit()
+            deleted, removed = services.delete_terms(
+                Category, subsite, merge_delete_form.categories.data
+                )
+            flash("Deleted {0} categories, removed from {1} posts".format(
+                deleted, removed))
             return redirect(url_for('blog.show_categories', subsite=subsite))
 
         if (
             merge_delete_form.validate_on_submit() and
             merge_delete_form.merge_button.data
         ):
-            if len(merge_delete_form.categories.data) > 1:
-                cats_to_merge = [
-                    Category.get_by_nicename(category_name)
-                    for category_name in merge_delete_form.categories.data
-                    ]
-                new_category_name = " ".join(
-                    [c.display_name for c in cats_to_merge]
+            try:
+                new_category, added = services.merge_terms(
+                    Category, subsite, merge_delete_form.categories.data
                     )
-                flash("Merged category added: "+new_category_name)
-                new_category = Category(display_name=new_category_name)
-                new_category.make_nicename()
-                new_category.subsite = subsite
-                if Category.exists(new_category.nicename):
-                    merge_delete_form.categories.errors.append(
-                        "Select more than one category to merge"
-                        )
-                else:
-                    db.session.add(new_category)
-                    db.session.commit()
-                    for category in cats_to_merge:
-                        for post in category.posts:
-                            post.categorise(new_category)
-                            db.session.add(post)
-                            flash(
-                                "Post categorised with merged category> "
-                                + post.display_title
-                                )
-                    db.session.commit()
-                    flash("Delete old categories if no longer needed")
-                    return redirect(
-                        url_for('blog.show_categories', subsite=subsite)
-                        )
+            except ValueError as error:
+                merge_delete_form.categories.errors.append(str(error))
             else:
-                merge_delete_form.categories.errors.append(
-                    "Select more than one category to merge"
+                flash("Merged category added: " + new_category.display_name)
+                flash("Posts categorised with merged category: {0}".format(
+                    added))
+                flash("Delete old categories if no longer needed")
+                return redirect(
+                    url_for('blog.show_categories', subsite=subsite)
                     )
 
     return render_template(
@@ -506,10 +835,11 @@ def merge_delete_categories(subsite):
 
 
 @blog.route('/<subsite>/tags/add', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def add_tags(subsite):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_tags', subsite=get_subsites()[0]))
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_tags', subsite=subsites.default))
     g.subsite = subsite
     tags = Tag.query.filter(
         Tag.subsite == subsite).order_by(
@@ -526,15 +856,17 @@ def add_tags(subsite):
             else:
                 db.session.add(tag)
                 db.session.commit()
+                page_cache.invalidate(('tags', subsite))
                 return redirect(url_for('blog.add_tags', subsite=subsite))
     return render_template('add_tags.html', tags=tags, add_form=add_form)
 
 
 @blog.route('/<subsite>/tags/edit', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def edit_tags(subsite):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_tags', subsite=get_subsites()[0]))
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_tags', subsite=subsites.default))
     g.subsite = subsite
     edit_form = EditTagForm()
     edit_form.tags.choices = Tag.get_tag_names(subsite)
@@ -549,16 +881,22 @@ def edit_tags(subsite):
                 tag.make_nicename()
                 db.session.add(tag)
                 db.session.commit()
+                page_cache.invalidate(
+                    ('tags', subsite),
+                    ('tag', subsite, selected_tag_nicename),
+                    ('tag', subsite, tag.nicename)
+                    )
                 return redirect(url_for('blog.show_tags', subsite=subsite))
 
     return render_template('edit_tags.html', edit_form=edit_form)
 
 
 @blog.route('/<subsite>/tags/merge_delete', methods=['GET', 'POST'])
+@use_primary
 @login_required
 def merge_delete_tags(subsite):
-    if subsite not in get_subsites():
-        return redirect(url_for('blog.show_tags', subsite=get_subsites()[0]))
+    if subsite not in subsites:
+        return redirect(url_for('blog.show_tags', subsite=subsites.default))
     g.subsite = subsite
 
     merge_delete_form = MergeDeleteTagForm()
@@ -573,113 +911,88 @@ def merge_delete_tags(subsite):
             merge_delete_form.validate_on_submit() and
             merge_delete_form.delete_button.data
         ):
-            for tag_name in merge_delete_form.tags.data:
-                tag = Tag.get_by_nicename(tag_name)
-                if tag:
-                    flash("Deleted tag: " + tag.display_name)
-                    for post in tag.posts:
-                        post.untag(tag)
-                        db.session.add(post)
-                        flash("Tag removed from post: " + post.display_title)
-                    db.session.delete(tag)
-                    db.session.commit()
+            deleted, removed = services.delete_terms(
+                Tag, subsite, merge_delete_form.tags.data
+                )
+            flash("Deleted {0} tags, removed from {1} posts".format(
+                deleted, removed))
             return redirect(url_for('blog.show_tags', subsite=subsite))
 
         if (
             merge_delete_form.validate_on_submit() and
             merge_delete_form.merge_button.data
         ):
-            if len(merge_delete_form.tags.data) > 1:
-                tags_to_merge = [
-                    Tag.get_by_nicename(tag_name)
-                    for tag_name in merge_delete_form.tags.data
-                    ]
-                new_tag_name = " ".join(
-                    [c.display_name for c in tags_to_merge]
+            try:
+                new_tag, added = services.merge_terms(
+                    Tag, subsite, merge_delete_form.tags.data
                     )
-                flash("Merged tag added: "+new_tag_name)
-                new_tag = Tag(display_name=new_tag_name)
-                new_tag.make_nicename()
-                new_tag.subsite = subsite
-                if Tag.exists(new_tag.nicename):
-                    merge_delete_form.tags.errors.append(
-                        "Select more than one tag to merge"
-                        )
-                else:
-                    db.session.add(new_tag)
-                    db.session.commit()
-                    for tag in tags_to_merge:
-                        for post in tag.posts:
-                            post.tag(new_tag)
-                            db.session.add(post)
-                            flash(
-                                "Post tagged with merged tag> "
-                                + post.display_title
-                                )
-                    db.session.commit()
-                    flash("Delete old tags if no longer needed")
-                    return redirect(url_for('blog.show_tags', subsite=subsite))
+            except ValueError as error:
+                merge_delete_form.tags.errors.append(str(error))
             else:
-                merge_delete_form.categories.errors.append(
-                    "Select more than one tag to merge"
-                    )
+                flash("Merged tag added: " + new_tag.display_name)
+                flash("Posts tagged with merged tag: {0}".format(added))
+                flash("Delete old tags if no longer needed")
+                return redirect(url_for('blog.show_tags', subsite=subsite))
 
     return render_template('md_tags.html', merge_delete_form=merge_delete_form)
 
 
 @blog.route('/sitemap.xml', methods=['GET'])
+@conditional(site_updated)
 def sitemap():
-    pages = []
-    ten_days_ago = datetime.datetime.now() - datetime.timedelta(days=10)
-
-    for subsite in get_subsites():
-        pages.append(
-            [
-                url_for(
-                    'blog.show_posts',
-                    subsite=subsite,
-                    _external=True
-                ),
-                ten_days_ago
-            ]
-            )
-        pages.append(
-            [
-                url_for(
-                    'blog.show_categories',
-                    subsite=subsite,
-                    _external=True
-                ),
-                ten_days_ago
-            ]
-            )
-        pages.append(
-            [
-                url_for(
-                    'blog.show_tags',
-                    subsite=subsite,
-                    _external=True
-                ),
-                ten_days_ago
-            ]
-            )
-
-        # Blog posts
-        posts = Post.query.filter(
-            Post.subsite == subsite).filter(
-                Post.status == "publish").order_by(
-                    Post.date_updated.desc()).all()
-        for post in posts:
-            url = url_for(
-                'blog.post',
+    max_urls = current_app.config['SITEMAP_MAX_URLS']
+    counts = [
+        (subsite, Post.count_by_status(subsite, "publish"))
+        for subsite in subsites
+        ]
+    total = 3 * len(counts) + sum(count for subsite, count in counts)
+
+    if total <= max_urls:
+        def pages():
+            for page in sitemap_pages.listing_pages(subsites):
+                yield page
+            for subsite, count in counts:
+                for page in sitemap_pages.post_pages(subsite):
+                    yield page
+        return sitemap_pages.stream_xml('sitemap.xml', pages=pages())
+
+    # Too many URLs for one sitemap, list child sitemaps instead
+    sitemaps = [url_for('blog.sitemap_listings', _external=True)]
+    for subsite, count in counts:
+        sitemaps.extend(
+            url_for(
+                'blog.sitemap_posts',
                 subsite=subsite,
-                nicename=post.nicename,
+                chunk=chunk,
                 _external=True
                 )
-            modified_time = post.date_updated.isoformat()
-            pages.append([url, modified_time])
+            for chunk in range(-(-count // max_urls))
+            )
+    return sitemap_pages.stream_xml('sitemap_index.xml', sitemaps=sitemaps)
 
-    sitemap_xml = render_template('sitemap.xml', pages=pages)
-    response = make_response(sitemap_xml)
-    response.headers["Content-Type"] = "application/xml"
-    return response
+
+@blog.route('/sitemap/pages.xml', methods=['GET'])
+@conditional(site_updated)
+def sitemap_listings():
+    return sitemap_pages.stream_xml(
+        'sitemap.xml',
+        pages=sitemap_pages.listing_pages(subsites)
+        )
+
+
+@blog.route('/sitemap/<subsite>/<int:chunk>.xml', methods=['GET'])
+@conditional(wall_updated)
+def sitemap_posts(subsite, chunk):
+    if subsite not in subsites:
+        abort(404)
+    max_urls = current_app.config['SITEMAP_MAX_URLS']
+    if chunk * max_urls >= max(Post.count_by_status(subsite, "publish"), 1):
+        abort(404)
+    return sitemap_pages.stream_xml(
+        'sitemap.xml',
+        pages=sitemap_pages.post_pages(
+            subsite,
+            offset=chunk * max_urls,
+            limit=max_urls
+            )
+        )
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from xml.etree.ElementTree import iterparse
+
+from benhoyle.extensions import db
+
+from benhoyle.blueprints.blog.models import (
+    Post, PostBody, Tag, Category, Author, post_tag, post_category,
+    post_author
+    )
+from benhoyle.blueprints.blog.rendering import (
+    render_content, content_hash, make_excerpt
+    )
+
+# Only posts are imported, not pages or attachments
+POST_TYPES = frozenset(['post'])
+# Statuses not imported at all, the rest other than publish become drafts
+SKIPPED_STATUSES = frozenset(['trash', 'auto-draft', 'inherit'])
+
+
+def _name(tag):
+    """ Local name of an element, telling content:encoded and
+    excerpt:encoded apart. WordPress changes the wp namespace between
+    export versions so namespaces are otherwise ignored. """
+    namespace, _, local = tag.rpartition('}')
+    if local == 'encoded':
+        return 'excerpt' if 'excerpt' in namespace else 'content'
+    return local
+
+
+def _date(value):
+    """ Parse a WordPress date, which is all zeros when unset. """
+    if not value or value.startswith('0000'):
+        return None
+    return datetime.datetime.strptime(value.strip(), '%Y-%m-%d %H:%M:%S')
+
+
+def _fields(element):
+    """ Dict of the stripped text of an element's children by local
+    name. """
+    return dict(
+        (_name(child.tag), (child.text or '').strip()) for child in element
+        )
+
+
+def parse(source):
+    """ Stream the authors, categories, tags and posts of a WXR export.
+
+    Elements are cleared once read so that memory stays bounded however
+    large the export is.
+
+    :param source: File name or file object
+    :return: Generator of (kind, dict) tuples, kind being 'author',
+             'category', 'tag' or 'post'
+    """
+    channel = None
+    for event, element in iterparse(source, events=('start', 'end')):
+        name = _name(element.tag)
+        if event == 'start':
+            if name == 'channel':
+                channel = element
+            continue
+
+        if name == 'author' and len(element):
+            fields = _fields(element)
+            yield 'author', {
+                'login': fields.get('author_login'),
+                'email': fields.get('author_email'),
+                'display_name': fields.get('author_display_name'),
+                'first_name': fields.get('author_first_name'),
+                'last_name': fields.get('author_last_name')
+                }
+        elif name == 'category' and len(element):
+            fields = _fields(element)
+            yield 'category', {
+                'nicename': fields.get('category_nicename'),
+                'display_name': fields.get('cat_name'),
+                'parent': fields.get('category_parent') or None
+                }
+        elif name == 'tag' and len(element):
+            fields = _fields(element)
+            yield 'tag', {
+                'nicename': fields.get('tag_slug'),
+                'display_name': fields.get('tag_name')
+                }
+        elif name == 'item':
+            yield 'post', _post(element)
+        else:
+            continue
+
+        # Drop what has been read, including the channel's reference to it
+        element.clear()
+        if channel is not None:
+            channel.clear()
+
+
+def _post(element):
+    """ Dict describing the post in a WXR item element. """
+    fields = {}
+    tags, categories, authors = [], [], []
+    for child in element:
+        name = _name(child.tag)
+        if name == 'category':
+            term = (child.get('nicename'), (child.text or '').strip())
+            if child.get('domain') == 'post_tag':
+                tags.append(term)
+            elif child.get('domain') == 'category':
+                categories.append(term)
+        elif name == 'creator':
+            authors.append((child.text or '').strip())
+        elif name in ('content', 'excerpt'):
+            fields[name] = child.text or ''
+        else:
+            fields[name] = (child.text or '').strip()
+    return {
+        'display_title': fields.get('title', ''),
+        'nicename': fields.get('post_name'),
+        'content': fields.get('content', ''),
+        'excerpt': fields.get('excerpt', ''),
+        'date_published': _date(fields.get('post_date')),
+        'date_updated': _date(fields.get('post_modified')),
+        'status': fields.get('status'),
+        'post_type': fields.get('post_type', 'post'),
+        'tags': tags,
+        'categories': categories,
+        'authors': authors
+        }
+
+
+class WXRImporter(object):
+    """ Bulk import a WXR export into a subsite.
+
+    Tags, categories and authors are resolved through in memory
+    nicename/login to id maps, loaded once and extended as new ones are
+    created, rather than by a query per name. Posts, their bodies and their
+    association rows are written with executemany inserts, committed every
+    batch_size posts. Post ids are allocated here so that the bodies and
+    association rows can be written in the same batch, so nothing else
+    should add posts while an import runs.
+
+    Posts whose nicename is already taken in the subsite are skipped, so
+    an interrupted import can be run again.
+
+    :param subsite: Subsite to import into
+    :param batch_size: Posts written per transaction
+    """
+
+    def __init__(self, subsite, batch_size=1000):
+        self.subsite = subsite
+        self.batch_size = batch_size
+        self.counts = dict(
+            posts=0, skipped=0, tags=0, categories=0, authors=0
+            )
+
+        session = db.session
+        self.tags = dict(session.query(Tag.nicename, Tag.id).filter(
+            Tag.subsite == subsite))
+        self.categories = dict(session.query(
+            Category.nicename, Category.id).filter(
+                Category.subsite == subsite))
+        self.authors = dict(session.query(Author.login, Author.id))
+        self.nicenames = set(
+            row[0] for row in session.query(Post.nicename).filter(
+                Post.subsite == subsite)
+            )
+        self.next_id = (session.query(db.func.max(Post.id)).scalar() or 0) + 1
+        self._orphans = []
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._posts = []
+        self._bodies = []
+        self._post_tags = []
+        self._post_categories = []
+        self._post_authors = []
+
+    def _insert(self, table, values):
+        """ Insert a row and return its id. """
+        return db.session.execute(
+            table.insert().values(**values)).inserted_primary_key[0]
+
+    def add_author(self, author):
+        """ Return the id of the author with author['login'], adding
+        them if new. """
+        if not author['login'] or author['login'] in self.authors:
+            return self.authors.get(author['login'])
+        author = dict(author, subsite=self.subsite)
+        author['display_name'] = author.get('display_name') or author['login']
+        self.authors[author['login']] = self._insert(Author.__table__, author)
+        self.counts['authors'] += 1
+        return self.authors[author['login']]
+
+    def add_tag(self, nicename, display_name):
+        """ Return the id of the tag with nicename, adding it if new. """
+        if not nicename or nicename in self.tags:
+            return self.tags.get(nicename)
+        self.tags[nicename] = self._insert(Tag.__table__, {
+            'nicename': nicename,
+            'display_name': display_name or nicename,
+            'subsite': self.subsite
+            })
+        self.counts['tags'] += 1
+        return self.tags[nicename]
+
+    def add_category(self, nicename, display_name, parent=None):
+        """ Return the id of the category with nicename, adding it if
+        new. """
+        if not nicename or nicename in self.categories:
+            return self.categories.get(nicename)
+        self.categories[nicename] = self._insert(Category.__table__, {
+            'nicename': nicename,
+            'display_name': display_name or nicename,
+            'parent': self.categories.get(parent),
+            'subsite': self.subsite
+            })
+        if parent and parent not in self.categories:
+            self._orphans.append((nicename, parent))
+        self.counts['categories'] += 1
+        return self.categories[nicename]
+
+    def add_post(self, post):
+        """ Queue a post parsed from the export for the next batch. """
+        if post['post_type'] not in POST_TYPES:
+            return
+        nicename = post['nicename']
+        if not nicename and post['display_title']:
+            # WordPress leaves the slug of unpublished drafts empty
+            draft = Post(display_title=post['display_title'])
+            draft.make_nicename()
+            nicename = draft.nicename
+        if (
+            not nicename or
+            post['status'] in SKIPPED_STATUSES or
+            nicename in self.nicenames
+        ):
+            self.counts['skipped'] += 1
+            return
+        self.nicenames.add(nicename)
+
+        ident = self.next_id
+        self.next_id += 1
+        status = 'publish' if post['status'] == 'publish' else 'draft'
+        published = post['date_published'] if status == 'publish' else None
+        content = post['content']
+        excerpt_text, excerpt_html = make_excerpt(post['excerpt'], content)
+        self._posts.append({
+            'id': ident,
+            'display_title': post['display_title'],
+            'nicename': nicename,
+            'excerpt': post['excerpt'],
+            'excerpt_text': excerpt_text,
+            'excerpt_html': excerpt_html,
+            'date_published': published,
+            'date_published_year': published.year if published else None,
+            'date_published_month': published.month if published else None,
+            'date_updated': post['date_updated'] or post['date_published'],
+            'status': status,
+            'subsite': self.subsite
+            })
+        self._bodies.append({
+            'post_id': ident,
+            'content': content,
+            'content_html': render_content(content),
+            'content_hash': content_hash(content)
+            })
+        for tag in set(self.add_tag(*term) for term in post['tags']):
+            if tag:
+                self._post_tags.append({'post_id': ident, 'tag_id': tag})
+        for category in set(
+            self.add_category(*term) for term in post['categories']
+        ):
+            if category:
+                self._post_categories.append(
+                    {'post_id': ident, 'category_id': category})
+        for author in set(
+            self.add_author({'login': login}) for login in post['authors']
+        ):
+            if author:
+                self._post_authors.append(
+                    {'post_id': ident, 'author_id': author})
+
+        self.counts['posts'] += 1
+        if len(self._posts) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Write and commit the pending batch. """
+        for table, rows in [
+            (Post.__table__, self._posts),
+            (PostBody.__table__, self._bodies),
+            (post_tag, self._post_tags),
+            (post_category, self._post_categories),
+            (post_author, self._post_authors)
+        ]:
+            if rows:
+                db.session.execute(table.insert(), rows)
+        db.session.commit()
+        self._reset_batch()
+
+    def run(self, source):
+        """ Import everything in source.
+
+        :param source: File name or file object of the export
+        :return: Dict of the number of posts, skipped posts, tags,
+                 categories and authors added
+        """
+        for kind, item in parse(source):
+            if kind == 'author':
+                self.add_author(item)
+            elif kind == 'tag':
+                self.add_tag(item['nicename'], item['display_name'])
+            elif kind == 'category':
+                self.add_category(
+                    item['nicename'], item['display_name'], item['parent'])
+            else:
+                self.add_post(item)
+
+        # Categories listed before their parent
+        for nicename, parent in self._orphans:
+            if parent in self.categories:
+                db.session.execute(Category.__table__.update().where(
+                    Category.id == self.categories[nicename]).values(
+                        parent=self.categories[parent]))
+        self.flush()
+        return self.counts
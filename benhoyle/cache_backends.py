@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from werkzeug.contrib.cache import BaseCache, RedisCache
+
+
+class SQLiteCache(BaseCache):
+    """ Cache stored in a SQLite file so that every worker process on the
+    host shares the same entries and sees the same invalidations.
+
+    Entries are evicted least recently used first once there are more than
+    threshold of them or their pickled size passes max_size. clear() does
+    not delete anything, it moves the cache to a new generation so that
+    every worker stops seeing the old entries at once; they are removed
+    by the next prune.
+
+    :param path: Path of the SQLite file
+    :param threshold: Maximum number of entries
+    :param max_size: Maximum total size of the pickled values in bytes
+    :param default_timeout: Default timeout in seconds, 0 never expires
+    :param prune_interval: Check the caps every this many writes
+    """
+
+    # Only refresh an entry's last access time this often, so that reads
+    # rarely need the write lock
+    access_resolution = 10
+
+    def __init__(self, path, threshold=500, max_size=None,
+                 default_timeout=300, prune_interval=50):
+        BaseCache.__init__(self, default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self.max_size = max_size
+        self.prune_interval = prune_interval
+        self._local = threading.local()
+        self._writes = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB, size INTEGER, '
+                'generation INTEGER, expires REAL, accessed REAL)'
+                )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS ix_cache_accessed '
+                'ON cache (accessed)'
+                )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_meta ('
+                'name TEXT PRIMARY KEY, value INTEGER)'
+                )
+            connection.execute(
+                "INSERT OR IGNORE INTO cache_meta VALUES ('generation', 0)"
+                )
+
+    def _connection(self):
+        """ Return this process and thread's connection to the cache file,
+        reconnecting after a fork. """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None
+                )
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.pid = os.getpid()
+        return local.connection
+
+    def _expires(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        if timeout > 0:
+            return time.time() + timeout
+        return 0
+
+    def generation(self):
+        """ Return the current cache generation. """
+        return self._connection().execute(
+            "SELECT value FROM cache_meta WHERE name = 'generation'"
+            ).fetchone()[0]
+
+    def get(self, key):
+        return self.get_many(key)[0]
+
+    def get_many(self, *keys):
+        if not keys:
+            return []
+        now = time.time()
+        connection = self._connection()
+        rows = connection.execute(
+            'SELECT key, value, accessed FROM cache '
+            'WHERE key IN ({0}) AND (expires = 0 OR expires > ?) '
+            'AND generation = '
+            "(SELECT value FROM cache_meta WHERE name = 'generation')".format(
+                ', '.join('?' * len(keys))),
+            keys + (now,)
+            ).fetchall()
+        found = {}
+        stale = []
+        for key, value, accessed in rows:
+            found[key] = pickle.loads(value)
+            if accessed < now - self.access_resolution:
+                stale.append((now, key))
+        if stale:
+            connection.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?', stale
+                )
+        return [found.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        return self.set_many({key: value}, timeout)
+
+    def set_many(self, mapping, timeout=None):
+        now = time.time()
+        expires = self._expires(timeout)
+        rows = []
+        for key, value in mapping.items():
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            rows.append((key, sqlite3.Binary(data), len(data), expires, now))
+        connection = self._connection()
+        connection.executemany(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, '
+            "(SELECT value FROM cache_meta WHERE name = 'generation'), ?, ?)",
+            rows
+            )
+        self._writes += len(rows)
+        if self._writes >= self.prune_interval:
+            self._writes = 0
+            self.prune()
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def delete(self, key):
+        return self.delete_many(key)
+
+    def delete_many(self, *keys):
+        if keys:
+            self._connection().execute(
+                'DELETE FROM cache WHERE key IN ({0})'.format(
+                    ', '.join('?' * len(keys))),
+                keys
+                )
+        return True
+
+    def clear(self):
+        self._connection().execute(
+            "UPDATE cache_meta SET value = value + 1 WHERE name = 'generation'"
+            )
+        return True
+
+    def prune(self):
+        """ Drop expired and old generation entries, then the least
+        recently used until within the entry and size caps. """
+        connection = self._connection()
+        connection.execute(
+            'DELETE FROM cache WHERE (expires != 0 AND expires <= ?) '
+            'OR generation != '
+            "(SELECT value FROM cache_meta WHERE name = 'generation')",
+            (time.time(),)
+            )
+        count, size = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+            ).fetchone()
+        excess = count - self.threshold
+        if excess > 0:
+            connection.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (excess,)
+                )
+            size = connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM cache'
+                ).fetchone()[0]
+        if self.max_size and size > self.max_size:
+            # Walk from the least recently used until enough is freed
+            to_free = size - self.max_size
+            victims = []
+            for key, entry_size in connection.execute(
+                'SELECT key, size FROM cache ORDER BY accessed'
+            ):
+                victims.append((key,))
+                to_free -= entry_size
+                if to_free <= 0:
+                    break
+            connection.executemany('DELETE FROM cache WHERE key = ?', victims)
+
+
+def sqlite(app, config, args, kwargs):
+    """ Flask-Cache factory for a SQLiteCache shared by all workers. """
+    directory = config['CACHE_DIR'] or os.path.join(app.instance_path, 'cache')
+    kwargs.update(dict(threshold=config['CACHE_THRESHOLD']))
+    return SQLiteCache(os.path.join(directory, 'cache.db'), *args, **kwargs)
+
+
+def redis(app, config, args, kwargs):
+    """ Flask-Cache factory for a Redis, or Redis compatible, server given
+    by CACHE_REDIS_URL. Needs the optional redis package. """
+    try:
+        from redis import from_url
+    except ImportError:
+        raise RuntimeError(
+            'CACHE_REDIS_URL is set but the redis package is not installed, '
+            'see requirements.txt')
+    kwargs.pop('max_size', None)
+    kwargs.pop('prune_interval', None)
+    kwargs.update(dict(key_prefix=config['CACHE_KEY_PREFIX']))
+    return RedisCache(from_url(config['CACHE_REDIS_URL']), *args, **kwargs)
+
+
+def shared(app, config, args, kwargs):
+    """ Flask-Cache factory for a cache shared between workers: Redis if
+    CACHE_REDIS_URL is configured, otherwise a SQLite file. """
+    if config.get('CACHE_REDIS_URL'):
+        return redis(app, config, args, kwargs)
+    return sqlite(app, config, args, kwargs)
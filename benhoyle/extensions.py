@@ -1,11 +1,18 @@
-from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CsrfProtect
 from flask_login import LoginManager
 from flask_cache import Cache
 from flask_debugtoolbar import DebugToolbarExtension
 
-db = SQLAlchemy()
+from benhoyle.instrumentation import SQLInstrumentation
+from benhoyle.metrics import Metrics
+from benhoyle.pragmas import SQLitePragmas
+from benhoyle.replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
 csrf = CsrfProtect()
 login_manager = LoginManager()
-cache = Cache(config={'CACHE_TYPE': 'simple'})
+cache = Cache()
 debug_toolbar = DebugToolbarExtension()
+instrumentation = SQLInstrumentation()
+metrics = Metrics()
+pragmas = SQLitePragmas()
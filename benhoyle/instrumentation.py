@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import random
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def parameter_shape(parameters, executemany=False):
+    """ Describe bound parameters by their types rather than their values,
+    so that slow queries can be logged without leaking what readers or
+    authors sent and queries differing only in values log alike.
+
+    :param parameters: Parameters as passed to the DBAPI cursor
+    :param executemany: Whether parameters is a list of parameter sets
+    :return: String such as "(int, str)" or "3 x {id: int}"
+    """
+    if executemany:
+        parameters = list(parameters)
+        if not parameters:
+            return '0 x ()'
+        return '{0} x {1}'.format(
+            len(parameters), parameter_shape(parameters[0]))
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(
+            '{0}: {1}'.format(k, type(v).__name__)
+            for k, v in sorted(parameters.items())
+            ) + '}'
+    return '(' + ', '.join(
+        type(v).__name__ for v in parameters or ()) + ')'
+
+
+def _stats():
+    """ Statistics of the current request, or None if it is not being
+    instrumented. """
+    if not has_request_context():
+        return None
+    return g.get('db_stats')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if _stats() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = _stats()
+    starts = conn.info.get('query_start')
+    if stats is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats['queries'] += 1
+    stats['time'] += elapsed
+
+    if elapsed >= current_app.config['SQL_SLOW_QUERY_SECONDS']:
+        current_app.logger.warning(
+            'Slow query %.1fms on %s %s: %s %s',
+            elapsed * 1000, request.method, request.endpoint,
+            ' '.join(statement.split()),
+            parameter_shape(parameters, executemany)
+            )
+
+
+class SQLInstrumentation(object):
+    """ Count the SQL statements of each request and the time spent in
+    them, reported in the X-DB-Queries and Server-Timing response headers,
+    and log statements slower than SQL_SLOW_QUERY_SECONDS with the route
+    that ran them.
+
+    Only SQL_SAMPLE_RATE of requests are instrumented. The engine
+    listeners return at once for the rest, so a low rate keeps the cost
+    negligible under load.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_SAMPLE_RATE', 1.0)
+        app.config.setdefault('SQL_SLOW_QUERY_SECONDS', 0.25)
+
+        # Listen on every engine, whichever app or worker created it
+        if not event.contains(
+            Engine, 'before_cursor_execute', _before_cursor_execute
+        ):
+            event.listen(
+                Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(
+                Engine, 'after_cursor_execute', _after_cursor_execute)
+
+        app.before_request(self._start)
+        app.after_request(self._report)
+
+    @staticmethod
+    def _start():
+        rate = current_app.config['SQL_SAMPLE_RATE']
+        g.db_stats = None
+        if rate > 0 and (rate >= 1 or random.random() < rate):
+            g.db_stats = {
+                'queries': 0, 'time': 0.0, 'start': time.perf_counter()
+                }
+
+    @staticmethod
+    def _report(response):
+        # Left on g for the metrics recorded after the response
+        stats = g.get('db_stats')
+        if stats is None:
+            return response
+        total = time.perf_counter() - stats['start']
+        response.headers['X-DB-Queries'] = str(stats['queries'])
+        response.headers.add(
+            'Server-Timing',
+            'db;dur={0:.2f};desc="{1} queries", total;dur={2:.2f}'.format(
+                stats['time'] * 1000, stats['queries'], total * 1000)
+            )
+        return response
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from flask import (
+    abort, current_app, g, request, Response, before_render_template,
+    template_rendered
+    )
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+    )
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304
+    )
+
+# Name, type and help of every metric, in the order they are exposed
+METRICS = [
+    ('http_request_duration_seconds', 'histogram',
+     'Time to handle a request, by endpoint'),
+    ('http_response_size_bytes', 'histogram',
+     'Size of the response body, by endpoint'),
+    ('http_requests_total', 'counter',
+     'Requests handled, by endpoint and status'),
+    ('template_render_seconds', 'histogram',
+     'Time to render a template, by template'),
+    ('db_queries_per_request', 'histogram',
+     'SQL statements run by an instrumented request, by endpoint'),
+    ('db_seconds_per_request', 'histogram',
+     'Time spent in SQL by an instrumented request, by endpoint'),
+    ('page_cache_requests_total', 'counter',
+     'Requests for cacheable pages, by whether they were a hit'),
+    ('page_cache_hit_ratio', 'gauge',
+     'Fraction of requests for cacheable pages served from the cache')
+    ]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace(
+        '"', '\\"')
+
+
+def _labels(**labels):
+    return ','.join(
+        '{0}="{1}"'.format(k, _escape(v)) for k, v in sorted(labels.items())
+        )
+
+
+# The bound label of a histogram bucket
+_LE = re.compile(r'(^|,)le="([^"]*)"')
+
+
+def _bucket_order(sample):
+    """ Sort key putting the buckets of each series in ascending order of
+    bound, +Inf last, rather than in the string order they are stored in.
+    """
+    labels = sample[0]
+    match = _LE.search(labels)
+    bound = float(match.group(2)) if match else float('inf')
+    return _LE.sub('', labels), bound
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsStore(object):
+    """ Metric samples kept in a SQLite file so that every worker process
+    on the host adds to the same totals and any of them can serve the
+    whole.
+
+    Each worker collects its increments in memory and adds them to the
+    file at most every flush_interval seconds, in one transaction, so a
+    request normally costs no write at all.
+
+    :param path: Path of the SQLite file
+    :param flush_interval: Seconds between writes of a worker's increments
+    """
+
+    def __init__(self, path, flush_interval=5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushed = time.time()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS sample ('
+            'name TEXT, labels TEXT, value REAL, '
+            'PRIMARY KEY (name, labels))'
+            )
+
+    def _connection(self):
+        """ Return this process and thread's connection to the file,
+        reconnecting after a fork. """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None
+                )
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.pid = os.getpid()
+        return local.connection
+
+    def inc(self, name, labels, amount=1):
+        """ Add amount to the sample name{labels}. """
+        key = (name, labels)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+        if time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def observe(self, name, buckets, value, **labels):
+        """ Record value in the histogram name. """
+        for bound in buckets + (float('inf'),):
+            if value <= bound:
+                self.inc(
+                    name + '_bucket', _labels(le=_format(bound), **labels))
+        self.inc(name + '_sum', _labels(**labels), value)
+        self.inc(name + '_count', _labels(**labels))
+
+    def flush(self):
+        """ Add this worker's pending increments to the shared totals. """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.time()
+        if not pending:
+            return
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT INTO sample VALUES (?, ?, ?) '
+                'ON CONFLICT (name, labels) '
+                'DO UPDATE SET value = value + excluded.value',
+                [(n, labels, v) for (n, labels), v in pending.items()]
+                )
+
+    def samples(self):
+        """ Return {name: [(labels, value)]} of every sample of every
+        worker, including this one's pending increments. """
+        self.flush()
+        samples = {}
+        for name, labels, value in self._connection().execute(
+            'SELECT name, labels, value FROM sample ORDER BY name, labels'
+        ):
+            samples.setdefault(name, []).append((labels, value))
+        return samples
+
+    def clear(self):
+        """ Forget every sample. """
+        with self._lock:
+            self._pending = {}
+        self._connection().execute('DELETE FROM sample')
+
+
+def exposition(samples):
+    """ Render samples in the Prometheus text exposition format. """
+    requests = samples.get('page_cache_requests_total', [])
+    hits = sum(
+        value for labels, value in requests if 'result="hit"' in labels)
+    total = sum(value for labels, value in requests)
+    samples = dict(samples, page_cache_hit_ratio=[
+        ('', float(hits) / total if total else 0.0)
+        ])
+
+    lines = []
+    for name, kind, description in METRICS:
+        lines.append('# HELP {0} {1}'.format(name, description))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        suffixes = ['_bucket', '_sum', '_count'] if kind == 'histogram' \
+            else ['']
+        for suffix in suffixes:
+            series = samples.get(name + suffix, [])
+            if suffix == '_bucket':
+                series = sorted(series, key=_bucket_order)
+            for labels, value in series:
+                if value == int(value):
+                    value = int(value)
+                lines.append('{0}{1} {2}'.format(
+                    name + suffix, '{' + labels + '}' if labels else '',
+                    _format(value)
+                    ))
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics(object):
+    """ Record request latency, response size, template render time, SQL
+    statements per request and page cache hits, and serve them at
+    /metrics for Prometheus.
+
+    The samples of all the workers are added up in the SQLite file at
+    METRICS_PATH. /metrics answers 404 unless METRICS_TOKEN is set, and
+    403 unless the scraper sends it as a bearer token.
+    """
+
+    def __init__(self, app=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        self.store = MetricsStore(
+            app.config['METRICS_PATH'], app.config['METRICS_FLUSH_INTERVAL']
+            )
+        atexit.register(self.store.flush)
+        app.extensions['metrics'] = self
+
+        app.before_request(self._start)
+        app.after_request(self._record)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._end_render, app)
+        app.add_url_rule('/metrics', 'metrics', self._serve)
+
+    @staticmethod
+    def _start():
+        g.metrics_start = time.perf_counter()
+        g.metrics_renders = []
+
+    def _record(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        endpoint = request.endpoint or 'none'
+        store = self.store
+
+        store.observe(
+            'http_request_duration_seconds', LATENCY_BUCKETS,
+            time.perf_counter() - start, endpoint=endpoint
+            )
+        store.inc('http_requests_total', _labels(
+            endpoint=endpoint, status=response.status_code))
+        if not response.is_streamed:
+            store.observe(
+                'http_response_size_bytes', SIZE_BUCKETS,
+                len(response.get_data()), endpoint=endpoint
+                )
+
+        # Left by the SQL instrumentation on the requests it samples
+        db_stats = g.get('db_stats')
+        if db_stats is not None:
+            store.observe(
+                'db_queries_per_request', QUERY_BUCKETS,
+                db_stats['queries'], endpoint=endpoint
+                )
+            store.observe(
+                'db_seconds_per_request', LATENCY_BUCKETS,
+                db_stats['time'], endpoint=endpoint
+                )
+
+        result = response.headers.get('X-Cache')
+        if result:
+            store.inc('page_cache_requests_total', _labels(
+                result=result.lower()))
+        return response
+
+    @staticmethod
+    def _start_render(sender, template, context, **extra):
+        if g.get('metrics_renders') is not None:
+            g.metrics_renders.append(time.perf_counter())
+
+    def _end_render(self, sender, template, context, **extra):
+        renders = g.get('metrics_renders')
+        if renders:
+            self.store.observe(
+                'template_render_seconds', LATENCY_BUCKETS,
+                time.perf_counter() - renders.pop(),
+                template=template.name or 'string'
+                )
+
+    def _serve(self):
+        token = current_app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        if request.headers.get('Authorization') != 'Bearer ' + token:
+            abort(403)
+        return Response(
+            exposition(self.store.samples()),
+            mimetype='text/plain; version=0.0.4'
+            )
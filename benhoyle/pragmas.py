@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+
+from sqlalchemy import event
+
+# Pragmas reported by status, those set on connection first
+STATUS_PRAGMAS = [
+    'journal_mode', 'synchronous', 'busy_timeout', 'cache_size',
+    'mmap_size', 'page_size', 'page_count', 'freelist_count',
+    'wal_autocheckpoint'
+    ]
+
+SYNCHRONOUS = {0: 'off', 1: 'normal', 2: 'full', 3: 'extra'}
+
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+_NAME = re.compile(r'^[a-z_]+$')
+_WORD = re.compile(r'^[A-Za-z]+$')
+
+
+def check_pragmas(pragmas):
+    """ Check that pragma names and values can be written into statements:
+    names are lower case words, values integers or single words.
+
+    :param pragmas: {name: value}
+    :raises ValueError: For a name or value that is not allowed
+    """
+    for name, value in pragmas.items():
+        if not _NAME.match(name):
+            raise ValueError('Bad SQLite pragma name {0!r}'.format(name))
+        if not (isinstance(value, int) or _WORD.match(str(value))):
+            raise ValueError('Bad value {0!r} for SQLite pragma {1}'.format(
+                value, name))
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """ Set pragmas on a new sqlite3 connection. busy_timeout is set first
+    so that switching the journal mode waits for other connections rather
+    than failing.
+
+    :param dbapi_connection: sqlite3 connection
+    :param pragmas: {name: value}, checked by check_pragmas
+    :return: None
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name in sorted(pragmas, key=lambda n: n != 'busy_timeout'):
+            cursor.execute('PRAGMA {0} = {1}'.format(name, pragmas[name]))
+    finally:
+        cursor.close()
+
+
+def optimize(connection):
+    """ Let SQLite refresh the statistics the query planner uses, when it
+    thinks they are out of date. Usually a no-op.
+
+    :param connection: SQLAlchemy connection
+    :return: None
+    """
+    connection.execute('PRAGMA optimize')
+
+
+def checkpoint(connection, mode='PASSIVE'):
+    """ Copy the write-ahead log back into the database file.
+
+    PASSIVE never waits, copying what readers allow. TRUNCATE waits for
+    readers, up to busy_timeout, then empties the log file.
+
+    :param connection: SQLAlchemy connection
+    :param mode: One of CHECKPOINT_MODES
+    :return: Tuple of (1 if blocked else 0, pages in the log, pages copied)
+             or None if the database is not in WAL mode
+    """
+    if mode.upper() not in CHECKPOINT_MODES:
+        raise ValueError('Bad checkpoint mode {0!r}'.format(mode))
+    row = connection.execute(
+        'PRAGMA wal_checkpoint({0})'.format(mode.upper())).first()
+    if row is None or row[1] == -1:
+        return None
+    return tuple(row)
+
+
+def status(connection):
+    """ Report the pragmas in effect on a connection and the size of the
+    database and its write-ahead log.
+
+    :param connection: SQLAlchemy connection
+    :return: List of (name, value) tuples
+    """
+    report = []
+    for name in STATUS_PRAGMAS:
+        value = connection.execute('PRAGMA {0}'.format(name)).scalar()
+        if name == 'synchronous':
+            value = SYNCHRONOUS.get(value, value)
+        report.append((name, value))
+
+    path = connection.engine.url.database
+    if path:
+        for name, suffix in [('file_bytes', ''), ('wal_bytes', '-wal')]:
+            try:
+                report.append((name, os.path.getsize(path + suffix)))
+            except OSError:
+                report.append((name, 0))
+    return report
+
+
+class SQLitePragmas(object):
+    """ Tune the SQLite database for many readers and the odd writer.
+
+    Every new connection gets SQLITE_PRAGMAS, by default the write-ahead
+    log so that readers no longer wait for a saving author, a busy timeout
+    rather than "database is locked", and memory mapped reads.
+
+    Each worker also runs PRAGMA optimize every SQLITE_OPTIMIZE_INTERVAL
+    seconds and checkpoints the log every SQLITE_CHECKPOINT_INTERVAL
+    seconds, after the response of the request that falls due has been
+    sent. An interval of 0 turns the task off.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLITE_PRAGMAS', {})
+        app.config.setdefault('SQLITE_OPTIMIZE_INTERVAL', 3600)
+        app.config.setdefault('SQLITE_CHECKPOINT_INTERVAL', 300)
+        app.config.setdefault('SQLITE_CHECKPOINT_MODE', 'PASSIVE')
+
+        db = app.extensions['sqlalchemy'].db
+        engine = db.get_engine(app)
+        if engine.dialect.name != 'sqlite':
+            return
+
+        pragmas = dict(app.config['SQLITE_PRAGMAS'])
+        check_pragmas(pragmas)
+
+        def set_pragmas(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+        # Read replicas are tuned alike, maintenance is left to the primary
+        for tuned in [engine] + db.get_read_engines(app):
+            if tuned.dialect.name == 'sqlite':
+                event.listen(tuned, 'connect', set_pragmas)
+
+        tasks = [
+            (optimize, (), app.config['SQLITE_OPTIMIZE_INTERVAL']),
+            (checkpoint, (app.config['SQLITE_CHECKPOINT_MODE'],),
+             app.config['SQLITE_CHECKPOINT_INTERVAL'])
+            ]
+        tasks = [task for task in tasks if task[2]]
+        if not tasks:
+            return
+        # Last run of each task in this worker, first due one interval on
+        due = dict((task[0], time.time()) for task in tasks)
+
+        def maintain():
+            now = time.time()
+            with engine.connect() as connection:
+                for function, args, interval in tasks:
+                    if now - due[function] >= interval:
+                        due[function] = now
+                        try:
+                            function(connection, *args)
+                        except Exception:
+                            app.logger.exception(
+                                'SQLite %s failed', function.__name__)
+
+        @app.after_request
+        def schedule(response):
+            now = time.time()
+            if any(now - due[task[0]] >= task[2] for task in tasks):
+                response.call_on_close(maintain)
+            return response
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import shutil
+import sqlite3
+import time
+
+import sqlalchemy
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.expression import UpdateBase
+
+# Requests whose reads may go to a read engine
+READ_METHODS = ('GET', 'HEAD')
+
+# Key in the Flask session of the time until which an author who saved
+# something reads from the primary
+STICKY_KEY = 'db_primary_until'
+
+
+def use_primary(view):
+    """ Mark a view as reading from the primary database even on GET, for
+    pages authors use to change things. Goes below the route decorators.
+    """
+    view.use_primary = True
+    return view
+
+
+def _wrote():
+    """ Note that the current request has written, so that the rest of it
+    and, after a save, the author's next requests read what it wrote. """
+    if has_request_context():
+        g.db_wrote = True
+        g.db_read_engine = None
+
+
+class RoutingSession(SignallingSession):
+    """ Session sending the reads of read-only requests to the read engine
+    chosen for the request, and everything else to the primary. """
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = SignallingSession.get_bind(self, mapper, clause)
+        if self._flushing or isinstance(clause, UpdateBase):
+            _wrote()
+            return primary
+        if not has_request_context() or primary is not self.bind:
+            return primary
+        return g.get('db_read_engine') or primary
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    _wrote()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy with read engines for SQLALCHEMY_READ_URIS, e.g.
+    copies of the SQLite file kept up to date by "sqlite replicate" or
+    Postgres replicas.
+
+    GET and HEAD requests read from one of them picked at random, unless
+    their view is marked use_primary. Writes always go to the primary, and
+    so do the rest of the reads of a request once it has written. After a
+    request that saves something, the author reads from the primary for
+    SQLALCHEMY_READ_STICKY_SECONDS, long enough for the replicas to catch
+    up.
+
+    Anonymous readers may fill the page and count caches from a replica
+    that has not caught up with a save, so whatever brings the replicas
+    up to date must clear the cache afterwards, as "sqlite replicate"
+    does.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_READ_URIS', [])
+        app.config.setdefault('SQLALCHEMY_READ_STICKY_SECONDS', 30)
+        SQLAlchemy.init_app(self, app)
+        app.before_request(self._route)
+        app.after_request(self._stick)
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def get_read_engines(self, app):
+        """ Return the read engines of app, created as Flask-SQLAlchemy
+        creates its primary engine. """
+        with self._engine_lock:
+            state = get_state(app)
+            engines = getattr(state, 'read_engines', None)
+            if engines is None:
+                engines = []
+                for uri in app.config['SQLALCHEMY_READ_URIS']:
+                    info = make_url(uri)
+                    options = {'convert_unicode': True}
+                    self.apply_pool_defaults(app, options)
+                    self.apply_driver_hacks(app, info, options)
+                    engines.append(sqlalchemy.create_engine(info, **options))
+                state.read_engines = engines
+            return engines
+
+    def _route(self):
+        # Chosen per request, as g can outlive one
+        g.db_wrote = False
+        g.db_read_engine = None
+        engines = self.get_read_engines(current_app)
+        if not engines or request.method not in READ_METHODS:
+            return
+        view = current_app.view_functions.get(request.endpoint)
+        if getattr(view, 'use_primary', False):
+            return
+        if session.get(STICKY_KEY, 0) > time.time():
+            return
+        g.db_read_engine = random.choice(engines)
+
+    @staticmethod
+    def _stick(response):
+        seconds = current_app.config['SQLALCHEMY_READ_STICKY_SECONDS']
+        if g.get('db_wrote') and request.method not in READ_METHODS and \
+                seconds and current_app.config['SQLALCHEMY_READ_URIS']:
+            session[STICKY_KEY] = time.time() + seconds
+        return response
+
+
+def replicate(primary_uri, replica_uri, attempts=5):
+    """ Copy a SQLite database over a read replica.
+
+    The primary's write-ahead log is checkpointed into the database file,
+    which is then copied while holding the write lock so that no commit
+    can change it. Readers of the primary carry on; writers wait for the
+    copy, up to their busy timeout. The copy replaces the replica in one
+    rename, so readers of the replica see either the old copy or the new
+    one. Works without the backup API, which needs Python 3.7.
+
+    :param primary_uri: SQLAlchemy URI of the primary SQLite file
+    :param replica_uri: SQLAlchemy URI of the replica SQLite file
+    :param attempts: Times to checkpoint before giving up when writers
+                     keep adding to the log
+    :return: Pages in the copy
+    :raises RuntimeError: If the log could not be emptied
+    """
+    paths = [make_url(uri).database for uri in (primary_uri, replica_uri)]
+    for uri, path in zip((primary_uri, replica_uri), paths):
+        if make_url(uri).get_backend_name() != 'sqlite' or not path:
+            raise ValueError('Only SQLite files can be replicated')
+    primary, replica = paths
+    temporary = replica + '.tmp'
+
+    source = sqlite3.connect(primary, timeout=30, isolation_level=None)
+    try:
+        for _ in range(attempts):
+            source.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            source.execute('BEGIN IMMEDIATE')
+            # A commit between the checkpoint and the lock refills the log
+            if not os.path.exists(primary + '-wal') or \
+                    os.path.getsize(primary + '-wal') == 0:
+                break
+            source.execute('ROLLBACK')
+        else:
+            raise RuntimeError('Could not checkpoint {0}'.format(primary))
+        try:
+            shutil.copyfile(primary, temporary)
+        finally:
+            source.execute('ROLLBACK')
+    finally:
+        source.close()
+
+    os.replace(temporary, replica)
+    copy = sqlite3.connect(replica)
+    try:
+        return copy.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        copy.close()
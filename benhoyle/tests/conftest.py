@@ -2,7 +2,7 @@ import pytest
 
 from config import settings
 from benhoyle.app import create_app
-from benhoyle.extensions import db as _db
+from benhoyle.extensions import db as _db, cache
 from benhoyle.blueprints.blog.models import Author
 
 
@@ -18,7 +18,9 @@ def app():
         'DEBUG': False,
         'TESTING': True,
         'WTF_CSRF_ENABLED': False,
-        'SQLALCHEMY_DATABASE_URI': db_uri
+        'SQLALCHEMY_DATABASE_URI': db_uri,
+        'CACHE_DIR': '{0}_test'.format(settings.CACHE_DIR),
+        'METRICS_PATH': '{0}_test'.format(settings.METRICS_PATH)
     }
 
     _app = create_app(settings_override=params)
@@ -40,6 +42,9 @@ def client(app):
     :param app: Pytest fixture
     :return: Flask app client
     """
+    # Start each test without pages or counts cached by earlier tests.
+    cache.clear()
+
     yield app.test_client()
 
 
@@ -0,0 +1,57 @@
+from benhoyle.blueprints.blog import bench
+from benhoyle.blueprints.blog.models import Post
+
+
+class TestBench(object):
+
+    def test_percentile(self):
+        latencies = list(range(1, 101))
+        assert bench.percentile(latencies, 50) == 50
+        assert bench.percentile(latencies, 99) == 99
+        assert bench.percentile([7], 99) == 7
+        assert bench.percentile([], 50) is None
+
+    def test_compare(self):
+        """ Slower latencies and lower throughput beyond the threshold are
+        regressions, smaller changes and new routes are not. """
+        baseline = {'routes': {
+            'post': {'p50_ms': 10.0, 'p99_ms': 20.0, 'rps': 100.0},
+            'show_tags': {'p50_ms': 10.0, 'p99_ms': 20.0, 'rps': 100.0}
+            }}
+        current = {'routes': {
+            'post': {'p50_ms': 10.5, 'p99_ms': 30.0, 'rps': 80.0},
+            'show_tags': {'p50_ms': 5.0, 'p99_ms': 10.0, 'rps': 200.0},
+            'search': {'p50_ms': 50.0, 'p99_ms': 90.0, 'rps': 20.0}
+            }}
+        regressions = bench.compare(baseline, current, threshold=0.1)
+        assert [(r[0], r[1]) for r in regressions] == [
+            ('post', 'p99_ms'), ('post', 'rps')
+            ]
+
+    def test_seed_and_run(self, app, client, db):
+        """ Every public route of a seeded subsite answers and is
+        measured. """
+        if not Post.query.filter(Post.subsite == "Bench1").count():
+            assert bench.seed(
+                posts=10, tags=5, categories=2, content_words=50
+                ) == ["Bench1"]
+        assert Post.query.filter(Post.subsite == "Bench1").count() == 10
+
+        with app.test_request_context():
+            pages = bench.routes("Bench1")
+        names = [name for name, url in pages]
+        for name in ['post', 'tag_postwall', 'category_feed',
+                     'archive_month', 'search']:
+            assert name in names
+
+        results = bench.run(
+            bench.client_getter(client), pages, requests=3, warmup=1)
+        assert set(results) == set(names)
+        for result in results.values():
+            assert result['errors'] == 0
+            assert result['requests'] == 3
+            assert result['p50_ms'] <= result['p99_ms']
+
+        report = bench.report(results, target='client')
+        assert report['meta']['target'] == 'client'
+        assert report['routes'] == results
@@ -0,0 +1,133 @@
+import sys
+import time
+import types
+from fnmatch import fnmatch
+
+import pytest
+
+from benhoyle import cache_backends
+from benhoyle.cache_backends import SQLiteCache
+
+
+class StubRedis(object):
+    """ Just enough of a redis-py client for RedisCache, over a dict. """
+
+    def __init__(self, url):
+        self.url = url
+        self.data = {}
+        self.timeouts = {}
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def mget(self, names):
+        return [self.data.get(name) for name in names]
+
+    def set(self, name, value):
+        self.data[name] = value
+        self.timeouts.pop(name, None)
+        return True
+
+    def setex(self, name, value, time):
+        self.data[name] = value
+        self.timeouts[name] = time
+        return True
+
+    def delete(self, *names):
+        return len([n for n in names if self.data.pop(n, None) is not None])
+
+    def keys(self, pattern):
+        return [name for name in self.data if fnmatch(name, pattern)]
+
+
+def redis_config(**config):
+    """ Cache settings with a Redis server configured. """
+    config.setdefault('CACHE_REDIS_URL', 'redis://cache.example:6379/0')
+    config.setdefault('CACHE_KEY_PREFIX', 'blog/')
+    return config
+
+
+class TestSQLiteCache(object):
+
+    def test_shared_between_instances(self, tmpdir):
+        """ Entries and clears are seen by every instance on the file. """
+        path = str(tmpdir.join('cache.db'))
+        worker1 = SQLiteCache(path)
+        worker2 = SQLiteCache(path)
+
+        worker1.set('key', {'value': 1})
+        assert worker2.get('key') == {'value': 1}
+
+        worker2.clear()
+        assert worker1.get('key') is None
+
+    def test_expiry(self, tmpdir):
+        """ Entries expire after their timeout, 0 never expires. """
+        cache = SQLiteCache(str(tmpdir.join('cache.db')))
+        cache.set('short', 1, timeout=1)
+        cache.set('forever', 2, timeout=0)
+        assert cache.get_many('short', 'forever') == [1, 2]
+
+        time.sleep(1.1)
+
+        assert cache.get_many('short', 'forever') == [None, 2]
+
+    def test_lru_eviction(self, tmpdir):
+        """ The least recently used entries go first past the threshold. """
+        cache = SQLiteCache(
+            str(tmpdir.join('cache.db')), threshold=3, prune_interval=1)
+        cache.access_resolution = 0
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        cache.get('a')
+        cache.set('d', 4)
+
+        assert cache.get_many('a', 'b', 'c', 'd') == [1, None, 3, 4]
+
+    def test_size_cap(self, tmpdir):
+        """ Entries are evicted until the total size is under the cap. """
+        cache = SQLiteCache(
+            str(tmpdir.join('cache.db')), max_size=3000, prune_interval=1)
+        for key in 'abcd':
+            cache.set(key, 'x' * 1000)
+
+        assert cache.get('a') is None
+        assert cache.get('d') == 'x' * 1000
+
+
+class TestRedisCache(object):
+
+    def test_stub_client(self, monkeypatch):
+        """ The shared factory uses Redis when CACHE_REDIS_URL is set,
+        keeping keys under the prefix. """
+        module = types.ModuleType('redis')
+        module.from_url = StubRedis
+        monkeypatch.setitem(sys.modules, 'redis', module)
+
+        cache = cache_backends.shared(None, redis_config(), (), {
+            'default_timeout': 300, 'max_size': 1000, 'prune_interval': 10
+            })
+        client = cache._client
+        assert client.url == 'redis://cache.example:6379/0'
+
+        cache.set('page', {'body': b'x'})
+        cache.set('generation', 'abc', timeout=0)
+        assert sorted(client.data) == ['blog/generation', 'blog/page']
+        assert client.timeouts == {'blog/page': 300}
+        assert cache.get_many('page', 'generation', 'missing') == [
+            {'body': b'x'}, 'abc', None]
+
+        cache.delete_many('page')
+        assert cache.get('page') is None
+        client.data['other'] = b'1'
+        cache.clear()
+        assert list(client.data) == ['other']
+
+    def test_missing_package(self, monkeypatch):
+        """ Without the redis package the error says what is missing. """
+        monkeypatch.setitem(sys.modules, 'redis', None)
+
+        with pytest.raises(RuntimeError) as error:
+            cache_backends.redis(None, redis_config(), (), {})
+        assert 'redis package' in str(error.value)
@@ -0,0 +1,74 @@
+import datetime
+
+from flask import url_for
+
+from benhoyle.blueprints.blog import page_cache
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.tests.test_queries import count_queries
+
+
+def add_conditional_records(session):
+    """
+    Add a published post.
+
+    :param session: DB session
+    :return: None
+    """
+    if Post.query.filter(Post.subsite == "Conditional").count():
+        return None
+    post = Post(
+        display_title="Conditional Post",
+        nicename="conditional-post",
+        content="Conditional content",
+        date_published=datetime.datetime.now(),
+        date_updated=datetime.datetime.now(),
+        status="publish",
+        subsite="Conditional"
+        )
+    post.render()
+    session.add(post)
+    session.commit()
+    return None
+
+
+class TestConditionalGet(object):
+
+    def test_if_none_match_short_circuits(self, db, session, client):
+        """ A matching ETag is answered with one validator query. """
+        add_conditional_records(session)
+        url = url_for(
+            'blog.post', subsite="Conditional", nicename="conditional-post")
+        response = client.get(url)
+        etag = response.headers['ETag']
+        assert etag.startswith('W/')
+        assert response.headers['Last-Modified']
+
+        with count_queries(db) as statements:
+            response = client.get(url, headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+        assert response.data == b''
+        assert len(statements) == 1
+
+    def test_if_modified_since(self, session, client):
+        """ Last-Modified round trips through If-Modified-Since. """
+        add_conditional_records(session)
+        url = url_for('blog.show_posts', subsite="Conditional")
+        last_modified = client.get(url).headers['Last-Modified']
+
+        response = client.get(
+            url, headers={'If-Modified-Since': last_modified})
+
+        assert response.status_code == 304
+
+    def test_content_change_changes_etag(self, session, client):
+        """ A new content generation invalidates outstanding ETags. """
+        add_conditional_records(session)
+        url = url_for('blog.show_tags', subsite="Conditional")
+        etag = client.get(url).headers['ETag']
+
+        page_cache.invalidate(('tags', "Conditional"))
+        response = client.get(url, headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
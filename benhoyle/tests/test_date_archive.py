@@ -0,0 +1,146 @@
+import datetime
+
+from flask import url_for
+
+from benhoyle.extensions import cache
+from benhoyle.blueprints.blog.migrations import upgrade
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.blueprints.blog.subsites import subsites
+
+
+def archive_post(i, published, status="publish"):
+    """
+    Make a post in the "Archive" subsite.
+
+    :param i: Number of the post
+    :param published: datetime published
+    :param status: Post status
+    :return: Post
+    """
+    return Post(
+        display_title="Archive Post {0}".format(i),
+        nicename="archive-post-{0}".format(i),
+        content="Archive content",
+        date_published=published,
+        date_published_year=published.year,
+        date_published_month=published.month,
+        date_updated=published,
+        status=status,
+        subsite="Archive"
+        )
+
+
+def add_archive_records(session):
+    """
+    Add 25 posts in March 2016, 3 in January 2016 and 2 in December 2015
+    to the "Archive" subsite, plus a draft.
+
+    :param session: DB session
+    :return: None
+    """
+    if Post.query.filter(Post.subsite == "Archive").count():
+        return None
+    dates = (
+        [datetime.datetime(2016, 3, 1 + i % 28, 12, i) for i in range(25)] +
+        [datetime.datetime(2016, 1, 5 + i) for i in range(3)] +
+        [datetime.datetime(2015, 12, 1 + i) for i in range(2)]
+        )
+    for i, published in enumerate(dates):
+        session.add(archive_post(i, published))
+    session.add(archive_post(99, datetime.datetime(2016, 2, 1), "draft"))
+    session.commit()
+    subsites.load()
+    return None
+
+
+class TestArchive(object):
+
+    def test_summary(self, session, client):
+        """ Published posts are counted per month, newest first. """
+        add_archive_records(session)
+
+        assert Post.archive_summary("Archive") == [
+            (2016, 3, 25), (2016, 1, 3), (2015, 12, 2)
+            ]
+
+    def test_summary_dropped_on_commit(self, session, client):
+        """ Publishing, unpublishing and deleting drop the cached summary
+        once they commit; a change rolled back leaves it cached. """
+        add_archive_records(session)
+        Post.archive_summary("Archive")
+        key = Post.archive_key("Archive")
+
+        session.add(archive_post(100, datetime.datetime(2016, 2, 10)))
+        session.flush()
+        assert cache.get(key) is not None
+        session.rollback()
+        assert cache.get(key) is not None
+
+        post = archive_post(100, datetime.datetime(2016, 2, 10))
+        session.add(post)
+        session.commit()
+        assert cache.get(key) is None
+        assert (2016, 2, 1) in Post.archive_summary("Archive")
+
+        post.status = "draft"
+        session.commit()
+        assert (2016, 2, 1) not in Post.archive_summary("Archive")
+
+        post.status = "publish"
+        session.commit()
+        session.delete(post)
+        session.commit()
+        assert Post.archive_summary("Archive") == [
+            (2016, 3, 25), (2016, 1, 3), (2015, 12, 2)
+            ]
+
+    def test_archive_pages(self, session, client):
+        """ The archive lists the months, which list their posts. """
+        add_archive_records(session)
+        index = client.get(
+            url_for('blog.archive', subsite="Archive")).get_data(as_text=True)
+        month = client.get(url_for(
+            'blog.archive_posts', subsite="Archive", year=2016, month=3))
+        year = client.get(url_for(
+            'blog.archive_posts', subsite="Archive", year=2015))
+        empty = client.get(url_for(
+            'blog.archive_posts', subsite="Archive", year=2016, month=2))
+
+        assert 'December' in index and '(25)' in index
+        assert month.status_code == 200
+        data = month.get_data(as_text=True)
+        assert data.count('id="postcell"') == 20
+        assert '/Archive/archive/2016/3/page/2' in data
+        assert 'after=' in data
+        assert year.get_data(as_text=True).count('id="postcell"') == 2
+        assert empty.status_code == 404
+
+    def test_archive_index_used(self, db, session):
+        """ The summary is answered from the archive index alone. """
+        plan = db.session.execute(
+            "EXPLAIN QUERY PLAN "
+            "SELECT date_published_year, date_published_month, count(id) "
+            "FROM post WHERE subsite = 'Archive' AND status = 'publish' "
+            "GROUP BY date_published_year, date_published_month"
+            ).fetchall()
+
+        assert 'ix_post_subsite_status_year_month' in str(plan)
+
+    def test_upgrade_backfills_months(self, db, session):
+        """ Posts published before the month columns were set are given
+        them by the upgrade. """
+        add_archive_records(session)
+        session.execute(
+            "UPDATE post SET date_published_year = NULL, "
+            "date_published_month = NULL "
+            "WHERE nicename = 'archive-post-26'"
+            )
+        session.commit()
+
+        steps = upgrade()
+
+        assert 'archive months' in dict(steps)
+        post = Post.query.filter(Post.nicename == "archive-post-26").one()
+        session.refresh(post)
+        assert (post.date_published_year, post.date_published_month) == \
+            (2016, 1)
@@ -0,0 +1,106 @@
+import datetime
+import os
+import time
+
+from flask import url_for
+
+from benhoyle.blueprints.blog.models import Post, Tag, Category
+
+
+def add_feed_records(session, count=25):
+    """
+    Add published posts, every other one tagged and categorised, to the
+    "Feed" subsite.
+
+    :param session: DB session
+    :return: None
+    """
+    if Post.query.filter(Post.subsite == "Feed").count():
+        return None
+    tag = Tag(nicename="feedtag", display_name="Feed Tag", subsite="Feed")
+    category = Category(
+        nicename="feedcat", display_name="Feed Category", subsite="Feed")
+    start = datetime.datetime(2016, 1, 1)
+    for i in range(count):
+        post = Post(
+            display_title="Feed Post {0}".format(i),
+            nicename="feed-post-{0}".format(i),
+            content="Feed content <{0}>".format(i),
+            date_published=start + datetime.timedelta(days=i),
+            date_updated=start + datetime.timedelta(days=i),
+            status="publish",
+            subsite="Feed"
+            )
+        post.render()
+        session.add(post)
+        if i % 2:
+            post.tags.append(tag)
+            post.categories.append(category)
+    session.commit()
+    return None
+
+
+class TestFeeds(object):
+
+    def test_subsite_feed(self, session, client):
+        """ The feed holds the latest posts' pre-rendered content. """
+        add_feed_records(session)
+        response = client.get(url_for('blog.subsite_feed', subsite="Feed"))
+        data = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/atom+xml'
+        assert data.count('<entry>') == 20
+        assert 'feed-post-24' in data
+        assert 'feed-post-4<' not in data
+        # The HTML content is escaped into the feed
+        assert '&lt;p&gt;Feed content &lt;24&gt;&lt;/p&gt;' in data
+
+    def test_dates_in_utc(self, session, client):
+        """ Local post dates are converted to UTC in the feed. """
+        add_feed_records(session)
+        zone = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+        try:
+            data = client.get(url_for(
+                'blog.subsite_feed', subsite="Feed")).get_data(as_text=True)
+        finally:
+            if zone is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = zone
+            time.tzset()
+
+        assert '<updated>2016-01-25T05:00:00Z</updated>' in data
+        assert '<published>2016-01-25T05:00:00Z</published>' in data
+
+    def test_tag_and_category_feeds(self, session, client):
+        """ Tag and category feeds only hold their own posts. """
+        add_feed_records(session)
+        tag_feed = client.get(url_for(
+            'blog.tag_feed', subsite="Feed", tag_nicename="feedtag"
+            )).get_data(as_text=True)
+        category_feed = client.get(url_for(
+            'blog.category_feed', subsite="Feed", category_nicename="feedcat"
+            )).get_data(as_text=True)
+        missing = client.get(url_for(
+            'blog.tag_feed', subsite="Feed", tag_nicename="nosuchtag"))
+
+        assert tag_feed.count('<entry>') == 12
+        assert 'feed-post-23' in tag_feed
+        assert 'feed-post-24' not in tag_feed
+        assert category_feed.count('<entry>') == 12
+        assert missing.status_code == 404
+
+    def test_feed_not_modified(self, session, client):
+        """ Pollers holding the current feed get 304 from the cache. """
+        add_feed_records(session)
+        url = url_for('blog.subsite_feed', subsite="Feed")
+        first = client.get(url)
+        second = client.get(
+            url, headers={'If-None-Match': first.headers['ETag']})
+
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.status_code == 304
+        assert client.get(url).headers['X-Cache'] == 'HIT'
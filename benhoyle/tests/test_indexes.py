@@ -0,0 +1,82 @@
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.blueprints.blog.migrations import missing_indexes, upgrade
+
+
+def query_plan(db, statement, **params):
+    """
+    Return the SQLite query plan for a statement as a single string.
+
+    :param db: SQLAlchemy extension
+    :param statement: SQL statement
+    :type statement: str
+    :return: str
+    """
+    rows = db.session.execute(
+        'EXPLAIN QUERY PLAN ' + statement, params
+        ).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+class TestIndexes(object):
+
+    def test_post_wall_uses_index(self, db, session):
+        """ The post wall query is answered from the composite index. """
+        plan = query_plan(
+            db,
+            "SELECT id FROM post WHERE subsite = :subsite "
+            "AND status = :status ORDER BY date_published DESC",
+            subsite="Test1", status="publish"
+            )
+        assert "ix_post_subsite_status_published" in plan
+        assert "TEMP B-TREE" not in plan
+
+    def test_post_lookup_uses_index(self, db, session):
+        """ Looking a post up by subsite and nicename uses the unique
+        index. """
+        plan = query_plan(
+            db,
+            "SELECT id FROM post WHERE subsite = :subsite "
+            "AND nicename = :nicename",
+            subsite="Test1", nicename="test-post"
+            )
+        assert "uq_post_subsite_nicename" in plan
+
+    def test_tag_wall_uses_index(self, db, session):
+        """ Posts for a tag are found from the tag side of the association. """
+        plan = query_plan(
+            db,
+            "SELECT post_id FROM post_tag WHERE tag_id = :tag_id",
+            tag_id=1
+            )
+        assert "ix_post_tag_tag_post" in plan
+
+    def test_upgrade_creates_missing_indexes(self, db, session):
+        """ The upgrade recreates an index missing from the database. """
+        session.execute('DROP INDEX ix_post_subsite_status_published')
+        session.commit()
+        assert [i.name for i in missing_indexes(db.engine)] == [
+            'ix_post_subsite_status_published'
+            ]
+
+        steps = upgrade()
+
+        assert ('ix_post_subsite_status_published', 'created') in steps
+        assert missing_indexes(db.engine) == []
+
+    def test_post_exists_in_subsite(self, session):
+        """ Nicename clashes are checked per subsite. """
+        post = Post(
+            display_title="Index Post",
+            nicename="index-post",
+            status="draft",
+            subsite="Indexes"
+            )
+        session.add(post)
+        session.commit()
+
+        assert Post.exists('index-post', 'Indexes')
+        assert not Post.exists('index-post', 'Indexes', post.id)
+        assert not Post.exists('index-post', 'no-such-subsite')
+
+        session.delete(post)
+        session.commit()
@@ -0,0 +1,67 @@
+import logging
+
+from flask import url_for
+
+from benhoyle.instrumentation import parameter_shape
+
+
+class ListHandler(logging.Handler):
+    """ Collect the messages logged while attached. """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestInstrumentation(object):
+
+    def test_headers(self, app, client, db):
+        """ Instrumented requests report their statements and DB time. """
+        response = client.get(url_for('blog.index'))
+        assert response.status_code == 200
+        assert int(response.headers['X-DB-Queries']) >= 0
+        assert 'db;dur=' in response.headers['Server-Timing']
+        assert 'total;dur=' in response.headers['Server-Timing']
+
+        response = client.get(url_for('blog.show_tags', subsite='Blog'))
+        assert int(response.headers['X-DB-Queries']) > 0
+
+    def test_sampling(self, app, client, db):
+        """ Requests left out of the sample are not instrumented. """
+        app.config['SQL_SAMPLE_RATE'] = 0
+        try:
+            response = client.get(url_for('blog.show_tags', subsite='Blog'))
+        finally:
+            app.config['SQL_SAMPLE_RATE'] = 1.0
+        assert 'X-DB-Queries' not in response.headers
+        assert 'Server-Timing' not in response.headers
+
+    def test_slow_query_log(self, app, client, db):
+        """ Slow statements are logged with the route and the types of
+        their parameters but not their values. """
+        handler = ListHandler()
+        app.logger.addHandler(handler)
+        app.config['SQL_SLOW_QUERY_SECONDS'] = 0
+        try:
+            client.get(url_for(
+                'blog.tag_postwall', subsite='Blog',
+                tag_nicename='secret-tag'
+                ))
+        finally:
+            app.config['SQL_SLOW_QUERY_SECONDS'] = 0.25
+            app.logger.removeHandler(handler)
+        slow = [m for m in handler.messages if m.startswith('Slow query')]
+        assert slow
+        assert all('blog.tag_postwall' in m for m in slow)
+        assert not any('secret-tag' in m for m in slow)
+
+    def test_parameter_shape(self):
+        assert parameter_shape((1, 'a', None)) == '(int, str, NoneType)'
+        assert parameter_shape({'id': 1, 'name': 'a'}) == \
+            '{id: int, name: str}'
+        assert parameter_shape([(1,), (2,)], executemany=True) == \
+            '2 x (int)'
+        assert parameter_shape([], executemany=True) == '0 x ()'
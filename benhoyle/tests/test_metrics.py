@@ -0,0 +1,90 @@
+from flask import url_for
+
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.extensions import metrics
+from benhoyle.metrics import MetricsStore, exposition
+
+
+class TestMetrics(object):
+
+    def test_protected(self, app, client, db):
+        """ /metrics is hidden without a token and refused with a wrong
+        one. """
+        assert client.get('/metrics').status_code == 404
+        app.config['METRICS_TOKEN'] = 'secret'
+        try:
+            response = client.get(
+                '/metrics', headers={'Authorization': 'Bearer wrong'})
+        finally:
+            app.config['METRICS_TOKEN'] = None
+        assert response.status_code == 403
+
+    def test_metrics(self, app, client, db, session):
+        """ Requests, renders, statements and cache hits are exposed. """
+        if not Post.query.filter(Post.subsite == "Metrics").count():
+            session.add(Post(
+                display_title="Metrics", nicename="metrics",
+                status="publish", subsite="Metrics"
+                ))
+            session.commit()
+        metrics.store.clear()
+        url = url_for('blog.show_tags', subsite='Metrics')
+        client.get(url)
+        client.get(url)
+
+        app.config['METRICS_TOKEN'] = 'secret'
+        try:
+            response = client.get(
+                '/metrics', headers={'Authorization': 'Bearer secret'})
+        finally:
+            app.config['METRICS_TOKEN'] = None
+        assert response.status_code == 200
+        text = response.get_data(as_text=True)
+        assert '# TYPE http_request_duration_seconds histogram' in text
+        assert 'http_request_duration_seconds_count' \
+            '{endpoint="blog.show_tags"} 2' in text
+        assert 'http_request_duration_seconds_bucket' \
+            '{endpoint="blog.show_tags",le="+Inf"} 2' in text
+        assert 'http_requests_total' \
+            '{endpoint="blog.show_tags",status="200"} 2' in text
+        assert 'http_response_size_bytes_count' \
+            '{endpoint="blog.show_tags"} 2' in text
+        assert 'template_render_seconds_count{template="tags.html"} 1' \
+            in text
+        assert 'db_queries_per_request_count{endpoint="blog.show_tags"} 2' \
+            in text
+        assert 'page_cache_requests_total{result="hit"} 1' in text
+        assert 'page_cache_requests_total{result="miss"} 1' in text
+        assert 'page_cache_hit_ratio 0.5' in text
+
+    def test_shared_store(self, app):
+        """ Samples written by separate workers are added up. """
+        path = app.config['METRICS_PATH'] + '_shared'
+        first = MetricsStore(path, flush_interval=0)
+        first.clear()
+        second = MetricsStore(path, flush_interval=60)
+        first.observe('db_queries_per_request', (1, 10), 5, endpoint='a')
+        second.observe('db_queries_per_request', (1, 10), 20, endpoint='a')
+
+        samples = second.samples()
+        text = exposition(samples)
+        assert 'db_queries_per_request_bucket' \
+            '{endpoint="a",le="1"}' not in text
+        assert 'db_queries_per_request_bucket' \
+            '{endpoint="a",le="10"} 1' in text
+        assert 'db_queries_per_request_bucket' \
+            '{endpoint="a",le="+Inf"} 2' in text
+        assert 'db_queries_per_request_sum{endpoint="a"} 25' in text
+
+    def test_buckets_in_bound_order(self):
+        """ Buckets are exposed in ascending order of bound, +Inf last. """
+        text = exposition({'db_queries_per_request_bucket': [
+            ('endpoint="a",le="+Inf"', 3), ('endpoint="a",le="10"', 2),
+            ('endpoint="a",le="2"', 1), ('endpoint="b",le="+Inf"', 1)
+            ]})
+
+        assert [line.split('{')[1] for line in text.splitlines()
+                if line.startswith('db_queries_per_request_bucket')] == [
+            'endpoint="a",le="2"} 1', 'endpoint="a",le="10"} 2',
+            'endpoint="a",le="+Inf"} 3', 'endpoint="b",le="+Inf"} 1'
+            ]
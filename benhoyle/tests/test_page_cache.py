@@ -0,0 +1,119 @@
+import datetime
+
+from flask import current_app, g, url_for
+
+from benhoyle.blueprints.blog import page_cache
+from benhoyle.blueprints.blog.models import Post, Tag
+
+
+def add_cached_records(session):
+    """
+    Add a tagged, published post.
+
+    :param session: DB session
+    :return: None
+    """
+    if Post.query.filter(Post.subsite == "Cached").count():
+        return None
+    post = Post(
+        display_title="Cached Post",
+        nicename="cached-post",
+        content="Cached content",
+        date_published=datetime.datetime.now(),
+        date_updated=datetime.datetime.now(),
+        status="publish",
+        subsite="Cached"
+        )
+    post.render()
+    session.add(post)
+    post.tags.append(
+        Tag(nicename="cachedtag", display_name="Cached Tag", subsite="Cached")
+        )
+    session.commit()
+    return None
+
+
+def cache_requests(result):
+    """ Page cache requests counted by the metrics with result. """
+    samples = current_app.extensions['metrics'].store.samples()
+    return sum(
+        value for labels, value in samples.get('page_cache_requests_total', [])
+        if labels == 'result="{0}"'.format(result)
+        )
+
+
+class TestPageCache(object):
+
+    def test_second_request_is_a_hit(self, session, client):
+        """ Anonymous readers get the stored page on the second request. """
+        add_cached_records(session)
+        url = url_for('blog.post', subsite="Cached", nicename="cached-post")
+
+        hits, misses = cache_requests('hit'), cache_requests('miss')
+        first = client.get(url)
+        second = client.get(url)
+
+        assert first.headers['X-Cache'] == 'MISS'
+        assert second.headers['X-Cache'] == 'HIT'
+        assert first.data == second.data
+        assert cache_requests('hit') == hits + 1
+        assert cache_requests('miss') == misses + 1
+
+    def test_key_ignores_other_arguments(self, session, client):
+        """ Only the cursor arguments make a new entry, in any order. """
+        add_cached_records(session)
+        url = url_for('blog.show_posts', subsite="Cached")
+
+        assert client.get(url + '?x=1').headers['X-Cache'] == 'MISS'
+        assert client.get(url + '?x=2').headers['X-Cache'] == 'HIT'
+        assert client.get(url).headers['X-Cache'] == 'HIT'
+        with current_app.test_request_context(url + '?before=b&after=a&x=1'):
+            first = page_cache.page_key()
+        with current_app.test_request_context(url + '?after=a&before=b'):
+            assert page_cache.page_key() == first
+
+    def test_search_not_cached(self, session, client):
+        """ Search results are not stored, whatever the query. """
+        add_cached_records(session)
+        response = client.get(
+            url_for('blog.search', subsite="Cached", q="cached"))
+
+        assert response.status_code == 200
+        assert 'X-Cache' not in response.headers
+
+    def test_invalidation_is_precise(self, session, client):
+        """ A tag change evicts the pages showing the tag and no others. """
+        add_cached_records(session)
+        post_url = url_for(
+            'blog.post', subsite="Cached", nicename="cached-post")
+        wall_url = url_for('blog.show_posts', subsite="Cached")
+        tag_url = url_for(
+            'blog.tag_postwall', subsite="Cached", tag_nicename="cachedtag")
+        for url in [post_url, wall_url, tag_url]:
+            client.get(url)
+
+        page_cache.invalidate(('tag', "Cached", "cachedtag"))
+
+        assert client.get(post_url).headers['X-Cache'] == 'MISS'
+        assert client.get(tag_url).headers['X-Cache'] == 'MISS'
+        assert client.get(wall_url).headers['X-Cache'] == 'HIT'
+
+    def test_post_write_evicts_wall(self, session, client):
+        """ Post dependencies cover the post wall and the post page. """
+        add_cached_records(session)
+        wall_url = url_for('blog.show_posts', subsite="Cached")
+        client.get(wall_url)
+
+        page_cache.invalidate(*page_cache.post_dependencies(
+            "Cached", ["cached-post"], ["cachedtag"]))
+
+        assert client.get(wall_url).headers['X-Cache'] == 'MISS'
+
+    def test_authenticated_users_bypass(self, app):
+        """ Logged in authors are never served from the cache. """
+        class Author(object):
+            is_authenticated = True
+
+        with app.test_request_context('/Cached/posts'):
+            g.user = Author()
+            assert not page_cache.cacheable()
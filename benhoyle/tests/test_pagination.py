@@ -0,0 +1,154 @@
+import base64
+import datetime
+import json
+
+from flask import url_for
+
+from benhoyle.extensions import cache
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.blueprints.blog.pagination import (
+    paginate_keyset, encode_cursor, decode_cursor
+    )
+from benhoyle.tests.test_queries import count_queries
+
+
+def add_keyset_records(session, count=45):
+    """
+    Add published posts, several sharing a publication date.
+
+    :param session: DB session
+    :param count: Number of posts
+    :return: None
+    """
+    if Post.query.filter(Post.subsite == "Keyset").count():
+        return None
+    start = datetime.datetime(2016, 1, 1)
+    for i in range(count):
+        session.add(Post(
+            display_title="Keyset Post {0}".format(i),
+            nicename="keyset-post-{0}".format(i),
+            content="Keyset post {0}".format(i),
+            # Pairs of posts share a date to exercise the id tie breaker
+            date_published=start + datetime.timedelta(days=i // 2),
+            status="publish",
+            subsite="Keyset"
+            ))
+    session.commit()
+    return None
+
+
+def keyset_query():
+    return Post.query.filter(
+        Post.subsite == "Keyset").filter(Post.status == "publish")
+
+
+class TestKeysetPagination(object):
+
+    def test_cursor_round_trip(self):
+        """ Cursors decode to the key they were made from. """
+        when = datetime.datetime(2016, 5, 4, 3, 2, 1, 123)
+        assert decode_cursor(encode_cursor(when, 7, 3)) == (when, 7, 3)
+        assert decode_cursor(encode_cursor(None, 7)) == (None, 7, None)
+
+    def test_walk_matches_offset_order(self, session):
+        """ Following next cursors visits every row once, in order. """
+        add_keyset_records(session)
+        expected = [
+            p.id for p in keyset_query().order_by(
+                Post.date_published.desc(), Post.id.desc()).all()
+            ]
+
+        seen = []
+        pages = paginate_keyset(
+            keyset_query(), Post.date_published, Post.id, 10)
+        while True:
+            seen.extend(p.id for p in pages.items)
+            if not pages.has_next:
+                break
+            pages = paginate_keyset(
+                keyset_query(), Post.date_published, Post.id, 10,
+                after=pages.next_cursor)
+
+        assert seen == expected
+        assert pages.page == 5
+
+        previous = paginate_keyset(
+            keyset_query(), Post.date_published, Post.id, 10,
+            before=pages.prev_cursor)
+        assert [p.id for p in previous.items] == expected[30:40]
+        assert previous.page == 4
+
+    def test_page_number_maps_to_cursor(self, session):
+        """ /page/<n> shows the same rows as the nth page of cursors. """
+        add_keyset_records(session)
+        expected = [
+            p.id for p in keyset_query().order_by(
+                Post.date_published.desc(), Post.id.desc()).all()
+            ]
+        pages = paginate_keyset(
+            keyset_query(), Post.date_published, Post.id, 10, page=3)
+        assert [p.id for p in pages.items] == expected[20:30]
+        assert pages.has_prev and pages.has_next
+
+    def test_post_wall_count_is_cached(self, db, session, client):
+        """ Repeat post wall requests do not recount the posts. """
+        add_keyset_records(session)
+        url = url_for('blog.show_posts', subsite="Keyset", page=2)
+        assert client.get(url).status_code == 200
+
+        with count_queries(db) as statements:
+            response = client.get(url)
+
+        assert response.status_code == 200
+        assert "2 of 3" in str(response.data)
+        assert not [s for s in statements if 'count(' in s.lower()]
+
+    def test_count_dropped_on_commit(self, session, client):
+        """ A new draft drops the cached draft count once it commits, not
+        while a reader could still cache the old count. """
+        add_keyset_records(session)
+        key = Post.count_key("Keyset", "draft")
+        assert Post.count_by_status("Keyset", "draft") == 0
+
+        draft = Post(
+            display_title="Keyset Draft", nicename="keyset-draft",
+            status="draft", subsite="Keyset")
+        session.add(draft)
+        session.flush()
+        assert cache.get(key) == 0
+        session.commit()
+        assert cache.get(key) is None
+        assert Post.count_by_status("Keyset", "draft") == 1
+
+        session.delete(draft)
+        session.commit()
+        assert Post.count_by_status("Keyset", "draft") == 0
+
+    def test_bad_cursor_is_not_found(self, client):
+        """ A tampered cursor 404s rather than erroring. """
+        response = client.get(
+            url_for('blog.show_posts', subsite="Keyset", after="nonsense"))
+        assert response.status_code == 404
+
+    def test_bad_cursor_page_is_not_found(self, session, client):
+        """ A well formed cursor with a bad page number 404s too. """
+        add_keyset_records(session)
+        for page in ["x", 0, [2]]:
+            cursor = base64.urlsafe_b64encode(json.dumps(
+                ["2020-01-01T00:00:00", 5, page]).encode('utf-8'))
+            response = client.get(url_for(
+                'blog.show_posts', subsite="Keyset",
+                after=cursor.decode('ascii')))
+            assert response.status_code == 404
+
+    def test_bad_cursor_value_is_not_found(self, session, client):
+        """ A well formed cursor whose sort key is not a date or number
+        404s too. """
+        add_keyset_records(session)
+        for value in [{"a": 1}, [1], True, "yesterday"]:
+            cursor = base64.urlsafe_b64encode(json.dumps(
+                [value, 5, None]).encode('utf-8'))
+            response = client.get(url_for(
+                'blog.show_posts', subsite="Keyset",
+                after=cursor.decode('ascii')))
+            assert response.status_code == 404
@@ -0,0 +1,113 @@
+from flask import url_for
+from sqlalchemy import create_engine, inspect
+
+from benhoyle.extensions import db as _db
+from benhoyle.blueprints.blog.models import Post, PostBody
+from benhoyle.blueprints.blog.migrations import (
+    missing_indexes, move_post_bodies, upgrade
+    )
+from benhoyle.blueprints.blog.search import SearchResults
+from benhoyle.blueprints.blog.subsites import subsites
+from benhoyle.tests.test_queries import count_queries
+
+
+def add_body_records(session):
+    """
+    Add a published post to the "Bodies" subsite.
+
+    :param session: DB session
+    :return: The post
+    """
+    post = Post.query.filter(Post.subsite == "Bodies").first()
+    if post is not None:
+        return post
+    post = Post(
+        display_title="Body Post",
+        nicename="body-post",
+        excerpt="",
+        content="All about <b>gooseberries</b>",
+        status="publish",
+        subsite="Bodies"
+        )
+    session.add(post)
+    session.commit()
+    subsites.load()
+    return post
+
+
+class TestPostBody(object):
+
+    def test_body_stored_separately(self, session):
+        """ Content lives in post_body and goes with its post. """
+        post = add_body_records(session)
+        assert 'content' not in Post.__table__.c
+        body = PostBody.query.get(post.id)
+        assert body.content == "All about <b>gooseberries</b>"
+        assert post.excerpt_text == "All about gooseberries"
+
+        draft = Post(display_title="No Body", subsite="Bodies")
+        assert draft.content is None
+        session.add(draft)
+        session.commit()
+        assert PostBody.query.get(draft.id) is None
+
+        session.delete(draft)
+        session.commit()
+
+    def test_walls_skip_bodies(self, client, session, db):
+        """ Post walls never read post_body, the post page joins it. """
+        post = add_body_records(session)
+        with count_queries(db) as statements:
+            page = client.get(url_for('blog.show_posts', subsite="Bodies"))
+        assert page.status_code == 200
+        assert not any('post_body' in s for s in statements)
+
+        with count_queries(db) as statements:
+            page = client.get(url_for(
+                'blog.post', subsite="Bodies", nicename=post.nicename))
+        assert page.status_code == 200
+        assert 'gooseberries' in page.get_data(as_text=True)
+        assert len([s for s in statements if 'post_body' in s]) == 1
+
+    def test_search_follows_body_edits(self, session):
+        """ Editing a body updates the full text index. """
+        post = add_body_records(session)
+        post.content = "Now about damsons"
+        session.commit()
+        assert SearchResults("Bodies", "damsons", 20).items == [post]
+        assert SearchResults("Bodies", "gooseberries", 20).items == []
+
+        post.content = "All about <b>gooseberries</b>"
+        session.commit()
+
+    def test_move_post_bodies(self):
+        """ The upgrade moves bodies out of the old post columns, keeps
+        them searchable and rebuilds the post table with its indexes. """
+        engine = create_engine('sqlite://')
+        _db.metadata.create_all(engine)
+        with engine.begin() as connection:
+            for column in ['content', 'content_html', 'content_hash']:
+                connection.execute(
+                    'ALTER TABLE post ADD COLUMN {0} TEXT'.format(column))
+            connection.execute(
+                "INSERT INTO post (id, display_title, excerpt, content, "
+                "content_html, subsite, status) VALUES (1, 'Old', '', "
+                "'Old medlars', '<p>Old medlars</p>', 'Blog', 'publish')"
+                )
+
+        steps = upgrade(engine)
+
+        assert ('post_body', '1') in steps
+        assert missing_indexes(engine) == []
+        columns = [c['name'] for c in inspect(engine).get_columns('post')]
+        assert 'content' not in columns
+        with engine.begin() as connection:
+            assert move_post_bodies(connection) is None
+            assert list(connection.execute(
+                'SELECT post_id, content, content_html FROM post_body')) == [
+                    (1, 'Old medlars', '<p>Old medlars</p>')]
+            assert connection.execute(
+                'SELECT display_title FROM post').scalar() == 'Old'
+            assert connection.execute(
+                "SELECT rowid FROM post_fts WHERE post_fts MATCH 'medlars'"
+                ).scalar() == 1
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+from sqlalchemy import event
+
+from benhoyle.app import create_app
+from benhoyle.pragmas import check_pragmas, checkpoint, status
+
+
+class TestPragmas(object):
+
+    def test_connection_pragmas(self, db):
+        """ New connections get the configured pragmas. """
+        with db.engine.connect() as connection:
+            report = dict(status(connection))
+        assert report['journal_mode'] == 'wal'
+        assert report['synchronous'] == 'normal'
+        assert report['busy_timeout'] == 5000
+        assert report['mmap_size'] > 0
+        assert report['file_bytes'] > 0
+
+    def test_check_pragmas(self):
+        """ Only names and values that are safe to format are accepted. """
+        check_pragmas({'journal_mode': 'wal', 'cache_size': -2000})
+        with pytest.raises(ValueError):
+            check_pragmas({'journal_mode; DROP TABLE post': 'wal'})
+        with pytest.raises(ValueError):
+            check_pragmas({'journal_mode': 'wal; DROP TABLE post'})
+
+    def test_checkpoint(self, db):
+        with db.engine.connect() as connection:
+            assert checkpoint(connection)[0] == 0
+            with pytest.raises(ValueError):
+                checkpoint(connection, 'SOMETIMES')
+
+    def test_scheduled_maintenance(self, app, db):
+        """ Maintenance falls due per worker and runs once the response has
+        been sent. """
+        config = dict(app.config)
+        config.update(
+            SQLITE_OPTIMIZE_INTERVAL=0, SQLITE_CHECKPOINT_INTERVAL=0.05)
+        maintained = create_app(settings_override=config)
+        client = maintained.test_client()
+        statements = []
+        event.listen(
+            db.get_engine(maintained), 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(
+                statement)
+            )
+
+        client.get('/nowhere').close()
+        assert not any('wal_checkpoint' in s for s in statements)
+
+        time.sleep(0.05)
+        response = client.get('/nowhere')
+        assert not any('wal_checkpoint' in s for s in statements)
+        response.close()
+        assert statements == ['PRAGMA wal_checkpoint(PASSIVE)']
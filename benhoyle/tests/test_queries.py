@@ -0,0 +1,88 @@
+import datetime
+from contextlib import contextmanager
+
+from flask import url_for
+from sqlalchemy import event
+
+from benhoyle.blueprints.blog.models import Post, Tag, Category, Author
+from benhoyle.blueprints.blog.subsites import subsites
+
+
+@contextmanager
+def count_queries(db):
+    """
+    Count the SQL statements executed inside the block.
+
+    :param db: SQLAlchemy extension
+    :return: List that collects the executed statements
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(
+            db.engine, 'before_cursor_execute', before_cursor_execute
+            )
+
+
+def add_eager_records(session):
+    """
+    Add a post with several authors, tags and categories.
+
+    :param session: DB session
+    :return: Post
+    """
+    post = Post(
+        display_title="Eager Post",
+        nicename="eager-post",
+        content="Eager loading test post",
+        date_published=datetime.datetime.now(),
+        date_updated=datetime.datetime.now(),
+        status="publish",
+        subsite="Eager"
+        )
+    session.add(post)
+    for i in range(5):
+        post.tags.append(Tag(
+            nicename="eagertag{0}".format(i),
+            display_name="Eager Tag {0}".format(i),
+            subsite="Eager"
+            ))
+        post.categories.append(Category(
+            nicename="eagercat{0}".format(i),
+            display_name="Eager Category {0}".format(i),
+            subsite="Eager"
+            ))
+        post.authors.append(Author(
+            login="eager{0}".format(i),
+            display_name="Eager Author {0}".format(i)
+            ))
+    post.render()
+    session.commit()
+    return post
+
+
+class TestQueryCounts(object):
+
+    def test_post_page_query_count(self, db, session, client):
+        """ A post page loads its relations in a bounded number of queries. """
+        add_eager_records(session)
+        subsites.load()
+        url = url_for('blog.post', subsite="Eager", nicename="eager-post")
+        session.expire_all()
+
+        with count_queries(db) as statements:
+            response = client.get(url)
+
+        assert response.status_code == 200
+        assert "Eager Tag 4" in str(response.data)
+        assert "Eager Category 4" in str(response.data)
+        assert "Eager Author 4" in str(response.data)
+        # The conditional GET validator, one query for the post and one per
+        # eager loaded collection
+        assert len(statements) <= 5
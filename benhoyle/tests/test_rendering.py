@@ -0,0 +1,118 @@
+import datetime
+
+from flask import url_for
+
+from benhoyle.extensions import db as _db
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.blueprints.blog.migrations import backfill_excerpts
+from benhoyle.blueprints.blog.rendering import (
+    EXCERPT_LENGTH, render_content, content_hash, render_row, make_excerpt
+    )
+from benhoyle.tests.test_queries import count_queries
+
+
+class TestRendering(object):
+
+    def test_render_content(self):
+        """ Plain lines are wrapped in paragraphs, pre blocks are not. """
+        content = "First line\n\n<pre>\ncode\n</pre>\nLast line"
+        assert render_content(content) == (
+            "<p>First line</p>\n<pre>\ncode\n</pre>\n<p>Last line</p>"
+            )
+
+    def test_render_row_skips_current(self):
+        """ Bulk rendering skips rows whose hash is current. """
+        current = content_hash("Some text")
+        assert render_row((1, "Some text", current)) is None
+        assert render_row((1, "Some text", current), force=True) == {
+            'b_id': 1,
+            'content_html': "<p>Some text</p>",
+            'content_hash': current
+            }
+
+    def test_rendered_on_save(self, session):
+        """ Bodies are rendered as they are saved and again when edited. """
+        post = Post(
+            display_title="Render Post",
+            nicename="render-post",
+            content="Rendered on save",
+            date_published=datetime.datetime.now(),
+            status="publish",
+            subsite="Render"
+            )
+        session.add(post)
+        session.commit()
+        assert post.content_html == "<p>Rendered on save</p>"
+        assert not post.needs_render()
+
+        post.content = "Rendered again"
+        session.commit()
+        assert post.content_html == "<p>Rendered again</p>"
+
+    def test_post_page_does_not_write(self, db, session, client):
+        """ A post with a stale render is shown rendered, without saving
+        the render. """
+        post = Post(
+            display_title="Stale Post",
+            nicename="stale-post",
+            content="Rendered on view",
+            date_published=datetime.datetime.now(),
+            status="publish",
+            subsite="Render"
+            )
+        session.add(post)
+        session.commit()
+        session.execute(
+            "UPDATE post_body SET content_html = NULL WHERE post_id = :id",
+            {'id': post.id}
+            )
+        session.commit()
+
+        with count_queries(db) as statements:
+            response = client.get(url_for(
+                'blog.post', subsite="Render", nicename="stale-post"))
+
+        assert response.status_code == 200
+        assert "<p>Rendered on view</p>" in str(response.data)
+        assert all(s.startswith('SELECT') for s in statements)
+        session.expire_all()
+        assert Post.query.get(post.id).content_html is None
+
+    def test_make_excerpt(self):
+        """ Excerpts are plain text cut at a word boundary, the written
+        excerpt if there is one. """
+        text, html = make_excerpt("", "<p>Tom &amp; Jerry</p>\n<b>ran</b>")
+        assert text == "Tom & Jerry ran"
+        assert html == "<p>Tom &amp; Jerry ran</p>"
+
+        assert make_excerpt("Written <i>here</i>", "Body")[0] == \
+            "Written here"
+
+        text, html = make_excerpt(None, "word, " * 1000)
+        assert len(text) <= EXCERPT_LENGTH + 1
+        assert text.endswith("word…")
+        assert make_excerpt(None, None) == ("", "")
+
+    def test_excerpts_saved_and_backfilled(self, session):
+        """ Excerpts are made on save and backfilled in bulk. """
+        post = Post(
+            display_title="Excerpt Post",
+            nicename="excerpt-post",
+            content="The <b>first</b> words",
+            subsite="Render"
+            )
+        session.add(post)
+        session.commit()
+        assert post.excerpt_text == "The first words"
+
+        post.excerpt = "Hand written"
+        session.commit()
+        assert post.excerpt_html == "<p>Hand written</p>"
+
+        with _db.engine.begin() as connection:
+            connection.execute(Post.__table__.update().where(
+                Post.__table__.c.id == post.id).values(excerpt_text=None))
+            assert backfill_excerpts(connection) == 1
+            assert backfill_excerpts(connection) == 0
+        session.expire_all()
+        assert post.excerpt_text == "Hand written"
@@ -0,0 +1,91 @@
+import datetime
+
+from flask import g, url_for
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db as _db
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.replicas import STICKY_KEY, replicate
+
+
+def add_replica_post(nicename):
+    """
+    Add a published post to the "Replica" subsite.
+
+    :param nicename: Nicename of the post
+    :return: None
+    """
+    now = datetime.datetime.now()
+    _db.session.add(Post(
+        display_title=nicename.replace('-', ' ').title(),
+        nicename=nicename,
+        content="Replicated",
+        date_published=now,
+        date_updated=now,
+        status="publish",
+        subsite="Replica"
+        ))
+    _db.session.commit()
+
+
+def replica_app(app):
+    """
+    App reading from a copy of the test database, with a route that saves
+    a post.
+
+    :param app: Pytest fixture
+    :return: Tuple of (Flask app, URI of the copy)
+    """
+    uri = app.config['SQLALCHEMY_DATABASE_URI'] + '_replica'
+    config = dict(app.config)
+    config.update(SQLALCHEMY_READ_URIS=[uri], CACHE_TYPE='null')
+    replicated = create_app(settings_override=config)
+
+    @replicated.route('/replica/save', methods=['POST'])
+    def save():
+        add_replica_post('replica-saved')
+        return 'Saved'
+
+    return replicated, uri
+
+
+class TestReplicas(object):
+
+    def test_routing(self, app, db, session):
+        """ Public GETs read the replica, author pages the primary. """
+        replicated, uri = replica_app(app)
+        with replicated.test_request_context('/Replica/posts'):
+            replicated.preprocess_request()
+            assert g.db_read_engine is not None
+            assert str(g.db_read_engine.url) == uri
+        with replicated.test_request_context('/Replica/posts/add'):
+            replicated.preprocess_request()
+            assert g.db_read_engine is None
+        with replicated.test_request_context('/Replica/posts', method='POST'):
+            replicated.preprocess_request()
+            assert g.db_read_engine is None
+
+    def test_reads_and_stickiness(self, app, db, session):
+        """ Readers see the replica, an author who saved sees the primary
+        until the replica catches up. """
+        add_replica_post('replica-first')
+        replicated, uri = replica_app(app)
+        assert replicate(app.config['SQLALCHEMY_DATABASE_URI'], uri) > 0
+        add_replica_post('replica-second')
+
+        url = url_for('blog.show_posts', subsite="Replica")
+        body = replicated.test_client().get(url).get_data(as_text=True)
+        assert 'Replica First' in body
+        assert 'Replica Second' not in body
+
+        author = replicated.test_client()
+        author.post('/replica/save')
+        with author.session_transaction() as flask_session:
+            assert STICKY_KEY in flask_session
+        body = author.get(url).get_data(as_text=True)
+        assert 'Replica Second' in body
+        assert 'Replica Saved' in body
+
+        replicate(app.config['SQLALCHEMY_DATABASE_URI'], uri)
+        body = replicated.test_client().get(url).get_data(as_text=True)
+        assert 'Replica Saved' in body
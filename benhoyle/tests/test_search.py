@@ -0,0 +1,97 @@
+import datetime
+
+from flask import url_for
+
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.blueprints.blog.subsites import subsites
+from benhoyle.blueprints.blog.search import SearchResults, match_query
+
+
+def add_search_records(session, count=25):
+    """
+    Add published posts mentioning a common word to the "Search" subsite.
+
+    :param session: DB session
+    :param count: Number of posts to add
+    :return: None
+    """
+    if Post.query.filter(Post.subsite == "Search").count():
+        return
+    now = datetime.datetime.now()
+    for i in range(count):
+        session.add(Post(
+            display_title="Search Post {0}".format(i),
+            nicename="search-post-{0}".format(i),
+            excerpt="",
+            content="A post about <b>marmalade</b> " + "toast " * i,
+            date_published=now,
+            date_updated=now,
+            status="publish",
+            subsite="Search"
+            ))
+    session.add(Post(
+        display_title="Search Draft",
+        nicename="search-draft",
+        content="An unpublished marmalade draft",
+        status="draft",
+        subsite="Search"
+        ))
+    session.commit()
+    subsites.load()
+
+
+class TestSearch(object):
+
+    def test_match_query_quotes_words(self):
+        """ FTS5 syntax typed by readers is searched for, not run. """
+        assert match_query('marm') == '"marm" *'
+        assert match_query('NEAR(a "b") OR -c') == \
+            '"NEAR" "a" "b" "OR" "c" *'
+        assert match_query(' ;"* ') is None
+
+    def test_search_page(self, session, client):
+        """ Matching published posts are listed with a highlighted, escaped
+        snippet. """
+        add_search_records(session)
+        response = client.get(
+            url_for('blog.search', subsite="Search", q="marmalade"))
+        data = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert 'search-post-0' in data
+        assert 'search-draft' not in data
+        assert '<mark>marmalade</mark>' in data
+        assert '&lt;b&gt;' in data
+
+    def test_ranking_and_keyset_paging(self, session, client):
+        """ Best matches come first and pages do not overlap. """
+        add_search_records(session)
+        first = SearchResults("Search", "toast", 20)
+        second = SearchResults("Search", "toast", 20, first.next_cursor)
+
+        assert first.has_next and not second.has_next
+        assert len(first.items) == 20 and len(second.items) == 4
+        assert first.items[0].nicename == 'search-post-24'
+        assert not set(first.items) & set(second.items)
+
+    def test_index_follows_edits(self, session, client):
+        """ Triggers keep the index in step with the post table. """
+        add_search_records(session)
+        post = Post.query.filter(Post.nicename == "search-post-3").first()
+        post.content = "Now about quinces"
+        session.commit()
+
+        assert SearchResults("Search", "quinces", 20).items == [post]
+        assert post not in SearchResults("Search", "marmalade", 50).items
+
+        session.delete(post)
+        session.commit()
+
+        assert SearchResults("Search", "quinces", 20).items == []
+
+    def test_bad_cursor(self, session, client):
+        """ A tampered cursor is not found. """
+        response = client.get(url_for(
+            'blog.search', subsite="Search", q="toast", after="nonsense"))
+
+        assert response.status_code == 404
@@ -0,0 +1,101 @@
+import pytest
+
+from benhoyle.blueprints.blog import services
+from benhoyle.blueprints.blog.models import (
+    Post, Tag, Category, post_category
+    )
+from benhoyle.tests.test_queries import count_queries
+
+
+def add_term_records(session, count=30):
+    """
+    Add posts to the "Terms" subsite, all tagged "red", every third also
+    "blue", and all in the category "parent" which has a child category.
+
+    :param session: DB session
+    :return: None
+    """
+    if Post.query.filter(Post.subsite == "Terms").count():
+        return None
+    red = Tag(nicename="red", display_name="Red", subsite="Terms")
+    blue = Tag(nicename="blue", display_name="Blue", subsite="Terms")
+    parent = Category(
+        nicename="parent", display_name="Parent", subsite="Terms")
+    session.add_all([red, blue, parent])
+    session.flush()
+    session.add(Category(
+        nicename="child", display_name="Child", parent=parent.id,
+        subsite="Terms"
+        ))
+    for i in range(count):
+        post = Post(
+            display_title="Term Post {0}".format(i),
+            nicename="term-post-{0}".format(i),
+            status="publish",
+            subsite="Terms"
+            )
+        session.add(post)
+        post.tags.append(red)
+        if i % 3 == 0:
+            post.tags.append(blue)
+        post.categories.append(parent)
+    session.commit()
+    return None
+
+
+class TestTermServices(object):
+
+    def test_merge(self, db, session, client):
+        """ Merging copies the association rows in a fixed number of
+        statements, however many posts there are. """
+        add_term_records(session)
+
+        with count_queries(db) as statements:
+            new_tag, added = services.merge_terms(
+                Tag, "Terms", ["red", "blue"])
+
+        assert added == 30
+        assert len(statements) <= 6
+        assert new_tag.posts.count() == 30
+        # The merged tags are kept
+        assert Tag.query.filter(Tag.subsite == "Terms").count() == 3
+
+        with pytest.raises(ValueError):
+            services.merge_terms(Tag, "Terms", ["red", "blue"])
+        with pytest.raises(ValueError):
+            services.merge_terms(Tag, "Terms", ["red", "no-such-tag"])
+
+    def test_delete(self, db, session, client):
+        """ Deleting removes the terms and their association rows. """
+        add_term_records(session)
+        parent = Category.query.filter(
+            Category.subsite == "Terms").filter(
+                Category.nicename == "parent").one()
+        parent_id = parent.id
+        Category.post_counts("Terms")
+
+        with count_queries(db) as statements:
+            deleted, removed = services.delete_terms(
+                Category, "Terms", ["parent", "no-such-category"])
+
+        assert (deleted, removed) == (1, 30)
+        assert len(statements) <= 5
+        assert db.session.query(post_category).filter(
+            post_category.c.category_id == parent_id).count() == 0
+        child = Category.query.filter(
+            Category.subsite == "Terms").filter(
+                Category.nicename == "child").one()
+        assert child.parent is None
+        assert [c.nicename for c in Category.post_counts("Terms")] == [
+            'child']
+        assert services.delete_terms(Tag, "Terms", []) == (0, 0)
+
+    def test_terms_scoped_to_subsite(self, session, client):
+        """ A nicename in another subsite is left alone. """
+        add_term_records(session)
+        session.add(Tag(nicename="red", display_name="Red", subsite="Other"))
+        session.commit()
+
+        services.delete_terms(Tag, "Other", ["red"])
+
+        assert Tag.query.filter(Tag.nicename == "red").count() == 1
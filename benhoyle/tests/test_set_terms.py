@@ -0,0 +1,100 @@
+from benhoyle.extensions import cache
+from benhoyle.blueprints.blog.models import (
+    Post, Tag, Category, term_counts_key
+    )
+from benhoyle.tests.test_queries import count_queries
+
+
+def add_set_terms_records(session):
+    """
+    Add a post and some tags and categories to the "SetTerms" subsite,
+    with a tag of the same nicename in another subsite.
+
+    :param session: DB session
+    :return: The post
+    """
+    post = Post.query.filter(Post.subsite == "SetTerms").first()
+    if post:
+        return post
+    for nicename in ["red", "green", "blue"]:
+        session.add(Tag(
+            nicename=nicename, display_name=nicename.title(),
+            subsite="SetTerms"
+            ))
+    session.add(Tag(nicename="red", display_name="Red", subsite="Other"))
+    for nicename in ["news", "notes"]:
+        session.add(Category(
+            nicename=nicename, display_name=nicename.title(),
+            subsite="SetTerms"
+            ))
+    post = Post(
+        display_title="Set Terms", nicename="set-terms",
+        status="publish", subsite="SetTerms"
+        )
+    session.add(post)
+    session.commit()
+    return post
+
+
+class TestSetTerms(object):
+
+    def test_set_tags(self, db, session):
+        """ Only the difference is written and terms of other subsites are
+        not used. """
+        post = add_set_terms_records(session)
+
+        assert post.set_tags(["red", "green", "missing"]) == (2, 0)
+        session.commit()
+        assert sorted(post.get_tag_nicenames()) == ["green", "red"]
+        assert all(t.subsite == "SetTerms" for t in post.tag_list)
+
+        with count_queries(db) as statements:
+            assert post.set_tags(["green", "blue"]) == (1, 1)
+        # Resolve, read current rows, one delete and one insert
+        assert len(statements) == 4
+        session.commit()
+        assert sorted(post.get_tag_nicenames()) == ["blue", "green"]
+
+        with count_queries(db) as statements:
+            assert post.set_tags(["blue", "green"]) == (0, 0)
+        assert len(statements) == 2
+
+        assert post.set_tags([]) == (0, 2)
+        session.commit()
+        assert post.get_tag_nicenames() == []
+
+    def test_set_categories(self, db, session):
+        post = add_set_terms_records(session)
+
+        assert post.set_categories(["news", "notes"]) == (2, 0)
+        session.commit()
+        assert post.set_categories(["notes"]) == (0, 1)
+        session.commit()
+        assert post.get_category_nicenames() == ["notes"]
+
+    def test_new_post(self, db, session):
+        """ A post without an id is flushed first. """
+        add_set_terms_records(session)
+        post = Post(
+            display_title="New Set Terms", nicename="new-set-terms",
+            status="draft", subsite="SetTerms"
+            )
+        session.add(post)
+        assert post.set_tags(["red"]) == (1, 0)
+        session.commit()
+        assert post.get_tag_nicenames() == ["red"]
+
+    def test_counts_dropped_on_commit(self, session, client):
+        """ The cached tag counts are dropped once the new tags commit. """
+        post = add_set_terms_records(session)
+        key = term_counts_key(Tag, "SetTerms")
+        before = post.get_tag_nicenames()
+        Tag.post_counts("SetTerms")
+
+        post.set_tags([] if "blue" in before else ["blue"])
+        assert cache.get(key) is not None
+        session.commit()
+        assert cache.get(key) is None
+
+        post.set_tags(before)
+        session.commit()
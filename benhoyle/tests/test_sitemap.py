@@ -0,0 +1,55 @@
+import gzip
+
+from flask import url_for
+
+from benhoyle.tests.test_pagination import add_keyset_records
+
+
+class TestSitemap(object):
+
+    def test_single_sitemap(self, session, client):
+        """ Small sites get one streamed urlset with every post. """
+        add_keyset_records(session)
+        response = client.get(url_for('blog.sitemap'))
+
+        assert response.status_code == 200
+        assert response.is_streamed
+        data = response.get_data(as_text=True)
+        assert '<urlset' in data
+        assert 'keyset-post-44' in data
+
+    def test_sitemap_index(self, app, session, client):
+        """ Large sites get an index of per subsite child sitemaps. """
+        add_keyset_records(session)
+        app.config['SITEMAP_MAX_URLS'] = 20
+        try:
+            index = client.get(url_for('blog.sitemap')).get_data(as_text=True)
+            first = client.get(
+                url_for('blog.sitemap_posts', subsite="Keyset", chunk=0)
+                ).get_data(as_text=True)
+            last = client.get(
+                url_for('blog.sitemap_posts', subsite="Keyset", chunk=2)
+                ).get_data(as_text=True)
+            missing = client.get(
+                url_for('blog.sitemap_posts', subsite="Keyset", chunk=3))
+        finally:
+            app.config['SITEMAP_MAX_URLS'] = 50000
+
+        assert '<sitemapindex' in index
+        assert url_for(
+            'blog.sitemap_posts', subsite="Keyset", chunk=2) in index
+        assert url_for('blog.sitemap_listings') in index
+        assert first.count('<url>') == 20
+        assert last.count('<url>') == 5
+        assert missing.status_code == 404
+
+    def test_gzip(self, session, client):
+        """ Clients accepting gzip get a compressed sitemap. """
+        add_keyset_records(session)
+        response = client.get(
+            url_for('blog.sitemap'),
+            headers={'Accept-Encoding': 'gzip'}
+            )
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert b'<urlset' in gzip.decompress(response.get_data())
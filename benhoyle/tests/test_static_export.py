@@ -0,0 +1,76 @@
+import datetime
+import os
+
+from flask import url_for
+
+from benhoyle.blueprints.blog import static_export
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.tests.test_pagination import add_keyset_records
+
+
+def export(app, client, root):
+    """
+    Export the site to root incrementally, in process.
+
+    :return: List of the urls written
+    """
+    pages = static_export.site_pages()
+    manifest = static_export.load_manifest(root)
+    stale, removed = static_export.changed_pages(pages, manifest)
+    app.config['STATIC_EXPORT'] = True
+    try:
+        for url in stale:
+            url, status = static_export.render_page(client, root, url)
+            assert status == 200
+            manifest[url] = dict(pages)[url]
+    finally:
+        app.config['STATIC_EXPORT'] = False
+    for url in removed:
+        manifest.pop(url)
+    static_export.save_manifest(root, manifest)
+    return stale
+
+
+class TestStaticExport(object):
+
+    def test_output_path(self):
+        """ Pages become index files, files keep their names. """
+        assert static_export.output_path('/out', '/') == \
+            '/out/index.html'
+        assert static_export.output_path('/out', '/Keyset/posts') == \
+            '/out/Keyset/posts/index.html'
+        assert static_export.output_path('/out', '/sitemap.xml') == \
+            '/out/sitemap.xml'
+        assert static_export.output_path('/out', '/WXR%20Again/tags') == \
+            '/out/WXR Again/tags/index.html'
+
+    def test_export(self, app, session, client, tmpdir):
+        """ Every public page is written, then only what changed. """
+        add_keyset_records(session)
+        root = str(tmpdir)
+
+        written = export(app, client, root)
+
+        assert url_for('blog.post', subsite="Keyset",
+                       nicename="keyset-post-0") in written
+        assert os.path.exists(os.path.join(root, 'sitemap.xml'))
+        with open(os.path.join(
+            root, 'Keyset', 'posts', 'index.html'
+        )) as f:
+            wall = f.read()
+        # Static files cannot be served by query string
+        assert '/Keyset/posts/page/2' in wall
+        assert 'after=' not in wall
+
+        assert export(app, client, root) == []
+
+        post = Post.query.filter(Post.nicename == "keyset-post-44").one()
+        post.date_updated = datetime.datetime.now()
+        session.commit()
+        written = export(app, client, root)
+
+        assert url_for('blog.post', subsite="Keyset",
+                       nicename="keyset-post-44") in written
+        assert url_for('blog.post', subsite="Keyset",
+                       nicename="keyset-post-0") not in written
+        assert url_for('blog.sitemap') in written
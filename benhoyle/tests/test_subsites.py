@@ -0,0 +1,72 @@
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.blueprints.blog.subsites import subsites, SubsiteRegistry
+from benhoyle.tests.test_queries import count_queries
+
+
+def selects(statements):
+    return [s for s in statements if s.startswith('SELECT')]
+
+
+class TestSubsiteRegistry(object):
+
+    def test_registry_invalidated_by_post_writes(self, session):
+        """ New and deleted subsites are picked up after a post write. """
+        subsites.load()
+        assert "Registry" not in subsites
+
+        post = Post(
+            display_title="Registry Post",
+            nicename="registry-post",
+            content="Registry content",
+            status="draft",
+            subsite="Registry"
+            )
+        session.add(post)
+        session.commit()
+        assert "Registry" in subsites
+
+        session.delete(post)
+        session.commit()
+        assert "Registry" not in subsites
+
+    def test_registry_shared_between_workers(self, session, db):
+        """ A post write in one worker reloads the others' registries, and
+        so does invalidate after a bulk insert. """
+        other = SubsiteRegistry()
+        other.load()
+        assert "Elsewhere" not in other
+
+        post = Post(
+            display_title="Elsewhere Post",
+            nicename="elsewhere-post",
+            status="draft",
+            subsite="Elsewhere"
+            )
+        session.add(post)
+        session.commit()
+        assert "Elsewhere" in other
+
+        session.execute(Post.__table__.insert().values(
+            display_title="Bulk Post", nicename="bulk-post",
+            status="draft", subsite="Bulk"))
+        session.commit()
+        assert "Bulk" not in other
+        subsites.invalidate()
+        assert "Bulk" in other
+
+        session.execute(Post.__table__.delete().where(
+            Post.__table__.c.subsite == "Bulk"))
+        session.delete(post)
+        session.commit()
+        subsites.invalidate()
+
+    def test_registry_loads_once(self, session, db):
+        """ Membership checks do not query once the registry is loaded. """
+        subsites.load()
+        with count_queries(db) as statements:
+            names = subsites.names
+            for name in names:
+                assert name in subsites
+            assert "Nowhere" not in subsites
+            assert subsites.default == names[0]
+        assert selects(statements) == []
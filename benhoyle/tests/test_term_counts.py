@@ -0,0 +1,93 @@
+from flask import url_for
+
+from benhoyle.extensions import cache
+from benhoyle.blueprints.blog.models import (
+    Post, Tag, Category, term_counts_key
+    )
+from benhoyle.blueprints.blog.subsites import subsites
+from benhoyle.tests.test_feeds import add_feed_records
+from benhoyle.tests.test_queries import count_queries
+
+
+class TestTermCounts(object):
+
+    def test_counts_in_one_query(self, db, session, client):
+        """ Counts of published posts come from one query, then the
+        cache. """
+        add_feed_records(session)
+        session.add(Tag(
+            nicename="unusedtag", display_name="Unused Tag", subsite="Feed"))
+        session.commit()
+
+        with count_queries(db) as statements:
+            counts = Tag.post_counts("Feed")
+            Tag.post_counts("Feed")
+
+        assert len(statements) == 1
+        assert [(c.nicename, c.count) for c in counts] == [
+            ('feedtag', 12), ('unusedtag', 0)
+            ]
+        assert Category.post_counts("Feed")[0].count == 12
+
+    def test_counts_follow_tagging(self, session, client):
+        """ Tagging and unpublishing change the cached counts. """
+        add_feed_records(session)
+        tag = Tag.query.filter(Tag.nicename == "feedtag").one()
+        post = Post.query.filter(Post.nicename == "feed-post-0").one()
+        before = Tag.post_counts("Feed")[0].count
+
+        post.tag(tag)
+        session.commit()
+        assert Tag.post_counts("Feed")[0].count == before + 1
+
+        post.status = "draft"
+        session.commit()
+        assert Tag.post_counts("Feed")[0].count == before
+
+        post.status = "publish"
+        post.untag(tag)
+        session.commit()
+        assert Tag.post_counts("Feed")[0].count == before
+
+    def test_counts_dropped_on_commit(self, session, client):
+        """ The cached counts are dropped once a change commits, and kept
+        when it is rolled back. """
+        add_feed_records(session)
+        key = term_counts_key(Tag, "Feed")
+        Tag.post_counts("Feed")
+        post = Post.query.filter(Post.nicename == "feed-post-0").one()
+
+        post.status = "draft"
+        session.flush()
+        assert cache.get(key) is not None
+        session.rollback()
+        assert cache.get(key) is not None
+
+        post.status = "draft"
+        session.commit()
+        assert cache.get(key) is None
+
+        post.status = "publish"
+        session.commit()
+
+    def test_listing_pages(self, db, session, client):
+        """ The tags page and JSON need no query per tag. """
+        add_feed_records(session)
+        subsites.load()
+        for i in range(10):
+            session.add(Tag(
+                nicename="many{0}".format(i),
+                display_name="Many {0}".format(i),
+                subsite="Feed"
+                ))
+        session.commit()
+
+        with count_queries(db) as statements:
+            page = client.get(url_for('blog.show_tags', subsite="Feed"))
+        data = client.get(url_for('blog.tag_counts', subsite="Feed")).json
+
+        assert page.status_code == 200
+        assert len(statements) <= 3
+        assert {
+            'nicename': 'feedtag', 'display_name': 'Feed Tag', 'count': 12
+            } in data['tags']
@@ -0,0 +1,90 @@
+import datetime
+
+from flask import url_for
+
+from benhoyle.blueprints.blog.models import Post, Tag, Category
+from benhoyle.tests.test_queries import count_queries
+
+
+def add_wall_records(session, count=25):
+    """
+    Add posts to the "Walls" subsite, all with the tag "walltag" and the
+    category "wallcat", every other one with an excerpt.
+
+    :param session: DB session
+    :return: None
+    """
+    if Post.query.filter(Post.subsite == "Walls").count():
+        return None
+    tag = Tag(nicename="walltag", display_name="Wall Tag", subsite="Walls")
+    category = Category(
+        nicename="wallcat", display_name="Wall Cat", subsite="Walls")
+    session.add_all([tag, category])
+    start = datetime.datetime(2016, 1, 1)
+    for i in range(count):
+        post = Post(
+            display_title="Wall Post {0}".format(i),
+            nicename="wall-post-{0}".format(i),
+            content="First line {0}\r\n{1}BODYTEXT".format(
+                i, "word " * 100),
+            excerpt="Excerpt {0}".format(i) if i % 2 else "",
+            date_published=start + datetime.timedelta(days=i),
+            date_updated=start + datetime.timedelta(days=i),
+            status="publish",
+            subsite="Walls"
+            )
+        session.add(post)
+        post.tags.append(tag)
+        post.categories.append(category)
+    session.commit()
+    return None
+
+
+class TestTermWalls(object):
+
+    def test_listing(self, session):
+        """ The listing excerpt is the stored one. """
+        add_wall_records(session)
+        posts = Post.query.filter(Post.subsite == "Walls").all()
+        excerpts = dict(
+            (row.id, row.excerpt_text)
+            for row in Post.listing(Post.subsite == "Walls")
+            )
+        for post in posts:
+            assert excerpts[post.id] == post.get_excerpt()
+
+    def test_tag_wall(self, client, session, db):
+        """ Tag walls are paginated and never load post bodies. """
+        add_wall_records(session)
+        with count_queries(db) as statements:
+            page = client.get(url_for(
+                'blog.tag_postwall', subsite="Walls", tag_nicename="walltag"))
+        assert page.status_code == 200
+        body = page.get_data(as_text=True)
+        assert 'Wall Post 24' in body
+        assert 'Wall Post 4<' not in body
+        assert 'Excerpt 23' in body
+        assert 'First line 24 word word' in body
+        assert 'BODYTEXT' not in body
+        assert '1 of 2' in body
+        assert not any('post.content' in s for s in statements)
+
+        page = client.get(url_for(
+            'blog.tag_postwall', subsite="Walls", tag_nicename="walltag",
+            page=2))
+        body = page.get_data(as_text=True)
+        assert 'Wall Post 4<' in body
+        assert 'Wall Post 5<' not in body
+
+    def test_category_wall(self, client, session):
+        add_wall_records(session)
+        page = client.get(url_for(
+            'blog.category_postwall', subsite="Walls",
+            category_nicename="wallcat", page=2))
+        assert page.status_code == 200
+        assert '2 of 2' in page.get_data(as_text=True)
+
+        page = client.get(url_for(
+            'blog.category_postwall', subsite="Walls",
+            category_nicename="missing"))
+        assert page.status_code == 404
@@ -0,0 +1,125 @@
+import io
+
+from benhoyle.blueprints.blog.models import Post, Tag, Category, Author
+from benhoyle.blueprints.blog.search import SearchResults
+from benhoyle.blueprints.blog.wxr import WXRImporter, parse
+
+WXR = (
+    '<?xml version="1.0" encoding="UTF-8" ?>\n'
+    '<rss version="2.0"\n'
+    '    xmlns:excerpt="http://wordpress.org/export/1.2/excerpt/"\n'
+    '    xmlns:content="http://purl.org/rss/1.0/modules/content/"\n'
+    '    xmlns:dc="http://purl.org/dc/elements/1.1/"\n'
+    '    xmlns:wp="http://wordpress.org/export/1.2/">\n'
+    '<channel>\n'
+    '    <title>Imported Blog</title>\n'
+    '    <wp:author>\n'
+    '        <wp:author_login>importer</wp:author_login>\n'
+    '        <wp:author_display_name>'
+    '<![CDATA[Import Author]]></wp:author_display_name>\n'
+    '    </wp:author>\n'
+    '    <wp:category>\n'
+    '        <wp:category_nicename>child</wp:category_nicename>\n'
+    '        <wp:category_parent>parent</wp:category_parent>\n'
+    '        <wp:cat_name><![CDATA[Child]]></wp:cat_name>\n'
+    '    </wp:category>\n'
+    '    <wp:category>\n'
+    '        <wp:category_nicename>parent</wp:category_nicename>\n'
+    '        <wp:category_parent></wp:category_parent>\n'
+    '        <wp:cat_name><![CDATA[Parent]]></wp:cat_name>\n'
+    '    </wp:category>\n'
+    '    <wp:tag>\n'
+    '        <wp:tag_slug>wxr-tag</wp:tag_slug>\n'
+    '        <wp:tag_name><![CDATA[WXR Tag]]></wp:tag_name>\n'
+    '    </wp:tag>\n'
+    '    {items}\n'
+    '</channel>\n'
+    '</rss>\n'
+    )
+
+ITEM = (
+    '<item>\n'
+    '        <title>Imported Post {0}</title>\n'
+    '        <dc:creator><![CDATA[importer]]></dc:creator>\n'
+    '        <content:encoded>'
+    '<![CDATA[Imported post about gooseberries {0}]]></content:encoded>\n'
+    '        <excerpt:encoded><![CDATA[Excerpt {0}]]></excerpt:encoded>\n'
+    '        <wp:post_date>2015-03-0{1} 12:00:00</wp:post_date>\n'
+    '        <wp:post_modified>2015-03-0{1} 13:00:00</wp:post_modified>\n'
+    '        <wp:post_name>imported-post-{0}</wp:post_name>\n'
+    '        <wp:status>{2}</wp:status>\n'
+    '        <wp:post_type>{3}</wp:post_type>\n'
+    '        <category domain="category" nicename="child">'
+    '<![CDATA[Child]]></category>\n'
+    '        <category domain="post_tag" nicename="wxr-tag">'
+    '<![CDATA[WXR Tag]]></category>\n'
+    '        <category domain="post_tag" nicename="new-tag">'
+    '<![CDATA[New Tag]]></category>\n'
+    '    </item>'
+    )
+
+
+def export(count=5):
+    """
+    Build a small WXR export.
+
+    :param count: Number of published posts
+    :return: File object
+    """
+    items = [
+        ITEM.format(i, i % 9 + 1, 'publish', 'post') for i in range(count)
+        ]
+    items.append(ITEM.format('draft', 1, 'draft', 'post'))
+    items.append(ITEM.format('trashed', 1, 'trash', 'post'))
+    items.append(ITEM.format('page', 1, 'publish', 'page'))
+    return io.BytesIO(WXR.format(items='\n'.join(items)).encode('utf-8'))
+
+
+class TestWXRImport(object):
+
+    def test_parse(self):
+        """ Authors, terms and posts are read from the export. """
+        kinds = [kind for kind, item in parse(export(2))]
+        posts = [item for kind, item in parse(export(2)) if kind == 'post']
+
+        assert kinds[:4] == ['author', 'category', 'category', 'tag']
+        assert kinds.count('post') == 5
+        assert posts[0]['content'] == "Imported post about gooseberries 0"
+        assert posts[0]['excerpt'] == "Excerpt 0"
+        assert posts[0]['tags'] == [
+            ('wxr-tag', 'WXR Tag'), ('new-tag', 'New Tag')]
+
+    def test_import(self, session):
+        """ Posts are imported with their relations in batches. """
+        counts = WXRImporter("WXR", batch_size=2).run(export())
+
+        assert counts == dict(
+            posts=6, skipped=1, tags=2, categories=2, authors=1)
+        post = Post.query.filter(
+            Post.subsite == "WXR").filter(
+                Post.nicename == "imported-post-3").one()
+        assert post.status == "publish"
+        assert post.date_published_month == 3
+        assert post.content_html == \
+            "<p>Imported post about gooseberries 3</p>"
+        assert sorted(post.get_tag_nicenames()) == ['new-tag', 'wxr-tag']
+        assert post.get_category_nicenames() == ['child']
+        assert [a.login for a in post.author_list] == ['importer']
+        categories = Category.query.filter(Category.subsite == "WXR")
+        child = categories.filter(Category.nicename == "child").one()
+        parent = categories.filter(Category.nicename == "parent").one()
+        assert child.parent == parent.id
+        assert Post.query.filter(
+            Post.nicename == "imported-post-draft").one().status == "draft"
+        assert len(SearchResults("WXR", "gooseberries", 20).items) == 5
+
+    def test_import_again_skips_existing(self, session):
+        """ Rerunning an import adds nothing twice. """
+        WXRImporter("WXR Again").run(export(3))
+        counts = WXRImporter("WXR Again").run(export(3))
+
+        assert counts['posts'] == 0
+        assert counts['tags'] == 0
+        assert Post.query.filter(Post.subsite == "WXR Again").count() == 4
+        assert Tag.query.filter(Tag.subsite == "WXR Again").count() == 2
+        assert Author.query.filter(Author.login == "importer").count() == 1
@@ -0,0 +1,131 @@
+import json
+
+import click
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db
+from benhoyle.blueprints.blog import bench
+
+# Create an app context for the benchmark database, not the site's.
+app = create_app(settings_override=bench.BENCH_SETTINGS)
+db.app = app
+
+
+@click.group()
+def cli():
+    """ Seed a synthetic database and measure the blog's routes. """
+    pass
+
+
+@click.command()
+@click.option('--posts', default=1000, help='Posts per subsite.')
+@click.option('--tags', default=200, help='Tags per subsite.')
+@click.option('--categories', default=20, help='Categories per subsite.')
+@click.option('--subsites', default=1, help='Number of subsites.')
+@click.option('--content-words', default=600,
+              help='Typical number of words in a post.')
+@click.option('--random-seed', default=0,
+              help='Seed, the same seed gives the same database.')
+def seed(posts, tags, categories, subsites, content_words, random_seed):
+    """
+    Replace the benchmark database with synthetic posts.
+
+    :return: None
+    """
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        names = bench.seed(
+            posts, tags, categories, subsites, content_words, random_seed)
+
+    click.echo("Seeded {0} with {1} posts each.".format(
+        ', '.join(names), posts))
+
+    return None
+
+
+@click.command()
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Write the results to this JSON file.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Results of an earlier run to compare with.')
+@click.option('--threshold', default=0.1,
+              help='Flag changes larger than this fraction.')
+@click.option('--target', type=click.Choice(['client', 'gunicorn']),
+              default='client',
+              help='Measure through the test client or a local gunicorn.')
+@click.option('--subsite', default='Bench1', help='Subsite to measure.')
+@click.option('--requests', default=100, help='Timed requests per route.')
+@click.option('--warmup', default=5, help='Untimed requests per route.')
+@click.option('--concurrency', default=1,
+              help='Requests made at once, with --target gunicorn.')
+@click.option('--workers', default=2,
+              help='gunicorn workers, with --target gunicorn.')
+@click.option('--port', default=8001,
+              help='Local port for gunicorn, with --target gunicorn.')
+@click.option('--cache/--no-cache', default=True,
+              help='Serve anonymous pages from the page cache.')
+def run(output, baseline, threshold, target, subsite, requests, warmup,
+        concurrency, workers, port, cache):
+    """
+    Measure the throughput and latency of every public route.
+
+    Exits with status 1 if any route is slower than the baseline by more
+    than the threshold.
+
+    :return: None
+    """
+    overrides = {} if cache else {'CACHE_TYPE': 'null'}
+    measured = app
+    if overrides:
+        measured = create_app(
+            settings_override=dict(bench.BENCH_SETTINGS, **overrides))
+    with measured.test_request_context():
+        pages = bench.routes(subsite)
+
+    process = None
+    if target == 'gunicorn':
+        process, base_url = bench.start_gunicorn(port, workers, overrides)
+        get = bench.http_getter(base_url)
+    else:
+        concurrency = 1
+        get = bench.client_getter(measured.test_client())
+    try:
+        with measured.app_context():
+            results = bench.run(get, pages, requests, warmup, concurrency)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = bench.report(
+        results, target=target, subsite=subsite, requests=requests,
+        concurrency=concurrency, workers=workers if process else None,
+        cache=cache
+        )
+    for name, result in sorted(results.items()):
+        click.echo(
+            "{0:<20} {1:>9.1f} req/s  p50 {2:>8.2f}ms  p99 {3:>8.2f}ms"
+            "{4}".format(
+                name, result['rps'], result['p50_ms'], result['p99_ms'],
+                "  {0} errors".format(result['errors'])
+                if result['errors'] else ''
+                ))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = bench.compare(json.load(f), report, threshold)
+        for route, key, old, new, change in regressions:
+            click.echo("Regression: {0} {1} {2} -> {3} ({4:+.0%})".format(
+                route, key, old, new, change))
+        if regressions:
+            raise SystemExit(1)
+
+    return None
+
+
+cli.add_command(seed)
+cli.add_command(run)
@@ -5,6 +5,7 @@ from sqlalchemy_utils import database_exists, create_database
 from benhoyle.app import create_app
 from benhoyle.extensions import db
 from benhoyle.blueprints.blog.models import Author
+from benhoyle.blueprints.blog.migrations import upgrade as upgrade_schema
 
 # Create an app context for the database connection.
 app = create_app()
@@ -89,7 +90,7 @@ def show_authors():
     click.echo("Blog authors registered in the system:")
 
     for author in Author.query.all():
-        click.echo("{0}".format(author)
+        click.echo("{0}".format(author))
 
     return None
 
@@ -117,8 +118,27 @@ def reset_password(login, password):
     return None
 
 
+@click.command()
+def upgrade():
+    """
+    Add missing tables, columns and indexes to an existing database.
+
+    :return: None
+    """
+    steps = upgrade_schema()
+
+    if not steps:
+        click.echo("Database is up to date.")
+
+    for step, outcome in steps:
+        click.echo("{0}: {1}".format(step, outcome))
+
+    return None
+
+
 cli.add_command(init)
 cli.add_command(seed)
 cli.add_command(reset_db)
 cli.add_command(show_authors)
 cli.add_command(reset_password)
+cli.add_command(upgrade)
@@ -0,0 +1,41 @@
+import click
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db, cache
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.blueprints.blog.migrations import backfill_excerpts
+
+# Create an app context for the database connection.
+app = create_app()
+db.app = app
+
+
+@click.command()
+@click.option('--force/--no-force', default=False,
+              help='Remake excerpts that are already stored?')
+@click.option('--batch-size', default=500,
+              help='Posts read and written per batch.')
+def cli(force, batch_size):
+    """
+    Make the stored plain text and HTML excerpts of posts.
+
+    Excerpts are made whenever a post is saved, so this is only needed
+    for posts saved before they were stored, which db upgrade also fills
+    in, or with --force after changing how excerpts are made.
+
+    :param force: Remake every post's excerpts
+    :param batch_size: Posts per batch
+    :return: None
+    """
+    with app.app_context():
+        with db.engine.begin() as connection:
+            updated = backfill_excerpts(connection, force, batch_size)
+        count = db.session.query(Post.id).count()
+        if updated:
+            # Bulk updates bypass the model events that evict cached pages
+            cache.clear()
+
+    click.echo("Made the excerpts of {0} of {1} posts.".format(
+        updated, count))
+
+    return None
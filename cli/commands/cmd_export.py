@@ -0,0 +1,82 @@
+import os
+from multiprocessing import Pool
+
+import click
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db
+from benhoyle.blueprints.blog import static_export
+
+# Create an app context for the database connection.
+app = create_app(settings_override=static_export.EXPORT_SETTINGS)
+db.app = app
+
+
+@click.command()
+@click.argument('output', type=click.Path(file_okay=False))
+@click.option('--base-url', default='http://localhost/',
+              help='Scheme and host the exported site is served from.')
+@click.option('--incremental/--full', default=True,
+              help='Only rewrite pages whose posts changed since the last '
+                   'export?')
+@click.option('--processes', default=None, type=int,
+              help='Worker processes, defaults to the number of CPUs.')
+def cli(output, base_url, incremental, processes):
+    """
+    Export every public page to static files under OUTPUT.
+
+    Pages are rendered by the app's own views and templates, as an
+    anonymous reader would see them, across a pool of worker processes.
+    An incremental export rewrites only pages whose posts were added,
+    updated (by date_updated) or removed since the last export, and
+    deletes the pages of unpublished posts. Use --full after renaming tags
+    or categories or changing templates.
+
+    :param output: Output directory
+    :param base_url: Base URL of the exported site
+    :param incremental: Only rewrite changed pages
+    :param processes: Number of worker processes
+    :return: None
+    """
+    with app.test_request_context(base_url=base_url):
+        pages = static_export.site_pages()
+
+    manifest = static_export.load_manifest(output)
+    stale, removed = static_export.changed_pages(pages, manifest)
+    if not incremental:
+        stale = [url for url, version in pages]
+
+    # Workers open their own connections
+    db.session.remove()
+    db.engine.dispose()
+
+    versions = dict(pages)
+    written = 0
+    with Pool(
+        processes,
+        initializer=static_export.init_worker,
+        initargs=(output, base_url)
+    ) as pool:
+        for url, status in pool.imap_unordered(
+            static_export.render_in_worker, stale, chunksize=16
+        ):
+            if status == 200:
+                manifest[url] = versions[url]
+                written += 1
+            else:
+                click.echo("{0}: {1}".format(url, status))
+
+    for url in removed:
+        path = static_export.output_path(output, url)
+        if os.path.exists(path):
+            os.remove(path)
+        manifest.pop(url, None)
+
+    static_export.save_manifest(output, manifest)
+
+    click.echo(
+        "Wrote {0} of {1} pages, removed {2}.".format(
+            written, len(pages), len(removed))
+        )
+
+    return None
@@ -0,0 +1,44 @@
+import click
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db, cache
+from benhoyle.blueprints.blog.subsites import subsites
+from benhoyle.blueprints.blog.wxr import WXRImporter
+
+# Create an app context for the database connection.
+app = create_app()
+db.app = app
+
+
+@click.command()
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--subsite', required=True,
+              help='Subsite to import the posts into.')
+@click.option('--batch-size', default=1000,
+              help='Posts written per transaction.')
+def cli(path, subsite, batch_size):
+    """
+    Import a WordPress WXR export into a subsite.
+
+    The export is streamed, so its size is not limited by memory. Posts
+    already in the subsite are skipped. Nothing else should add posts
+    while the import runs.
+
+    :param path: Path of the WXR file
+    :param subsite: Subsite to import into
+    :param batch_size: Posts per transaction
+    :return: None
+    """
+    with app.app_context():
+        counts = WXRImporter(subsite, batch_size).run(path)
+        # Bulk inserts bypass the model events that evict cached pages
+        # and post counts and tell running workers about new subsites
+        cache.clear()
+        subsites.invalidate()
+
+    click.echo(
+        "Imported {posts} posts, skipped {skipped}, added {tags} tags, "
+        "{categories} categories and {authors} authors.".format(**counts)
+        )
+
+    return None
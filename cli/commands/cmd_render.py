@@ -0,0 +1,84 @@
+from functools import partial
+from multiprocessing import Pool
+
+import click
+
+from sqlalchemy import bindparam
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db, cache
+from benhoyle.blueprints.blog.models import PostBody
+from benhoyle.blueprints.blog.rendering import render_row
+
+# Create an app context for the database connection.
+app = create_app()
+db.app = app
+
+
+def chunks(items, size):
+    """
+    Split a list into consecutive chunks.
+
+    :param items: List to split
+    :param size: Maximum chunk size
+    :return: Generator of lists
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@click.command()
+@click.option('--force/--no-force', default=False,
+              help='Re-render posts whose stored HTML is current?')
+@click.option('--processes', default=None, type=int,
+              help='Worker processes, defaults to the number of CPUs.')
+@click.option('--batch-size', default=500,
+              help='Posts read and written per transaction.')
+def cli(force, processes, batch_size):
+    """
+    Re-render the stored HTML of every post in parallel.
+
+    Run after changing the content renderer. Posts whose stored content
+    hash is current are skipped unless --force is given.
+
+    :param force: Re-render every post
+    :param processes: Number of worker processes
+    :param batch_size: Posts per batch
+    :return: None
+    """
+    table = PostBody.__table__
+    update = table.update().where(
+        table.c.post_id == bindparam('b_id')).values(
+            content_html=bindparam('content_html'),
+            content_hash=bindparam('content_hash')
+            )
+    renderer = partial(render_row, force=force)
+
+    with app.app_context():
+        ids = [
+            row[0] for row in
+            db.session.query(PostBody.post_id).order_by(PostBody.post_id)
+            ]
+        rendered = 0
+
+        with Pool(processes) as pool:
+            for batch in chunks(ids, batch_size):
+                rows = db.session.query(
+                    PostBody.post_id, PostBody.content,
+                    PostBody.content_hash).filter(
+                        PostBody.post_id.in_(batch)).all()
+                values = [
+                    row for row in pool.map(renderer, rows)
+                    if row is not None
+                    ]
+                if values:
+                    db.session.execute(update, values)
+                    db.session.commit()
+                rendered += len(values)
+        if rendered:
+            # Bulk updates bypass the model events that evict cached pages
+            cache.clear()
+
+        click.echo("Rendered {0} of {1} posts.".format(rendered, len(ids)))
+
+    return None
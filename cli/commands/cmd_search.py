@@ -0,0 +1,32 @@
+import click
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db
+from benhoyle.blueprints.blog.models import Post
+from benhoyle.blueprints.blog import search
+
+# Create an app context for the database connection.
+app = create_app()
+db.app = app
+
+
+@click.command()
+def cli():
+    """
+    Rebuild the full text search index of posts from scratch.
+
+    The index is kept up to date by triggers on the post table, so this is
+    only needed after editing the database outside of SQLite or changing
+    how the index is defined.
+
+    :return: None
+    """
+    with app.app_context():
+        with db.engine.begin() as connection:
+            search.drop_index(connection)
+            search.rebuild_index(connection)
+        count = db.session.query(Post.id).count()
+
+    click.echo("Indexed {0} posts.".format(count))
+
+    return None
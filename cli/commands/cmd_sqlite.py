@@ -0,0 +1,92 @@
+import click
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db, cache
+from benhoyle import pragmas
+from benhoyle.replicas import replicate as copy_database
+
+# Create an app context for the database connection.
+app = create_app()
+db.app = app
+
+
+@click.group()
+def cli():
+    """ Inspect and maintain the SQLite database. """
+    pass
+
+
+@click.command()
+def status():
+    """
+    Show the pragmas in effect on a new connection, as set from
+    SQLITE_PRAGMAS, and the size of the database and its write-ahead log.
+
+    :return: None
+    """
+    with app.app_context():
+        with db.engine.connect() as connection:
+            report = pragmas.status(connection)
+
+    width = max(len(name) for name, value in report)
+    for name, value in report:
+        click.echo('{0:<{1}}  {2}'.format(name, width, value))
+
+    return None
+
+
+@click.command()
+@click.option('--mode', default='TRUNCATE',
+              type=click.Choice(pragmas.CHECKPOINT_MODES),
+              help='Checkpoint mode.')
+def maintain(mode):
+    """
+    Run PRAGMA optimize and checkpoint the write-ahead log now, rather than
+    waiting for the workers to.
+
+    :param mode: Checkpoint mode, TRUNCATE also empties the log file
+    :return: None
+    """
+    with app.app_context():
+        with db.engine.connect() as connection:
+            pragmas.optimize(connection)
+            result = pragmas.checkpoint(connection, mode)
+
+    if result is None:
+        click.echo('Optimized, the database is not in WAL mode.')
+    else:
+        click.echo(
+            'Optimized, checkpointed {0} of {1} log pages{2}.'.format(
+                result[2], result[1], ' (blocked)' if result[0] else ''))
+
+    return None
+
+
+@click.command()
+def replicate():
+    """
+    Copy the database over each SQLite read replica in
+    SQLALCHEMY_READ_URIS. Run it from cron as often as readers may lag.
+
+    Pages and counts cached since the last copy may have been built from
+    a replica that did not yet have the latest saves, so the cache is
+    cleared once every replica is current.
+
+    :return: None
+    """
+    uris = app.config['SQLALCHEMY_READ_URIS']
+    if not uris:
+        click.echo('No read replicas are configured.')
+        return None
+    for uri in uris:
+        pages = copy_database(app.config['SQLALCHEMY_DATABASE_URI'], uri)
+        click.echo('Copied {0} pages to {1}.'.format(pages, uri))
+    with app.app_context():
+        cache.clear()
+
+    return None
+
+
+cli.add_command(status)
+cli.add_command(maintain)
+cli.add_command(replicate)
@@ -0,0 +1,81 @@
+import click
+
+from benhoyle.app import create_app
+from benhoyle.extensions import db
+from benhoyle.blueprints.blog.models import Tag, Category
+from benhoyle.blueprints.blog import services
+
+# Create an app context for the database connection.
+app = create_app()
+db.app = app
+
+KINDS = {'tag': Tag, 'category': Category}
+
+
+@click.group()
+def cli():
+    """ Merge and delete tags and categories. """
+    pass
+
+
+@click.command()
+@click.argument('kind', type=click.Choice(sorted(KINDS)))
+@click.argument('nicenames', nargs=-1, required=True)
+@click.option('--subsite', required=True, help='Subsite of the terms.')
+def delete(kind, nicenames, subsite):
+    """
+    Delete tags or categories and remove them from their posts.
+
+    :param kind: tag or category
+    :param nicenames: Nicenames of the terms
+    :param subsite: Subsite of the terms
+    :return: None
+    """
+    with app.app_context():
+        deleted, removed = services.delete_terms(
+            KINDS[kind], subsite, list(nicenames))
+
+    click.echo("Deleted {0} of {1}, removed from {2} posts.".format(
+        deleted, len(nicenames), removed))
+
+    return None
+
+
+@click.command()
+@click.argument('kind', type=click.Choice(sorted(KINDS)))
+@click.argument('nicenames', nargs=-1, required=True)
+@click.option('--subsite', required=True, help='Subsite of the terms.')
+@click.option('--name', default=None,
+              help='Display name of the merged term.')
+@click.option('--delete-old/--keep-old', default=False,
+              help='Delete the merged terms afterwards?')
+def merge(kind, nicenames, subsite, name, delete_old):
+    """
+    Add a new tag or category to every post with any of the given ones.
+
+    :param kind: tag or category
+    :param nicenames: Nicenames of the terms to merge
+    :param subsite: Subsite of the terms
+    :param name: Display name of the new term
+    :param delete_old: Delete the merged terms
+    :return: None
+    """
+    model = KINDS[kind]
+    with app.app_context():
+        try:
+            new_term, added = services.merge_terms(
+                model, subsite, list(nicenames), name)
+        except ValueError as error:
+            raise click.UsageError(str(error))
+        click.echo("Added {0} to {1} posts.".format(new_term.nicename, added))
+
+        if delete_old:
+            deleted, removed = services.delete_terms(
+                model, subsite, list(nicenames))
+            click.echo("Deleted {0} old terms.".format(deleted))
+
+    return None
+
+
+cli.add_command(delete)
+cli.add_command(merge)
@@ -12,6 +12,78 @@ SQLALCHEMY_DATABASE_URI  = (
     'sqlite:///' + BASE_DIR + '/instance/db/website.db'
     )
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Read engines, e.g. copies of the SQLite file kept current by
+# "sqlite replicate" or Postgres replicas. Public GET requests read from
+# them; writes, author pages and an author's requests for
+# SQLALCHEMY_READ_STICKY_SECONDS after a save use the primary. Clear the
+# cache after each replication, as "sqlite replicate" does, so pages built
+# from a lagging replica are not kept.
+SQLALCHEMY_READ_URIS = []
+SQLALCHEMY_READ_STICKY_SECONDS = 30
+
+# SQLite.
+# Set on every new connection: the write-ahead log lets readers carry on
+# while an author saves, writers wait up to busy_timeout milliseconds for
+# each other, and reads go through a memory map of up to mmap_size bytes.
+# A negative cache_size is in KiB, per connection.
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,
+    'temp_store': 'memory'
+    }
+# Seconds between each worker's PRAGMA optimize and WAL checkpoints, 0 to
+# turn them off. A TRUNCATE checkpoint also shrinks the WAL file but
+# waits for readers.
+SQLITE_OPTIMIZE_INTERVAL = 3600
+SQLITE_CHECKPOINT_INTERVAL = 300
+SQLITE_CHECKPOINT_MODE = 'PASSIVE'
+
+# Cache.
+# 'benhoyle.cache_backends.shared' keeps the cache in a SQLite file under
+# CACHE_DIR that every gunicorn worker on the host shares, or in Redis (or
+# a local Redis compatible server) when CACHE_REDIS_URL is set, which needs
+# the optional redis package in requirements.txt. Use 'simple' for a
+# per-process cache.
+CACHE_TYPE = 'benhoyle.cache_backends.shared'
+CACHE_DIR = BASE_DIR + '/instance/cache'
+CACHE_REDIS_URL = None
+CACHE_DEFAULT_TIMEOUT = 300
+# Maximum number of entries and total bytes before LRU eviction
+CACHE_THRESHOLD = 10000
+CACHE_OPTIONS = {'max_size': 256 * 1024 * 1024}
+
+# Sitemap.
+# Above this many URLs /sitemap.xml becomes an index of child sitemaps.
+SITEMAP_MAX_URLS = 50000
+# Gzip sitemaps for clients that accept it.
+SITEMAP_GZIP = True
+
+# Feeds.
+# Number of posts in each Atom feed.
+FEED_LENGTH = 20
+
+# Static export.
+# Set by the export command while rendering pages to files.
+STATIC_EXPORT = False
+
+# SQL instrumentation.
+# Fraction of requests whose SQL statements are counted and timed, 0 to
+# turn it off. Statements slower than SQL_SLOW_QUERY_SECONDS are logged.
+SQL_SAMPLE_RATE = 1.0
+SQL_SLOW_QUERY_SECONDS = 0.25
+
+# Metrics.
+# Samples of every worker are added up in METRICS_PATH. /metrics is only
+# served, to scrapers sending "Authorization: Bearer <METRICS_TOKEN>",
+# once METRICS_TOKEN is set in instance/settings.py.
+METRICS_ENABLED = True
+METRICS_PATH = BASE_DIR + '/instance/metrics/metrics.db'
+METRICS_TOKEN = None
+# Seconds between writes of each worker's samples to METRICS_PATH
+METRICS_FLUSH_INTERVAL = 5
 
 # Cookie Settings
 REMEMBER_COOKIE_DURATION = timedelta(days=90)